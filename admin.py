@@ -1,22 +1,61 @@
 # -*- coding: utf-8 -*-
-from django import forms
+from django.conf import settings
 from django.contrib import admin
-from django.contrib.auth.admin import UserAdmin
-from django.contrib.auth.models import User
-from django.utils.translation import ugettext_lazy as _
+from django.core.cache import cache
+from django.db.models.query import QuerySet
+from django.utils.hashcompat import md5_constructor
 
 from models import (Choice, Poll, Vote)
 
+# Number of seconds changelist row counts are cached for
+COUNT_CACHE_TIMEOUT = getattr(settings, 'POLLS_ADMIN_COUNT_CACHE_TIMEOUT',
+                              5 * 60)
 
-class ChoiceAdmin(admin.ModelAdmin):
+
+class CachedCountQuerySet(QuerySet):
+    """ QuerySet that caches the result of count().
+
+    The admin changelist counts both the filtered and the unfiltered
+    queryset on every page view, which means full scans of tables with
+    millions of rows. Counts are cached by query so that paging through
+    a changelist only runs them once in a while. The numbers shown may
+    hence be slightly out of date.
+
+    """
+    def count(self):
+        # The SQL and its parameters, as str(self.query) fails on
+        # non-ASCII parameters such as a search term
+        key = 'polls:admin-count:%s:%s' % \
+              (self.model._meta.db_table,
+               md5_constructor(repr(self.query.as_sql())).hexdigest())
+        count = cache.get(key)
+        if count is None:
+            count = super(CachedCountQuerySet, self).count()
+            cache.set(key, count, COUNT_CACHE_TIMEOUT)
+        return count
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    """ ModelAdmin for tables too large for the admin defaults. """
+
+    list_select_related = True
+
+    def queryset(self, request):
+        qs = super(LargeTableAdmin, self).queryset(request)
+        return qs._clone(klass=CachedCountQuerySet)
+
+
+class ChoiceAdmin(LargeTableAdmin):
     fields = ['poll', 'choice', 'user']
     list_display = ['poll', 'choice', 'user', 'date_created']
     search_fields = ['choice']
+    raw_id_fields = ['poll', 'user']
+    date_hierarchy = 'date_created'
 
 admin.site.register(Choice, ChoiceAdmin)
 
 
-class PollAdmin(admin.ModelAdmin):
+class PollAdmin(LargeTableAdmin):
     fields = ['title', 'description', 'user', 'allow_new_choices',
               'status', 'published_at']
     list_display = ['title', 'user', 'allow_new_choices',
@@ -24,12 +63,16 @@ class PollAdmin(admin.ModelAdmin):
                     'date_modified']
     list_filter = ['status', 'allow_new_choices']
     search_fields = ['title', 'description']
+    raw_id_fields = ['user']
+    date_hierarchy = 'date_created'
 
 admin.site.register(Poll, PollAdmin)
 
 
-class VoteAdmin(admin.ModelAdmin):
+class VoteAdmin(LargeTableAdmin):
     fields = ['user', 'choice']
     list_display = ['user', 'choice', 'date_created']
+    raw_id_fields = ['user', 'choice']
+    date_hierarchy = 'date_created'
 
 admin.site.register(Vote, VoteAdmin)
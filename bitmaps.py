@@ -0,0 +1,225 @@
+# -*- coding: utf-8 -*-
+""" Compressed bitmaps of integers, for sets of user ids.
+
+The layout follows Roaring bitmaps: the 32-bit space is split into
+chunks of 2^16 values keyed by their high 16 bits. Sparse chunks are
+stored as sorted arrays of their low 16 bits while dense chunks (more
+than `ARRAY_MAX` values) are stored as 2^16 bit bitsets, here a Python
+long. Operations between two chunks of the same key are done on whichever
+representation is cheapest and the result is converted back as needed.
+
+"""
+import base64
+import bisect
+import struct
+import sys
+import zlib
+from array import array
+
+ARRAY_MAX = 4096
+CHUNK_BITS = 1 << 16
+
+_ARRAY = 0
+_BITSET = 1
+# Chunk key, representation and length in bytes
+_HEADER = '<HBI'
+
+
+def _popcount(bits):
+    return bin(bits).count('1')
+
+
+def _to_bitset(chunk):
+    if not isinstance(chunk, array):
+        return chunk
+    bits = 0
+    for low in chunk:
+        bits |= 1 << low
+    return bits
+
+
+def _to_array(bits):
+    a = array('H')
+    low = 0
+    while bits:
+        if bits & 0xffffffff:
+            for i in range(32):
+                if (bits >> i) & 1:
+                    a.append(low + i)
+        bits >>= 32
+        low += 32
+    return a
+
+
+def _normalize(chunk):
+    """ Picks the cheapest representation for a chunk; None if empty. """
+
+    if isinstance(chunk, array):
+        if len(chunk) > ARRAY_MAX:
+            return _to_bitset(chunk)
+        return chunk or None
+    if not chunk:
+        return None
+    if _popcount(chunk) <= ARRAY_MAX:
+        return _to_array(chunk)
+    return chunk
+
+
+class RoaringBitmap(object):
+    """ A set of non-negative integers less than 2^32. """
+
+    def __init__(self, values=()):
+        self._chunks = {}
+        for value in values:
+            self.add(value)
+
+    def __contains__(self, value):
+        chunk = self._chunks.get(value >> 16)
+        if chunk is None:
+            return False
+        low = value & 0xffff
+        if isinstance(chunk, array):
+            i = bisect.bisect_left(chunk, low)
+            return i < len(chunk) and chunk[i] == low
+        return bool((chunk >> low) & 1)
+
+    def __len__(self):
+        return sum([len(chunk) if isinstance(chunk, array) else
+                    _popcount(chunk) for chunk in self._chunks.values()])
+
+    def __nonzero__(self):
+        return bool(self._chunks)
+
+    def __iter__(self):
+        for high in sorted(self._chunks):
+            chunk = self._chunks[high]
+            if not isinstance(chunk, array):
+                chunk = _to_array(chunk)
+            base = high << 16
+            for low in chunk:
+                yield base + low
+
+    def __eq__(self, other):
+        return list(self) == list(other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return 'RoaringBitmap(%r)' % list(self)
+
+    def add(self, value):
+        high, low = value >> 16, value & 0xffff
+        chunk = self._chunks.get(high)
+        if chunk is None:
+            self._chunks[high] = array('H', [low])
+        elif isinstance(chunk, array):
+            i = bisect.bisect_left(chunk, low)
+            if i == len(chunk) or chunk[i] != low:
+                chunk.insert(i, low)
+                if len(chunk) > ARRAY_MAX:
+                    self._chunks[high] = _to_bitset(chunk)
+        else:
+            self._chunks[high] = chunk | (1 << low)
+
+    def discard(self, value):
+        high, low = value >> 16, value & 0xffff
+        chunk = self._chunks.get(high)
+        if chunk is None:
+            return
+        if isinstance(chunk, array):
+            i = bisect.bisect_left(chunk, low)
+            if i < len(chunk) and chunk[i] == low:
+                del chunk[i]
+        else:
+            chunk &= ~(1 << low)
+        chunk = _normalize(chunk)
+        if chunk is None:
+            del self._chunks[high]
+        else:
+            self._chunks[high] = chunk
+
+    def _combine(self, other, op, keys):
+        result = RoaringBitmap()
+        for high in keys:
+            a = self._chunks.get(high)
+            b = other._chunks.get(high)
+            if a is None or b is None:
+                if op == 'or':
+                    chunk = a if a is not None else b
+                elif op == 'sub':
+                    chunk = a
+                else:
+                    chunk = None
+                if isinstance(chunk, array):
+                    chunk = array('H', chunk)
+            elif isinstance(a, array) and isinstance(b, array):
+                a, b = set(a), set(b)
+                values = {'or': a | b, 'and': a & b, 'sub': a - b}[op]
+                chunk = _normalize(array('H', sorted(values)))
+            else:
+                a, b = _to_bitset(a), _to_bitset(b)
+                chunk = _normalize({'or': a | b,
+                                    'and': a & b,
+                                    'sub': a & ~b}[op])
+            if chunk is not None:
+                result._chunks[high] = chunk
+        return result
+
+    def __or__(self, other):
+        keys = set(self._chunks) | set(other._chunks)
+        return self._combine(other, 'or', keys)
+
+    def __and__(self, other):
+        keys = set(self._chunks) & set(other._chunks)
+        return self._combine(other, 'and', keys)
+
+    def __sub__(self, other):
+        return self._combine(other, 'sub', set(self._chunks))
+
+    def copy(self):
+        return self | RoaringBitmap()
+
+    def dumps(self):
+        """ Serializes the bitmap into a string (see `loads`). """
+
+        parts = []
+        for high in sorted(self._chunks):
+            chunk = self._chunks[high]
+            if isinstance(chunk, array):
+                chunk = array('H', chunk)
+                if sys.byteorder == 'big':
+                    chunk.byteswap()
+                data = chunk.tostring()
+                kind = _ARRAY
+            else:
+                data = ('%0*x' % (CHUNK_BITS // 4, chunk)).decode('hex')
+                kind = _BITSET
+            parts.append(struct.pack(_HEADER, high, kind, len(data)))
+            parts.append(data)
+        return base64.b64encode(zlib.compress(''.join(parts)))
+
+    @classmethod
+    def loads(cls, data):
+        """ Deserializes a string created by `dumps`. """
+
+        bitmap = cls()
+        if not data:
+            return bitmap
+        raw = zlib.decompress(base64.b64decode(data))
+        offset = 0
+        size = struct.calcsize(_HEADER)
+        while offset < len(raw):
+            high, kind, length = struct.unpack(_HEADER,
+                                               raw[offset:offset + size])
+            data = raw[offset + size:offset + size + length]
+            offset += size + length
+            if kind == _ARRAY:
+                chunk = array('H')
+                chunk.fromstring(data)
+                if sys.byteorder == 'big':
+                    chunk.byteswap()
+            else:
+                chunk = long(data.encode('hex'), 16)
+            bitmap._chunks[high] = chunk
+        return bitmap
@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+""" Bloom filters for fast negative membership tests. """
+import math
+
+from django.utils.hashcompat import md5_constructor
+
+
+class BloomFilter(object):
+    """ A Bloom filter of integers.
+
+    `might_contain` never answers False for a value that has been added,
+    but may answer True for one that has not. The filter is sized for
+    `capacity` values at a false positive rate of `error_rate`; it keeps
+    working beyond that, only with more false positives.
+
+    """
+
+    def __init__(self, capacity=1000, error_rate=0.01):
+        capacity = max(capacity, 1)
+        self.capacity = capacity
+        self.num_bits = int(math.ceil(-capacity * math.log(error_rate) /
+                                      math.log(2) ** 2))
+        self.num_hashes = max(1, int(round(self.num_bits * math.log(2) /
+                                           capacity)))
+        self.bits = bytearray((self.num_bits + 7) // 8)
+        self.count = 0
+
+    def _positions(self, value):
+        # Double hashing, see Kirsch and Mitzenmacher, "Less Hashing,
+        # Same Performance: Building a Better Bloom Filter"
+        digest = md5_constructor(str(value)).hexdigest()
+        h1, h2 = int(digest[:16], 16), int(digest[16:], 16)
+        for i in range(self.num_hashes):
+            yield (h1 + i * h2) % self.num_bits
+
+    def add(self, value):
+        for position in self._positions(value):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def might_contain(self, value):
+        for position in self._positions(value):
+            if not self.bits[position >> 3] & (1 << (position & 7)):
+                return False
+        return True
+
+    def __contains__(self, value):
+        return self.might_contain(value)
+
+    def false_positive_rate(self):
+        """ Estimated false positive rate, given the bits set so far. """
+
+        filled = float(sum([bin(byte).count('1') for byte in self.bits])) / \
+                 self.num_bits
+        return filled ** self.num_hashes
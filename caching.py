@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+""" Versioned cache entries.
+
+Instead of deleting cache entries when the data they were derived from
+changes, entries are stored under a key that includes a version number,
+and the version is bumped on changes. Stale entries are never read again
+and simply expire.
+
+Everything cached by the app is derived either from a single poll or
+from the polls as a whole (listings). Each poll therefore has a
+generation counter that is bumped on any write to the poll, its choices
+or its votes, and there is a global generation counter for listings that
+is bumped on any write to any poll. Keys are built from these with
+`poll_key`, `poll_keys` and `listing_key`, so that a write invalidates
+everything derived from it by a single increment.
+
+A write inside a transaction bumps the generation before the write is
+committed, and until then entries may be rebuilt from the old data. The
+polls written in a managed transaction are therefore remembered, and
+`bump_committed_generations` bumps them again once it is committed (see
+`middleware.CommittedCacheMiddleware`).
+
+Versions start out at the current time in milliseconds so that a
+version evicted from the cache does not start over at a number that
+old entries may still be stored under.
+
+"""
+import threading
+import time
+
+from django.core.cache import cache
+from django.db import transaction
+
+from tenancy import get_current_tenant
+
+# Versions are kept for this many seconds; longer than any entry
+VERSION_TIMEOUT = 30 * 24 * 3600
+
+LISTINGS = 'listings'
+
+# Ids of the polls written in the current transaction, per thread
+_written = threading.local()
+
+
+def _initial_version():
+    return int(time.time() * 1000)
+
+
+def get_versions(names):
+    """ Returns a dict of the current versions of `names`. """
+
+    keys = dict([('polls:version:%s' % name, name) for name in names])
+    versions = cache.get_many(keys.keys())
+    result = {}
+    for key, name in keys.items():
+        version = versions.get(key)
+        if version is None:
+            version = _initial_version()
+            if not cache.add(key, version, VERSION_TIMEOUT):
+                version = cache.get(key, version)
+        result[name] = version
+    return result
+
+
+def get_version(name):
+    return get_versions([name])[name]
+
+
+def bump_version(name):
+    """ Makes all entries stored under the current version stale. """
+
+    key = 'polls:version:%s' % name
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, _initial_version(), VERSION_TIMEOUT)
+
+
+def versioned_key(name, version, *parts):
+    return ':'.join(['polls', name, str(version)] + [str(p) for p in parts])
+
+
+def poll_generation_name(pollid):
+    return 'poll:%d' % pollid
+
+
+def poll_generation(pollid):
+    return get_version(poll_generation_name(pollid))
+
+
+def bump_poll_generation(pollid):
+    """ Invalidates everything cached for a poll, and all listings. """
+
+    bump_version(poll_generation_name(pollid))
+    bump_version(LISTINGS)
+    if transaction.is_managed():
+        pollids = getattr(_written, 'pollids', None)
+        if pollids is None:
+            pollids = _written.pollids = set()
+        pollids.add(pollid)
+
+
+def bump_committed_generations():
+    """ Bumps the polls written in this thread's transaction again,
+    once it has been committed or rolled back.
+
+    """
+    pollids = getattr(_written, 'pollids', None)
+    if not pollids:
+        return
+    _written.pollids = set()
+    for pollid in pollids:
+        bump_version(poll_generation_name(pollid))
+    bump_version(LISTINGS)
+
+
+def poll_key(name, pollid, *parts):
+    """ Key of an entry named `name` derived from a poll. """
+
+    return versioned_key(name, poll_generation(pollid), pollid, *parts)
+
+
+def poll_keys(name, pollids, *parts):
+    """ Keys of the entries named `name` of several polls, as a dict
+    mapping poll ids to keys. The generations are read in one go.
+
+    """
+    versions = get_versions([poll_generation_name(pollid)
+                             for pollid in pollids])
+    return dict([(pollid,
+                  versioned_key(name,
+                                versions[poll_generation_name(pollid)],
+                                pollid,
+                                *parts))
+                 for pollid in pollids])
+
+
+def listing_key(name, *parts):
+    """ Key of an entry named `name` derived from any number of polls
+    of the current tenant.
+
+    """
+    return versioned_key(name, get_version(LISTINGS), get_current_tenant(),
+                         *parts)
@@ -0,0 +1,279 @@
+# -*- coding: utf-8 -*-
+""" Streaming export of poll results and votes as CSV and XLSX.
+
+Rows are produced by generators that read votes in chunks keyed on id,
+and written out as they come, so that memory use stays constant and the
+first bytes are sent right away however large the poll. XLSX files are
+zip archives; `ZipStream` writes them without knowing the sizes of the
+files in advance by putting the sizes in data descriptors after each
+file (general purpose flag bit 3).
+
+"""
+import csv
+import datetime
+import re
+import struct
+import time
+import zlib
+from xml.sax.saxutils import escape
+
+from django.contrib.auth.models import User
+from django.utils.encoding import smart_str
+
+from models import Choice, Vote, VoteArchive
+from packing import from_timestamp
+from tenancy import get_current_tenant, set_current_tenant
+
+RESULTS_HEADER = ('choice', 'votes')
+VOTES_HEADER = ('username', 'name', 'choice', 'voted (date)',
+                'changed (date)')
+
+
+def result_rows(poll):
+    """ Yields (choice, number of votes) for the live choices of a poll. """
+
+    tallies = Choice.objects.tallies_for_polls([poll.id])[poll.id]
+    for choiceid, choice, votes in tallies:
+        yield (choice, votes)
+
+
+def vote_rows(poll, chunk_size=1000):
+    """ Yields (username, name, choice, created, modified) for the live
+    and archived votes of a poll.
+
+    """
+    after = 0
+    votes = Vote.objects.filter(choice__poll=poll,
+                                choice__deleted_at__isnull=True) \
+                        .order_by('id')
+    while True:
+        chunk = list(votes.filter(id__gt=after)
+                          .values_list('id', 'user__username',
+                                       'user__first_name', 'user__last_name',
+                                       'choice__choice', 'date_created',
+                                       'date_modified')[:chunk_size])
+        for (id, username, first_name, last_name, choice, created,
+             modified) in chunk:
+            yield (username, ('%s %s' % (first_name, last_name)).strip(),
+                   choice, created, modified)
+        if len(chunk) < chunk_size:
+            break
+        after = chunk[-1][0]
+
+    if not poll.archived_at:
+        return
+    try:
+        archive = VoteArchive.objects.get(poll=poll)
+    except VoteArchive.DoesNotExist:
+        return
+    choices = dict(Choice.objects.filter(poll=poll, deleted_at__isnull=True)
+                                 .values_list('id', 'choice'))
+    for rows in archive.row_chunks(chunk_size):
+        chunk = [row for row in rows if row[1] in choices]
+        users = User.objects.in_bulk([row[0] for row in chunk])
+        for userid, choiceid, created, modified in chunk:
+            user = users.get(userid)
+            if user is None:
+                continue
+            yield (user.username, user.get_full_name(), choices[choiceid],
+                   from_timestamp(created), from_timestamp(modified))
+
+
+def for_tenant(tenant, chunks):
+    """ Yields the strings from `chunks` with `tenant` as the current
+    tenant. Responses are streamed after `TenantMiddleware` has reset
+    the tenant, so the generators producing them must set it again.
+
+    """
+    chunks = iter(chunks)
+    while True:
+        previous = get_current_tenant()
+        set_current_tenant(tenant)
+        try:
+            try:
+                chunk = chunks.next()
+            except StopIteration:
+                return
+        finally:
+            set_current_tenant(previous)
+        yield chunk
+
+
+def buffered(chunks, size=16384):
+    """ Joins small strings from `chunks` into strings of about `size`
+    bytes, to save on writes to the client.
+
+    """
+    buf = []
+    length = 0
+    for chunk in chunks:
+        buf.append(chunk)
+        length += len(chunk)
+        if length >= size:
+            yield ''.join(buf)
+            buf = []
+            length = 0
+    if buf:
+        yield ''.join(buf)
+
+
+class _Line(object):
+    """ File-like object holding the last line written by a csv writer. """
+
+    def write(self, line):
+        self.line = line
+
+
+def _csv_value(value):
+    if isinstance(value, datetime.datetime):
+        return value.strftime('%Y-%m-%d %H:%M:%S')
+    return smart_str(value)
+
+
+def csv_stream(header, rows):
+    """ Yields the lines of a CSV file (in UTF-8). """
+
+    line = _Line()
+    writer = csv.writer(line)
+    writer.writerow(header)
+    yield line.line
+    for row in rows:
+        writer.writerow([_csv_value(value) for value in row])
+        yield line.line
+
+
+class ZipStream(object):
+    """ Writes a zip archive as a stream of strings. Use `add` for each
+    file and finally `close`, both of which are generators.
+
+    """
+
+    def __init__(self):
+        self.offset = 0
+        self.entries = []
+
+    def _out(self, data):
+        self.offset += len(data)
+        return data
+
+    def add(self, name, chunks):
+        """ Adds a file made up of the strings from `chunks`, deflated. """
+
+        dostime, dosdate = self._dos_time(time.localtime())
+        offset = self.offset
+        # Version 2.0, data descriptor flag, deflate
+        yield self._out(struct.pack('<IHHHHHIIIHH', 0x04034b50, 20, 0x08, 8,
+                                    dostime, dosdate, 0, 0, 0, len(name), 0) +
+                        name)
+        compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION,
+                                      zlib.DEFLATED, -15)
+        crc = 0
+        size = compressed = 0
+        for chunk in chunks:
+            crc = zlib.crc32(chunk, crc)
+            size += len(chunk)
+            data = compressor.compress(chunk)
+            if data:
+                compressed += len(data)
+                yield self._out(data)
+        data = compressor.flush()
+        compressed += len(data)
+        yield self._out(data)
+        crc &= 0xffffffff
+        yield self._out(struct.pack('<IIII', 0x08074b50, crc, compressed,
+                                    size))
+        self.entries.append((name, dostime, dosdate, crc, compressed, size,
+                             offset))
+
+    def close(self):
+        """ Writes the central directory. """
+
+        start = self.offset
+        for (name, dostime, dosdate, crc, compressed, size,
+             offset) in self.entries:
+            yield self._out(struct.pack('<IHHHHHHIIIHHHHHII', 0x02014b50,
+                                        20, 20, 0x08, 8, dostime, dosdate,
+                                        crc, compressed, size, len(name),
+                                        0, 0, 0, 0, 0, offset) + name)
+        yield self._out(struct.pack('<IHHHHIIH', 0x06054b50, 0, 0,
+                                    len(self.entries), len(self.entries),
+                                    self.offset - start, start, 0))
+
+    def _dos_time(self, t):
+        return ((t[3] << 11) | (t[4] << 5) | (t[5] // 2),
+                ((t[0] - 1980) << 9) | (t[1] << 5) | t[2])
+
+
+XLSX_FILES = (
+    ('[Content_Types].xml',
+     '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+     '<Types xmlns="http://schemas.openxmlformats.org/package/2006/'
+     'content-types">'
+     '<Default Extension="rels" ContentType="application/'
+     'vnd.openxmlformats-package.relationships+xml"/>'
+     '<Default Extension="xml" ContentType="application/xml"/>'
+     '<Override PartName="/xl/workbook.xml" ContentType="application/'
+     'vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+     '<Override PartName="/xl/worksheets/sheet1.xml" ContentType='
+     '"application/vnd.openxmlformats-officedocument.spreadsheetml.'
+     'worksheet+xml"/>'
+     '</Types>'),
+    ('_rels/.rels',
+     '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+     '<Relationships xmlns="http://schemas.openxmlformats.org/package/'
+     '2006/relationships">'
+     '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/'
+     'officeDocument/2006/relationships/officeDocument" '
+     'Target="xl/workbook.xml"/>'
+     '</Relationships>'),
+    ('xl/workbook.xml',
+     '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+     '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/'
+     '2006/main" xmlns:r="http://schemas.openxmlformats.org/'
+     'officeDocument/2006/relationships">'
+     '<sheets><sheet name="%(sheet)s" sheetId="1" r:id="rId1"/></sheets>'
+     '</workbook>'),
+    ('xl/_rels/workbook.xml.rels',
+     '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+     '<Relationships xmlns="http://schemas.openxmlformats.org/package/'
+     '2006/relationships">'
+     '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/'
+     'officeDocument/2006/relationships/worksheet" '
+     'Target="worksheets/sheet1.xml"/>'
+     '</Relationships>'),
+)
+
+
+# Characters not allowed in XML documents
+_INVALID_XML = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f]')
+
+
+def _xlsx_cell(value):
+    if isinstance(value, (int, long, float)) and not isinstance(value, bool):
+        return '<c><v>%s</v></c>' % value
+    return '<c t="inlineStr"><is><t>%s</t></is></c>' % \
+           escape(_INVALID_XML.sub('', _csv_value(value)))
+
+
+def _xlsx_sheet(header, rows):
+    yield ('<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+           '<worksheet xmlns="http://schemas.openxmlformats.org/'
+           'spreadsheetml/2006/main"><sheetData>')
+    yield '<row>%s</row>' % ''.join([_xlsx_cell(v) for v in header])
+    for row in rows:
+        yield '<row>%s</row>' % ''.join([_xlsx_cell(v) for v in row])
+    yield '</sheetData></worksheet>'
+
+
+def xlsx_stream(header, rows, sheet='Sheet1'):
+    """ Yields the bytes of an XLSX workbook with a single sheet. """
+
+    archive = ZipStream()
+    for name, content in XLSX_FILES:
+        for data in archive.add(name, [content % {'sheet': escape(sheet)}]):
+            yield data
+    for data in archive.add('xl/worksheets/sheet1.xml',
+                            _xlsx_sheet(header, rows)):
+        yield data
+    for data in archive.close():
+        yield data
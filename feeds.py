@@ -1,20 +1,78 @@
 # -*- coding: utf-8 -*-
+import hashlib
+import hmac
+from cStringIO import StringIO
+
+from django.conf import settings
 from django.contrib.auth.models import User
 from django.contrib.syndication.feeds import Feed
 from django.core.cache import cache
+from django.core.exceptions import ObjectDoesNotExist
 from django.core.urlresolvers import reverse
-from django.db.models import Count, Q
-from django.utils.translation import ugettext_lazy as _
+from django.utils import translation
+from django.utils.hashcompat import md5_constructor
+from django.utils.translation import ugettext, ugettext_lazy as _
 
-from models import Choice, Poll, Vote
+from caching import listing_key
+from models import Choice, Poll
 
+# Upper limit on the number of polls in a feed
+MAX_FEED_ITEMS = 30
+# Rendered feeds are kept in the cache for this many seconds
+FEED_CACHE_TIMEOUT = getattr(settings, 'POLLS_FEED_CACHE_TIMEOUT', 3600)
 
-class LatestPolls(Feed):
-    title = _("Latest polls")
-    description = _("The latest polls submitted by your co-workers")
 
-    def items(self):
-        return Poll.objects.recent()
+def answered_feed_token(user):
+    """ The secret part of the URL of a user's feed of answered polls,
+    so that only the user can read it.
+
+    """
+    return hmac.new(settings.SECRET_KEY,
+                    'polls:answered-feed:%d' % user.id,
+                    hashlib.sha1).hexdigest()
+
+
+class RenderedFeed(object):
+    """ A cached feed, standing in for the feed generator that the
+    syndication view writes out.
+
+    """
+
+    def __init__(self, mime_type, content):
+        self.mime_type = mime_type
+        self.content = content
+
+    def write(self, outfile, encoding):
+        outfile.write(self.content)
+
+
+class PollFeed(Feed):
+    """ Base class of the poll feeds, which only need to define `polls`.
+
+    Rendered feeds are cached under the generation of the listings (see
+    caching.py), so any poll being edited, published, closed or voted on
+    gives the feeds new keys.
+
+    """
+
+    def polls(self, obj):
+        raise NotImplementedError
+
+    def get_object(self, bits):
+        if bits:
+            raise ObjectDoesNotExist
+        return None
+
+    def items(self, obj):
+        return self.with_tallies(
+            list(self.polls(obj).select_related('user')[:MAX_FEED_ITEMS]))
+
+    def with_tallies(self, polls):
+        tallies = Choice.objects.tallies_for_polls([p.id for p in polls])
+        for poll in polls:
+            poll.tallies = tallies[poll.id]
+            poll.num_votes = sum([votes for id, choice, votes in poll.tallies])
+        return polls
 
     def item_link(self, item):
         return reverse('molnet-polls-show-poll',
@@ -23,6 +81,12 @@ class LatestPolls(Feed):
                                'day': item.published_at.day,
                                'slug': item.slug})
 
+    def item_author_name(self, item):
+        return item.user.get_full_name() or item.user.username
+
+    def item_pubdate(self, item):
+        return item.published_at
+
     def link(self):
         """ Defined as a method as reverse will otherwise throw an
         improperlyConfigured exception because the url patterns have
@@ -30,3 +94,93 @@ class LatestPolls(Feed):
 
         """
         return reverse("molnet-polls-startpage")
+
+    def get_feed(self, url=None):
+        # Feed.get_feed looks up the object and raises FeedDoesNotExist,
+        # so only feeds of valid urls are ever cached
+        key = listing_key('feed', md5_constructor(
+            repr((self.slug, url, translation.get_language()))).hexdigest())
+        feed = cache.get(key)
+        if feed is None:
+            feedgen = super(PollFeed, self).get_feed(url)
+            content = StringIO()
+            feedgen.write(content, 'utf-8')
+            feed = (feedgen.mime_type, content.getvalue())
+            cache.set(key, feed, FEED_CACHE_TIMEOUT)
+        return RenderedFeed(*feed)
+
+
+class LatestPolls(PollFeed):
+    title = _("Latest polls")
+    description = _("The latest polls submitted by your co-workers")
+
+    def polls(self, obj):
+        return Poll.objects.recent()
+
+
+class TrendingPolls(PollFeed):
+    title = _("Trending polls")
+    description = _("The polls your co-workers are answering right now")
+
+    def polls(self, obj):
+        return Poll.objects.trending()
+
+    def link(self):
+        return reverse("molnet-polls-trending")
+
+
+class ClosedPolls(PollFeed):
+    title = _("Poll results")
+    description = _("The results of recently closed polls")
+
+    def polls(self, obj):
+        return Poll.objects.closed()
+
+
+class UserPolls(PollFeed):
+    """ Published polls of a user, e.g. feeds/user/username/. """
+
+    def get_object(self, bits):
+        if len(bits) != 1:
+            raise ObjectDoesNotExist
+        return User.objects.get(username=bits[0])
+
+    def title(self, obj):
+        return ugettext("Polls by %s") % (obj.get_full_name() or
+                                          obj.username)
+
+    def description(self, obj):
+        return self.title(obj)
+
+    def polls(self, obj):
+        return Poll.objects.created_by_user(obj.id).exclude(status='DRAFT')
+
+
+class AnsweredPolls(UserPolls):
+    """ Polls a user has answered, e.g. feeds/answered/username/token/,
+    see `answered_feed_token`.
+
+    """
+
+    def get_object(self, bits):
+        if len(bits) != 2:
+            raise ObjectDoesNotExist
+        user = User.objects.get(username=bits[0])
+        if bits[1] != answered_feed_token(user):
+            raise ObjectDoesNotExist
+        return user
+
+    def title(self, obj):
+        return ugettext("Polls answered by %s") % (obj.get_full_name() or
+                                                   obj.username)
+
+    def items(self, obj):
+        return self.with_tallies(
+            Poll.objects.answered_by_user(obj.id, MAX_FEED_ITEMS))
+
+
+FEEDS = {'latest': LatestPolls,
+         'trending': TrendingPolls,
+         'results': ClosedPolls,
+         'user': UserPolls,
+         'answered': AnsweredPolls}
@@ -5,7 +5,7 @@ from django.forms import (BooleanField, CharField, ChoiceField, Form,
 from django.utils.encoding import force_unicode
 from django.utils.translation import ugettext_lazy as _
 
-from models import Choice, Poll, Vote
+from models import Choice, normalize_choice, Poll, Vote
 
 
 class ModelFormRequestUser(ModelForm):
@@ -180,7 +180,8 @@ class PollForm(ModelFormRequestUser):
 
     class Meta:
         model = Poll
-        fields = ['title', 'description', 'allow_new_choices']
+        fields = ['title', 'description', 'allow_new_choices',
+                  'allow_anonymous_votes', 'publish_at', 'close_at']
         # Django 1.2 only
         # widgets = {'title': TextInput(attrs={'class': 'span-12 last input'}),
         #           'description': Textarea(attrs={'class': 'span-12 last input'}),}
@@ -191,6 +192,26 @@ class PollForm(ModelFormRequestUser):
         self.fields['description'].widget.attrs['class'] = 'span-12 last input'
         self.fields['description'].widget.attrs['id'] = 'wmd-input'
 
+    def clean_title(self):
+        # Titles are unique per tenant, which the form does not check
+        # by itself as the tenant is not one of its fields
+        title = self.cleaned_data['title']
+        polls = Poll.objects.filter(title=title)
+        if self.instance.pk:
+            polls = polls.exclude(pk=self.instance.pk)
+        if list(polls.values_list('id', flat=True)[:1]):
+            raise ValidationError(_("A poll with this title already "
+                                    "exists."))
+        return title
+
+    def clean(self):
+        publish_at = self.cleaned_data.get('publish_at')
+        close_at = self.cleaned_data.get('close_at')
+        if publish_at and close_at and close_at <= publish_at:
+            raise ValidationError(_("The poll must be published before "
+                                    "it is closed."))
+        return self.cleaned_data
+
 class ChoiceForm(ModelFormRequestUser):
     """ Form for adding and editing poll choices. """
 
@@ -199,6 +220,15 @@ class ChoiceForm(ModelFormRequestUser):
         super(ChoiceForm, self).__init__(request, *args, **varargs)
         self.fields['choice'].widget.attrs['class'] = 'span-12 last input'
 
+    def clean_choice(self):
+        choice = self.cleaned_data['choice'].strip()
+        if list(Choice.objects.live()
+                              .filter(poll=self.poll,
+                                      normalized=normalize_choice(choice))
+                              .values_list('id', flat=True)[:1]):
+            raise ValidationError(_("The poll already has this choice."))
+        return choice
+
     def save(self, commit=True):
         obj = super(ChoiceForm, self).save(commit=False)
         obj.poll = self.poll
@@ -213,3 +243,43 @@ class ChoiceForm(ModelFormRequestUser):
         # Django 1.2 only
         # widgets = {'choice': TextInput(attrs={'class': 'span-12 input',
         #                                       'size': '255'}),}
+
+
+class BulkChoiceForm(Form):
+    """ Form for editing all choices of a poll at once, one per line. """
+
+    choices = CharField(label=_("Choices (one per line)"),
+                        widget=Textarea(attrs={'class': 'span-12 last input',
+                                               'rows': 10}))
+
+    def __init__(self, poll, *args, **kwargs):
+        self.poll = poll
+        if 'initial' not in kwargs:
+            texts = Choice.objects.live() \
+                                  .filter(poll=poll) \
+                                  .values_list('choice', flat=True)
+            kwargs['initial'] = {'choices': u'\n'.join(texts)}
+        super(BulkChoiceForm, self).__init__(*args, **kwargs)
+
+    def clean_choices(self):
+        """ Returns the choices as a list of stripped, non-empty lines. """
+
+        max_length = Choice._meta.get_field('choice').max_length
+        texts = []
+        keys = []
+        for line in self.cleaned_data['choices'].splitlines():
+            text = line.strip()
+            if not text:
+                continue
+            if len(text) > max_length:
+                raise ValidationError(_("Choices can be at most %d "
+                                        "characters long.") % max_length)
+            key = normalize_choice(text)
+            if key in keys:
+                raise ValidationError(_("The choice \"%s\" occurs more "
+                                        "than once.") % text)
+            texts.append(text)
+            keys.append(key)
+        if not texts:
+            raise ValidationError(_("Please enter at least one choice."))
+        return texts
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+""" HyperLogLog sketches for approximate counts of distinct values.
+
+See Flajolet et al., "HyperLogLog: the analysis of a near-optimal
+cardinality estimation algorithm". With a 64-bit hash no large range
+correction is needed.
+
+"""
+import base64
+import math
+import zlib
+
+from django.utils.hashcompat import md5_constructor
+
+HASH_BITS = 64
+
+
+class HyperLogLog(object):
+    """ An approximate set of values that can only be counted.
+
+    A sketch takes 2 ** `precision` bytes, 4 KB by default, however many
+    values are added, and counts them with a standard error of about
+    1.04 / sqrt(2 ** precision), 1.6% by default. Sketches of the same
+    precision can be merged, e.g. sketches of days into one of a month.
+
+    """
+
+    def __init__(self, precision=12):
+        if not 4 <= precision <= 16:
+            raise ValueError("Precision must be between 4 and 16.")
+        self.precision = precision
+        self.num_registers = 1 << precision
+        self.registers = bytearray(self.num_registers)
+
+    def add(self, value):
+        h = int(md5_constructor(str(value)).hexdigest()[:HASH_BITS // 4], 16)
+        bits = HASH_BITS - self.precision
+        index = h >> bits
+        rest = h & ((1 << bits) - 1)
+        # Position of the leftmost 1 bit of the rest, counting from 1
+        if rest:
+            rank = bits - (len(bin(rest)) - 2) + 1
+        else:
+            rank = bits + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def count(self):
+        """ Estimated number of distinct values added. """
+
+        m = self.num_registers
+        total = 0.0
+        zeros = 0
+        for register in self.registers:
+            total += 2.0 ** -register
+            if not register:
+                zeros += 1
+        if m >= 128:
+            alpha = 0.7213 / (1 + 1.079 / m)
+        else:
+            alpha = {16: 0.673, 32: 0.697, 64: 0.709}[m]
+        estimate = alpha * m * m / total
+        if estimate <= 2.5 * m and zeros:
+            # Linear counting is more accurate for small counts
+            estimate = m * math.log(float(m) / zeros)
+        return estimate
+
+    def __len__(self):
+        return int(round(self.count()))
+
+    def update(self, other):
+        """ Adds the values of another sketch to this one. """
+
+        if other.precision != self.precision:
+            raise ValueError("Sketches of different precision can't be "
+                             "merged.")
+        for i, register in enumerate(other.registers):
+            if register > self.registers[i]:
+                self.registers[i] = register
+
+    def __or__(self, other):
+        result = self.copy()
+        result.update(other)
+        return result
+
+    def copy(self):
+        result = HyperLogLog(self.precision)
+        result.registers = bytearray(self.registers)
+        return result
+
+    def dumps(self):
+        """ Serializes the sketch into a string (see `loads`). """
+
+        return base64.b64encode(zlib.compress(chr(self.precision) +
+                                              str(self.registers)))
+
+    @classmethod
+    def loads(cls, data, precision=12):
+        """ Deserializes a string created by `dumps`. An empty string
+        gives an empty sketch of `precision`.
+
+        """
+        if not data:
+            return cls(precision)
+        raw = zlib.decompress(base64.b64decode(data))
+        sketch = cls(ord(raw[0]))
+        sketch.registers = bytearray(raw[1:])
+        return sketch
@@ -0,0 +1,237 @@
+# -*- coding: utf-8 -*-
+""" A load test of voting, for reproducing lock contention locally.
+
+Synthetic users view and vote on a single poll from a pool of threads,
+each with its own test client and database connection, so the whole
+request stack runs in-process without a web server or network access.
+See the `loadtest_polls` management command.
+
+"""
+import datetime
+import math
+import random
+import threading
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.urlresolvers import reverse
+from django.db import connection
+from django.test.client import Client
+
+from models import Choice, Poll, Vote
+
+PATTERNS = ('uniform', 'skewed', 'change')
+USERNAME = 'loadtest-%d'
+PASSWORD = 'loadtest'
+
+
+def percentile(values, p):
+    """ The `p`th percentile of `values` (nearest rank). """
+
+    if not values:
+        return 0.0
+    values = sorted(values)
+    rank = int(math.ceil(p / 100.0 * len(values))) - 1
+    return values[min(max(rank, 0), len(values) - 1)]
+
+
+def is_lock_error(exc):
+    message = str(exc).lower()
+    return 'lock' in message or 'deadlock' in message
+
+
+def create_fixtures(num_users, num_choices):
+    """ Creates the synthetic users and a published poll to vote on.
+    Returns the poll and the users.
+
+    """
+    owner, created = User.objects.get_or_create(username=USERNAME % 0)
+    users = []
+    for i in range(1, num_users + 1):
+        user, created = User.objects.get_or_create(username=USERNAME % i)
+        if created:
+            user.set_password(PASSWORD)
+            user.save()
+        users.append(user)
+
+    now = datetime.datetime.now()
+    poll = Poll.objects.create(user=owner,
+                               title='Load test %s' % now.isoformat(),
+                               status='PUBLISHED',
+                               published_at=now)
+    for i in range(num_choices):
+        Choice.objects.create(poll=poll,
+                              user=owner,
+                              choice='Choice %d' % (i + 1),
+                              position=i)
+    return poll, users
+
+
+class Worker(threading.Thread):
+    """ Views or votes on the poll as one of `users` at a time, each
+    with a logged in client of its own.
+
+    """
+
+    def __init__(self, test, users, seed):
+        super(Worker, self).__init__()
+        self.test = test
+        self.users = users
+        self.random = random.Random(seed)
+        self.clients = {}
+        self.voted = set()
+
+    def client(self, user):
+        if user.id not in self.clients:
+            client = Client()
+            client.login(username=user.username, password=PASSWORD)
+            self.clients[user.id] = client
+        return self.clients[user.id]
+
+    def pick_choice(self):
+        choices = self.test.choices
+        if self.test.pattern == 'skewed':
+            # Most votes go to the first choice, making its row hot
+            if self.random.random() < 0.8:
+                return choices[0]
+        return self.random.choice(choices)
+
+    def run(self):
+        try:
+            while self.test.next_request():
+                user = self.random.choice(self.users)
+                if user.id in self.voted and self.test.pattern != 'change' \
+                   or self.random.random() < self.test.read_ratio:
+                    method, data = 'GET', None
+                else:
+                    method, data = 'POST', {'choices': self.pick_choice()}
+                connection.queries = []
+                start = time.time()
+                locked = False
+                try:
+                    # Logging in is part of the user's first request
+                    client = self.client(user)
+                    if method == 'GET':
+                        response = client.get(self.test.url)
+                    else:
+                        response = client.post(self.test.url, data)
+                    failed = response.status_code >= 400
+                    if method == 'POST' and not failed:
+                        self.voted.add(user.id)
+                except Exception, e:
+                    failed = True
+                    locked = is_lock_error(e)
+                self.test.record(method, time.time() - start, failed, locked,
+                                 self.write_times())
+        finally:
+            connection.close()
+
+    def write_times(self):
+        """ Time spent in writes during the last request, which includes
+        any time spent waiting for locks.
+
+        """
+        return [float(q['time']) for q in connection.queries
+                if q['sql'].split(' ', 1)[0] in ('INSERT', 'UPDATE',
+                                                 'DELETE')]
+
+
+class LoadTest(object):
+    """ Sends `num_requests` requests from `num_threads` threads on
+    behalf of `num_users` synthetic users.
+
+    `read_ratio` is the share of requests that view the poll instead of
+    voting. Users only vote once except with the 'change' pattern, where
+    they keep changing their votes.
+
+    """
+
+    def __init__(self, num_users=100, num_threads=8, num_requests=1000,
+                 num_choices=5, pattern='uniform', read_ratio=0.5):
+        if pattern not in PATTERNS:
+            raise ValueError("Unknown voting pattern %r" % pattern)
+        self.num_users = num_users
+        self.num_threads = num_threads
+        self.num_requests = num_requests
+        self.num_choices = num_choices
+        self.pattern = pattern
+        self.read_ratio = read_ratio
+        self.lock = threading.Lock()
+        self.sent = 0
+        self.latencies = {'GET': [], 'POST': []}
+        self.errors = {'GET': 0, 'POST': 0}
+        self.lock_errors = 0
+        self.write_latencies = []
+
+    def next_request(self):
+        self.lock.acquire()
+        try:
+            if self.sent >= self.num_requests:
+                return False
+            self.sent += 1
+            return True
+        finally:
+            self.lock.release()
+
+    def record(self, method, latency, failed, locked, write_times):
+        self.lock.acquire()
+        try:
+            self.latencies[method].append(latency)
+            if failed:
+                self.errors[method] += 1
+            if locked:
+                self.lock_errors += 1
+            self.write_latencies.extend(write_times)
+        finally:
+            self.lock.release()
+
+    def run(self):
+        poll, users = create_fixtures(self.num_users, self.num_choices)
+        self.choices = list(poll.choice_set.values_list('id', flat=True))
+        p_at = poll.published_at
+        self.url = reverse('molnet-polls-show-poll',
+                           kwargs={'year': p_at.year,
+                                   'month': p_at.month,
+                                   'day': p_at.day,
+                                   'slug': poll.slug})
+        # Worker threads open connections of their own
+        connection.close()
+
+        # Queries are only logged, with their times, when debugging
+        debug, settings.DEBUG = settings.DEBUG, True
+        try:
+            workers = [Worker(self, users[i::self.num_threads], i)
+                       for i in range(min(self.num_threads, len(users)))]
+            start = time.time()
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join()
+            self.elapsed = time.time() - start
+        finally:
+            settings.DEBUG = debug
+        self.votes = Vote.objects.filter(choice__poll=poll).count()
+        return self.report()
+
+    def report(self):
+        """ Returns the results of the run as a dict. """
+
+        latencies = self.latencies['GET'] + self.latencies['POST']
+        stats = {'requests': len(latencies),
+                 'elapsed': self.elapsed,
+                 'throughput': len(latencies) / max(self.elapsed, 1e-9),
+                 'errors': self.errors['GET'] + self.errors['POST'],
+                 'lock_errors': self.lock_errors,
+                 'votes': self.votes,
+                 'write_p95': percentile(self.write_latencies, 95),
+                 'write_max': max(self.write_latencies or [0.0])}
+        for method in ('GET', 'POST', 'all'):
+            if method == 'all':
+                values = latencies
+            else:
+                values = self.latencies[method]
+            for p in (50, 95, 99):
+                stats['%s_p%d' % (method, p)] = percentile(values, p)
+            stats['%s_count' % method] = len(values)
+        return stats
@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+import datetime
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand
+
+from molnet.polls.models import VoteArchive
+from molnet.polls.tenancy import set_current_tenant, tenant_option
+
+
+class Command(NoArgsCommand):
+    help = ("Moves the votes of polls that have been closed for a while "
+            "into compact per-poll archives, keeping their tallies.")
+    option_list = NoArgsCommand.option_list + (
+        tenant_option,
+        make_option('--days', dest='days', type='int', default=90,
+                    help="Archive polls closed more than this many days "
+                         "ago."),
+        make_option('--chunk-size', dest='chunk_size', type='int',
+                    default=1000,
+                    help="Number of votes to delete per statement."),
+    )
+
+    def handle_noargs(self, **options):
+        set_current_tenant(options['tenant'])
+        verbosity = int(options.get('verbosity', 1))
+        closed_before = datetime.datetime.now() - \
+                        datetime.timedelta(days=options['days'])
+
+        polls = votes = 0
+        for poll in VoteArchive.objects.polls_to_archive(closed_before):
+            votes += VoteArchive.objects.archive_poll(poll,
+                                                      options['chunk_size'])
+            polls += 1
+            if verbosity > 1:
+                print "Archived %s." % poll.slug
+        if verbosity > 0:
+            print "Archived %d vote(s) of %d poll(s)." % (votes, polls)
@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand
+from django.core.urlresolvers import reverse
+
+from molnet.polls.startup import (FIRST_REQUEST_BUDGET, IMPORT_BUDGET,
+                                  LAZY_MODULES, measure)
+
+
+class Command(NoArgsCommand):
+    help = ("Measures the time it takes a new process to import the polls "
+            "app and to serve its first request.")
+    option_list = NoArgsCommand.option_list + (
+        make_option('--path', dest='path', default=None,
+                    help="Path to request, by default the start page."),
+        make_option('--runs', dest='runs', type='int', default=5,
+                    help="Number of processes to measure."),
+    )
+
+    def handle_noargs(self, **options):
+        path = options['path'] or reverse('molnet-polls-startpage')
+        imports = []
+        requests = []
+        for i in range(options['runs']):
+            result = measure(path)
+            imports.append(result['import_time'])
+            requests.append(result['first_request_time'])
+        imports.sort()
+        requests.sort()
+
+        print "Import:        best %6.1f ms, median %6.1f ms " \
+              "(budget %.0f ms)" % (imports[0] * 1000,
+                                    imports[len(imports) // 2] * 1000,
+                                    IMPORT_BUDGET * 1000)
+        print "First request: best %6.1f ms, median %6.1f ms " \
+              "(budget %.0f ms, status %s)" % \
+              (requests[0] * 1000, requests[len(requests) // 2] * 1000,
+               FIRST_REQUEST_BUDGET * 1000, result['status_code'])
+        eager = [name for name in LAZY_MODULES
+                 if name in result['modules']]
+        if eager:
+            print "Imported at start-up: %s" % ', '.join(eager)
@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+import datetime
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand
+
+from molnet.polls.models import VoteEvent
+from molnet.polls.tenancy import set_current_tenant, tenant_option
+
+
+class Command(NoArgsCommand):
+    help = ("Folds old vote events into a checkpoint of tallies and "
+            "deletes them, so that replaying the vote log stays fast.")
+    option_list = NoArgsCommand.option_list + (
+        tenant_option,
+        make_option('--days', dest='days', type='int', default=30,
+                    help="Compact events older than this many days."),
+        make_option('--chunk-size', dest='chunk_size', type='int',
+                    default=1000,
+                    help="Number of events to read or delete at a time."),
+    )
+
+    def handle_noargs(self, **options):
+        set_current_tenant(options['tenant'])
+        verbosity = int(options.get('verbosity', 1))
+        before = datetime.datetime.now() - \
+                 datetime.timedelta(days=options['days'])
+
+        events = VoteEvent.objects.compact(before, options['chunk_size'])
+        if verbosity > 0:
+            print "Compacted %d vote event(s)." % events
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import tempfile
+from optparse import make_option
+
+from django.conf import settings
+from django.core.management.base import CommandError, NoArgsCommand
+from django.db import connection
+
+from molnet.polls.loadtest import PATTERNS, LoadTest
+
+
+class Command(NoArgsCommand):
+    help = ("Drives concurrent viewing and voting on a poll by synthetic "
+            "users and reports throughput, latencies, errors and lock "
+            "waits. Runs in-process against a throwaway database.")
+    option_list = NoArgsCommand.option_list + (
+        make_option('--users', dest='users', type='int', default=100,
+                    help="Number of synthetic users."),
+        make_option('--threads', dest='threads', type='int', default=8,
+                    help="Number of concurrent threads."),
+        make_option('--requests', dest='requests', type='int',
+                    default=1000,
+                    help="Total number of requests."),
+        make_option('--choices', dest='choices', type='int', default=5,
+                    help="Number of choices of the poll."),
+        make_option('--pattern', dest='pattern', default='uniform',
+                    help="Voting pattern: %s." % ', '.join(PATTERNS)),
+        make_option('--read-ratio', dest='read_ratio', type='float',
+                    default=0.5,
+                    help="Share of requests that only view the poll."),
+        make_option('--use-database', dest='use_database',
+                    action='store_true', default=False,
+                    help="Run against the configured database instead of "
+                         "a throwaway one. Synthetic users and polls are "
+                         "left behind!"),
+    )
+
+    def handle_noargs(self, **options):
+        verbosity = int(options.get('verbosity', 1))
+        if options['pattern'] not in PATTERNS:
+            raise CommandError("Unknown voting pattern %r" %
+                               options['pattern'])
+
+        test = LoadTest(num_users=options['users'],
+                        num_threads=options['threads'],
+                        num_requests=options['requests'],
+                        num_choices=options['choices'],
+                        pattern=options['pattern'],
+                        read_ratio=options['read_ratio'])
+        if options['use_database']:
+            stats = test.run()
+        else:
+            stats = self.run_in_test_database(test, verbosity)
+
+        print "%(requests)d requests in %(elapsed).2f s " \
+              "(%(throughput).1f requests/s), %(votes)d votes" % stats
+        for method in ('GET', 'POST', 'all'):
+            print "%-4s %6d requests, latency p50 %7.1f ms, " \
+                  "p95 %7.1f ms, p99 %7.1f ms" % \
+                  (method, stats['%s_count' % method],
+                   stats['%s_p50' % method] * 1000,
+                   stats['%s_p95' % method] * 1000,
+                   stats['%s_p99' % method] * 1000)
+        print "Errors: %d (%.1f%%), of which lock errors: %d" % \
+              (stats['errors'],
+               100.0 * stats['errors'] / max(stats['requests'], 1),
+               stats['lock_errors'])
+        print "Writes (including lock waits): p95 %.1f ms, max %.1f ms" % \
+              (stats['write_p95'] * 1000, stats['write_max'] * 1000)
+
+    def run_in_test_database(self, test, verbosity):
+        old_name = settings.DATABASE_NAME
+        old_test_name = settings.TEST_DATABASE_NAME
+        tmpdir = None
+        try:
+            if settings.DATABASE_ENGINE == 'sqlite3':
+                # An in-memory database would not be shared between threads
+                tmpdir = tempfile.mkdtemp()
+                settings.TEST_DATABASE_NAME = os.path.join(tmpdir,
+                                                           'loadtest.db')
+            connection.creation.create_test_db(verbosity, autoclobber=True)
+            try:
+                return test.run()
+            finally:
+                connection.creation.destroy_test_db(old_name, verbosity)
+        finally:
+            settings.TEST_DATABASE_NAME = old_test_name
+            if tmpdir:
+                shutil.rmtree(tmpdir, ignore_errors=True)
@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand
+
+from molnet.polls.models import Choice
+from molnet.polls.tenancy import set_current_tenant, tenant_option
+
+
+class Command(NoArgsCommand):
+    help = ("Merges choices of a poll that only differ in case, spacing "
+            "or Unicode representation, moving their votes to the oldest "
+            "of them.")
+    option_list = NoArgsCommand.option_list + (
+        tenant_option,
+        make_option('--chunk-size', dest='chunk_size', type='int',
+                    default=1000,
+                    help="Number of votes to delete per statement."),
+    )
+
+    def handle_noargs(self, **options):
+        set_current_tenant(options['tenant'])
+        verbosity = int(options.get('verbosity', 1))
+
+        merged = Choice.objects.merge_duplicates(options['chunk_size'])
+        if verbosity > 0:
+            print "Merged %d choice(s)." % merged
@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand
+
+from molnet.polls.models import Choice, Poll
+from molnet.polls.tenancy import set_current_tenant, tenant_option
+
+
+class Command(NoArgsCommand):
+    help = ("Removes deleted polls and choices, and their votes, in "
+            "small chunks. Meant to be run periodically, e.g. by cron.")
+    option_list = NoArgsCommand.option_list + (
+        tenant_option,
+        make_option('--chunk-size', dest='chunk_size', type='int',
+                    default=1000,
+                    help="Number of votes to delete per transaction."),
+        make_option('--pause', dest='pause', type='float', default=0.1,
+                    help="Seconds to sleep between chunks."),
+    )
+
+    def handle_noargs(self, **options):
+        set_current_tenant(options['tenant'])
+        chunk_size = options['chunk_size']
+        pause = options['pause']
+        verbosity = int(options.get('verbosity', 1))
+
+        polls, poll_votes = Poll.objects.purge_deleted(chunk_size, pause)
+        choices, choice_votes = Choice.objects.purge_deleted(chunk_size,
+                                                             pause)
+        if verbosity > 0:
+            print "Purged %d poll(s), %d choice(s) and %d vote(s)." % \
+                  (polls, choices, poll_votes + choice_votes)
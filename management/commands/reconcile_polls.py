@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand
+
+from molnet.polls.reconcile import reconcile
+from molnet.polls.tenancy import set_current_tenant, tenant_option
+
+
+class Command(NoArgsCommand):
+    help = ("Checks the cached and stored tallies and voter sets of all "
+            "polls against their votes, and optionally repairs them.")
+    option_list = NoArgsCommand.option_list + (
+        tenant_option,
+        make_option('--processes', dest='processes', type='int', default=4,
+                    help="Number of worker processes."),
+        make_option('--chunk-size', dest='chunk_size', type='int',
+                    default=100,
+                    help="Number of polls to check per transaction."),
+        make_option('--repair', dest='repair', action='store_true',
+                    default=False,
+                    help="Repair the inconsistencies found."),
+    )
+
+    def handle_noargs(self, **options):
+        set_current_tenant(options['tenant'])
+        verbosity = int(options.get('verbosity', 1))
+
+        result = reconcile(processes=options['processes'],
+                           chunk_size=options['chunk_size'],
+                           repair=options['repair'])
+        if verbosity > 0:
+            for pollid, problems in sorted(result['problems'].items()):
+                print "Poll %d: %s%s" % (pollid, ', '.join(problems),
+                                         options['repair'] and
+                                         " (repaired)" or "")
+            print "Checked %d poll(s) in %.1f s (%.1f polls/s), " \
+                  "%d inconsistent." % (result['polls'], result['elapsed'],
+                                        result['throughput'],
+                                        len(result['problems']))
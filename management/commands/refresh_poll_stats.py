@@ -0,0 +1,22 @@
+# -*- coding: utf-8 -*-
+from django.core.management.base import NoArgsCommand
+
+from molnet.polls.models import DailyStats
+from molnet.polls.tenancy import set_current_tenant, tenant_option
+
+
+class Command(NoArgsCommand):
+    help = ("Adds the polls and votes created or changed since the last "
+            "run to the statistics summary tables. Meant to be run "
+            "periodically, e.g. by cron.")
+    option_list = NoArgsCommand.option_list + (
+        tenant_option,
+    )
+
+    def handle_noargs(self, **options):
+        set_current_tenant(options['tenant'])
+        verbosity = int(options.get('verbosity', 1))
+
+        rows = DailyStats.objects.refresh()
+        if verbosity > 0:
+            print "Read %d row(s)." % rows
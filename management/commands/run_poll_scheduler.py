@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+import datetime
+import time
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand
+from django.db import connection
+
+from molnet.polls.models import Poll
+from molnet.polls.tenancy import set_current_tenant, tenant_option
+
+
+class Command(NoArgsCommand):
+    help = ("Publishes and closes polls at their scheduled times. Sleeps "
+            "until the next poll is due rather than checking all polls "
+            "on an interval.")
+    option_list = NoArgsCommand.option_list + (
+        tenant_option,
+        make_option('--once', dest='once', action='store_true',
+                    default=False,
+                    help="Apply the transitions that are due and exit, "
+                         "e.g. when run by cron."),
+        make_option('--batch-size', dest='batch_size', type='int',
+                    default=100,
+                    help="Number of polls to update per transaction."),
+        make_option('--max-sleep', dest='max_sleep', type='float',
+                    default=60,
+                    help="Longest time in seconds to sleep, so that "
+                         "newly scheduled polls are picked up."),
+    )
+
+    def handle_noargs(self, **options):
+        set_current_tenant(options['tenant'])
+        verbosity = int(options.get('verbosity', 1))
+
+        while True:
+            now = datetime.datetime.now()
+            published, closed = Poll.objects.apply_schedule(
+                now, options['batch_size'])
+            if verbosity > 0 and (published or closed):
+                print "%s: published %d and closed %d poll(s)." % \
+                      (now.strftime('%Y-%m-%d %H:%M:%S'), published, closed)
+            if options['once']:
+                return
+
+            due = Poll.objects.next_scheduled()
+            sleep = options['max_sleep']
+            if due is not None:
+                delta = due - datetime.datetime.now()
+                sleep = min(sleep, max(0, delta.days * 86400 +
+                                          delta.seconds +
+                                          delta.microseconds / 1e6))
+            # Don't hold on to a connection while sleeping
+            connection.close()
+            time.sleep(sleep)
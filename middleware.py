@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+""" Middleware of the polls app, other than that of tenancy.py and
+slowlog.py.
+
+"""
+from django.db import transaction
+
+from caching import bump_committed_generations
+from models import Vote, VoteEvent
+
+
+class CommittedCacheMiddleware(object):
+    """ Invalidates the cache entries of the polls written during a
+    request, and adds its voters to the voter filters again, once its
+    transaction has ended, as entries rebuilt before the commit may hold
+    the old data (see caching.py and `VoteManager.add_to_voter_filter`).
+
+    Put it before `TransactionMiddleware` in MIDDLEWARE_CLASSES so that
+    its `process_response` runs after the commit.
+
+    """
+
+    def process_response(self, request, response):
+        bump_committed_generations()
+        Vote.objects.add_committed_voters()
+        return response
+
+
+class VoteEventMiddleware(object):
+    """ Writes the vote events logged during a request (see
+    `VoteEventManager.record`) before the response is returned.
+
+    Put it after `TransactionMiddleware` in MIDDLEWARE_CLASSES so that
+    the events are written in the transaction of the votes they log, and
+    dropped along with the votes when the request fails.
+
+    """
+
+    def process_exception(self, request, exception):
+        if transaction.is_managed():
+            VoteEvent.objects.discard()
+        else:
+            # The votes have been committed already
+            VoteEvent.objects.flush()
+
+    def process_response(self, request, response):
+        VoteEvent.objects.flush()
+        return response
@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+
+from south.db import db
+from django.db import models
+from molnet.polls.models import *
+
+class Migration:
+    
+    def forwards(self, orm):
+        
+        # Adding model 'VoteArchive'
+        db.create_table('polls_votearchive', (
+            ('id', orm['polls.votearchive:id']),
+            ('poll', orm['polls.votearchive:poll']),
+            ('num_votes', orm['polls.votearchive:num_votes']),
+            ('user_ids', orm['polls.votearchive:user_ids']),
+            ('choice_ids', orm['polls.votearchive:choice_ids']),
+            ('dates_created', orm['polls.votearchive:dates_created']),
+            ('dates_modified', orm['polls.votearchive:dates_modified']),
+            ('date_created', orm['polls.votearchive:date_created']),
+            ('date_modified', orm['polls.votearchive:date_modified']),
+        ))
+        db.send_create_signal('polls', ['VoteArchive'])
+        
+        # Adding field 'Poll.closed_at'
+        db.add_column('polls_poll', 'closed_at', orm['polls.poll:closed_at'])
+        
+        # Adding field 'Poll.archived_at'
+        db.add_column('polls_poll', 'archived_at', orm['polls.poll:archived_at'])
+        
+        # Adding field 'Choice.archived_votes'
+        db.add_column('polls_choice', 'archived_votes', orm['polls.choice:archived_votes'])
+        
+        # Polls closed so far were last modified when they were closed
+        db.execute("UPDATE polls_poll SET closed_at = date_modified "
+                   "WHERE status = 'CLOSED'")
+        
+    
+    
+    def backwards(self, orm):
+        
+        # Deleting model 'VoteArchive'
+        db.delete_table('polls_votearchive')
+        
+        # Deleting field 'Poll.closed_at'
+        db.delete_column('polls_poll', 'closed_at')
+        
+        # Deleting field 'Poll.archived_at'
+        db.delete_column('polls_poll', 'archived_at')
+        
+        # Deleting field 'Choice.archived_votes'
+        db.delete_column('polls_choice', 'archived_votes')
+        
+    
+    
+    models = {
+        'auth.group': {
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '80', 'unique': 'True'}),
+            'permissions': ('django.db.models.fields.related.ManyToManyField', [], {'to': "orm['auth.Permission']", 'symmetrical': 'False', 'blank': 'True'})
+        },
+        'auth.permission': {
+            'Meta': {'unique_together': "(('content_type', 'codename'),)"},
+            'codename': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'content_type': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['contenttypes.ContentType']"}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '50'})
+        },
+        'auth.user': {
+            'date_joined': ('django.db.models.fields.DateTimeField', [], {'default': 'datetime.datetime.now'}),
+            'email': ('django.db.models.fields.EmailField', [], {'max_length': '75', 'blank': 'True'}),
+            'first_name': ('django.db.models.fields.CharField', [], {'max_length': '30', 'blank': 'True'}),
+            'groups': ('django.db.models.fields.related.ManyToManyField', [], {'to': "orm['auth.Group']", 'symmetrical': 'False', 'blank': 'True'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'is_active': ('django.db.models.fields.BooleanField', [], {'default': 'True', 'blank': 'True'}),
+            'is_staff': ('django.db.models.fields.BooleanField', [], {'default': 'False', 'blank': 'True'}),
+            'is_superuser': ('django.db.models.fields.BooleanField', [], {'default': 'False', 'blank': 'True'}),
+            'last_login': ('django.db.models.fields.DateTimeField', [], {'default': 'datetime.datetime.now'}),
+            'last_name': ('django.db.models.fields.CharField', [], {'max_length': '30', 'blank': 'True'}),
+            'password': ('django.db.models.fields.CharField', [], {'max_length': '128'}),
+            'user_permissions': ('django.db.models.fields.related.ManyToManyField', [], {'to': "orm['auth.Permission']", 'symmetrical': 'False', 'blank': 'True'}),
+            'username': ('django.db.models.fields.CharField', [], {'max_length': '30', 'unique': 'True'})
+        },
+        'contenttypes.contenttype': {
+            'Meta': {'unique_together': "(('app_label', 'model'),)", 'db_table': "'django_content_type'"},
+            'app_label': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'model': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '100'})
+        },
+        'polls.choice': {
+            'Meta': {'unique_together': "(('poll', 'choice'),)"},
+            'archived_votes': ('django.db.models.fields.PositiveIntegerField', [], {'default': '0'}),
+            'choice': ('django.db.models.fields.CharField', [], {'max_length': '255'}),
+            'date_created': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'db_index': 'True', 'blank': 'True'}),
+            'deleted_at': ('django.db.models.fields.DateTimeField', [], {'db_index': 'True', 'null': 'True', 'blank': 'True'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'poll': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['polls.Poll']"}),
+            'user': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['auth.User']"})
+        },
+        'polls.poll': {
+            'allow_new_choices': ('django.db.models.fields.BooleanField', [], {'default': 'False', 'blank': 'True'}),
+            'archived_at': ('django.db.models.fields.DateTimeField', [], {'null': 'True', 'blank': 'True'}),
+            'closed_at': ('django.db.models.fields.DateTimeField', [], {'db_index': 'True', 'null': 'True', 'blank': 'True'}),
+            'date_created': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'db_index': 'True', 'blank': 'True'}),
+            'date_modified': ('django.db.models.fields.DateTimeField', [], {'auto_now': 'True', 'db_index': 'True', 'blank': 'True'}),
+            'deleted_at': ('django.db.models.fields.DateTimeField', [], {'db_index': 'True', 'null': 'True', 'blank': 'True'}),
+            'description': ('django.db.models.fields.TextField', [], {'blank': 'True'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'published_at': ('django.db.models.fields.DateTimeField', [], {'db_index': 'True', 'null': 'True', 'blank': 'True'}),
+            'slug': ('autoslug.fields.AutoSlugField', [], {'unique_with': '()', 'max_length': '80', 'blank': 'True', 'unique': 'True', 'populate_from': 'None', 'db_index': 'True'}),
+            'status': ('django.db.models.fields.CharField', [], {'default': "'DRAFT'", 'max_length': '32', 'db_index': 'True'}),
+            'title': ('django.db.models.fields.CharField', [], {'max_length': '140', 'unique': 'True'}),
+            'trending_score': ('django.db.models.fields.FloatField', [], {'default': '0.0', 'db_index': 'True'}),
+            'user': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['auth.User']"})
+        },
+        'polls.vote': {
+            'choice': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['polls.Choice']"}),
+            'date_created': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'db_index': 'True', 'blank': 'True'}),
+            'date_modified': ('django.db.models.fields.DateTimeField', [], {'auto_now': 'True', 'db_index': 'True', 'blank': 'True'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'user': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['auth.User']"})
+        },
+        'polls.votearchive': {
+            'choice_ids': ('django.db.models.fields.TextField', [], {'blank': 'True'}),
+            'date_created': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'blank': 'True'}),
+            'date_modified': ('django.db.models.fields.DateTimeField', [], {'auto_now': 'True', 'blank': 'True'}),
+            'dates_created': ('django.db.models.fields.TextField', [], {'blank': 'True'}),
+            'dates_modified': ('django.db.models.fields.TextField', [], {'blank': 'True'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'num_votes': ('django.db.models.fields.PositiveIntegerField', [], {'default': '0'}),
+            'poll': ('django.db.models.fields.related.OneToOneField', [], {'to': "orm['polls.Poll']", 'unique': 'True'}),
+            'user_ids': ('django.db.models.fields.TextField', [], {'blank': 'True'})
+        }
+    }
+    
+    complete_apps = ['polls']
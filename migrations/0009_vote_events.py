@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+import datetime
+
+from south.db import db
+from django.db import models
+from molnet.polls.models import *
+from molnet.polls.packing import pack
+
+# See 0006_composite_indexes
+INDEXES = (
+    # VoteEventManager.events for a poll
+    ('polls_voteevent', ['poll_id', 'id']),
+)
+
+class Migration:
+    
+    def forwards(self, orm):
+        
+        # Adding model 'VoteEvent'
+        db.create_table('polls_voteevent', (
+            ('id', orm['polls.voteevent:id']),
+            ('kind', orm['polls.voteevent:kind']),
+            ('poll_id', orm['polls.voteevent:poll_id']),
+            ('user_id', orm['polls.voteevent:user_id']),
+            ('choice_id', orm['polls.voteevent:choice_id']),
+            ('previous_choice_id', orm['polls.voteevent:previous_choice_id']),
+            ('date_created', orm['polls.voteevent:date_created']),
+        ))
+        db.send_create_signal('polls', ['VoteEvent'])
+        
+        # Adding model 'VoteCheckpoint'
+        db.create_table('polls_votecheckpoint', (
+            ('id', orm['polls.votecheckpoint:id']),
+            ('last_event_id', orm['polls.votecheckpoint:last_event_id']),
+            ('as_of', orm['polls.votecheckpoint:as_of']),
+            ('poll_ids', orm['polls.votecheckpoint:poll_ids']),
+            ('choice_ids', orm['polls.votecheckpoint:choice_ids']),
+            ('counts', orm['polls.votecheckpoint:counts']),
+            ('date_created', orm['polls.votecheckpoint:date_created']),
+        ))
+        db.send_create_signal('polls', ['VoteCheckpoint'])
+        
+        for table, columns in INDEXES:
+            db.create_index(table, columns)
+        
+        # Votes cast so far were never logged, so replays start from a
+        # checkpoint of their tallies (see VoteEventManager.seed)
+        counts = {}
+        for pollid, choiceid, count in db.execute(
+                'SELECT polls_choice.poll_id, polls_vote.choice_id, COUNT(*) '
+                'FROM polls_vote INNER JOIN polls_choice '
+                'ON polls_choice.id = polls_vote.choice_id '
+                'GROUP BY polls_choice.poll_id, polls_vote.choice_id'):
+            counts[(pollid, choiceid)] = count
+        for pollid, choiceid, count in db.execute(
+                'SELECT poll_id, id, archived_votes FROM polls_choice '
+                'WHERE archived_votes > 0'):
+            counts[(pollid, choiceid)] = counts.get((pollid, choiceid), 0) + \
+                                         count
+        rows = sorted([key + (count,) for key, count in counts.items()])
+        orm['polls.votecheckpoint'].objects.create(
+            last_event_id=0,
+            as_of=datetime.datetime.now(),
+            poll_ids=pack([row[0] for row in rows]),
+            choice_ids=pack([row[1] for row in rows]),
+            counts=pack([row[2] for row in rows]))
+        
+    
+    
+    def backwards(self, orm):
+        
+        for table, columns in INDEXES:
+            db.delete_index(table, columns)
+        
+        # Deleting model 'VoteEvent'
+        db.delete_table('polls_voteevent')
+        
+        # Deleting model 'VoteCheckpoint'
+        db.delete_table('polls_votecheckpoint')
+        
+    
+    
+    models = {
+        'auth.group': {
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '80', 'unique': 'True'}),
+            'permissions': ('django.db.models.fields.related.ManyToManyField', [], {'to': "orm['auth.Permission']", 'symmetrical': 'False', 'blank': 'True'})
+        },
+        'auth.permission': {
+            'Meta': {'unique_together': "(('content_type', 'codename'),)"},
+            'codename': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'content_type': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['contenttypes.ContentType']"}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '50'})
+        },
+        'auth.user': {
+            'date_joined': ('django.db.models.fields.DateTimeField', [], {'default': 'datetime.datetime.now'}),
+            'email': ('django.db.models.fields.EmailField', [], {'max_length': '75', 'blank': 'True'}),
+            'first_name': ('django.db.models.fields.CharField', [], {'max_length': '30', 'blank': 'True'}),
+            'groups': ('django.db.models.fields.related.ManyToManyField', [], {'to': "orm['auth.Group']", 'symmetrical': 'False', 'blank': 'True'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'is_active': ('django.db.models.fields.BooleanField', [], {'default': 'True', 'blank': 'True'}),
+            'is_staff': ('django.db.models.fields.BooleanField', [], {'default': 'False', 'blank': 'True'}),
+            'is_superuser': ('django.db.models.fields.BooleanField', [], {'default': 'False', 'blank': 'True'}),
+            'last_login': ('django.db.models.fields.DateTimeField', [], {'default': 'datetime.datetime.now'}),
+            'last_name': ('django.db.models.fields.CharField', [], {'max_length': '30', 'blank': 'True'}),
+            'password': ('django.db.models.fields.CharField', [], {'max_length': '128'}),
+            'user_permissions': ('django.db.models.fields.related.ManyToManyField', [], {'to': "orm['auth.Permission']", 'symmetrical': 'False', 'blank': 'True'}),
+            'username': ('django.db.models.fields.CharField', [], {'max_length': '30', 'unique': 'True'})
+        },
+        'contenttypes.contenttype': {
+            'Meta': {'unique_together': "(('app_label', 'model'),)", 'db_table': "'django_content_type'"},
+            'app_label': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'model': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '100'})
+        },
+        'polls.choice': {
+            'Meta': {'unique_together': "(('poll', 'choice'),)"},
+            'archived_votes': ('django.db.models.fields.PositiveIntegerField', [], {'default': '0'}),
+            'choice': ('django.db.models.fields.CharField', [], {'max_length': '255'}),
+            'date_created': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'db_index': 'True', 'blank': 'True'}),
+            'deleted_at': ('django.db.models.fields.DateTimeField', [], {'db_index': 'True', 'null': 'True', 'blank': 'True'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'poll': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['polls.Poll']"}),
+            'position': ('django.db.models.fields.PositiveIntegerField', [], {'default': '0'}),
+            'user': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['auth.User']"})
+        },
+        'polls.poll': {
+            'allow_new_choices': ('django.db.models.fields.BooleanField', [], {'default': 'False', 'blank': 'True'}),
+            'archived_at': ('django.db.models.fields.DateTimeField', [], {'null': 'True', 'blank': 'True'}),
+            'close_at': ('django.db.models.fields.DateTimeField', [], {'null': 'True', 'blank': 'True'}),
+            'closed_at': ('django.db.models.fields.DateTimeField', [], {'db_index': 'True', 'null': 'True', 'blank': 'True'}),
+            'date_created': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'db_index': 'True', 'blank': 'True'}),
+            'date_modified': ('django.db.models.fields.DateTimeField', [], {'auto_now': 'True', 'db_index': 'True', 'blank': 'True'}),
+            'deleted_at': ('django.db.models.fields.DateTimeField', [], {'db_index': 'True', 'null': 'True', 'blank': 'True'}),
+            'description': ('django.db.models.fields.TextField', [], {'blank': 'True'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'publish_at': ('django.db.models.fields.DateTimeField', [], {'null': 'True', 'blank': 'True'}),
+            'published_at': ('django.db.models.fields.DateTimeField', [], {'db_index': 'True', 'null': 'True', 'blank': 'True'}),
+            'slug': ('autoslug.fields.AutoSlugField', [], {'unique_with': '()', 'max_length': '80', 'blank': 'True', 'unique': 'True', 'populate_from': 'None', 'db_index': 'True'}),
+            'status': ('django.db.models.fields.CharField', [], {'default': "'DRAFT'", 'max_length': '32', 'db_index': 'True'}),
+            'title': ('django.db.models.fields.CharField', [], {'max_length': '140', 'unique': 'True'}),
+            'trending_score': ('django.db.models.fields.FloatField', [], {'default': '0.0', 'db_index': 'True'}),
+            'user': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['auth.User']"})
+        },
+        'polls.vote': {
+            'choice': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['polls.Choice']"}),
+            'date_created': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'db_index': 'True', 'blank': 'True'}),
+            'date_modified': ('django.db.models.fields.DateTimeField', [], {'auto_now': 'True', 'db_index': 'True', 'blank': 'True'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'user': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['auth.User']"})
+        },
+        'polls.votearchive': {
+            'choice_ids': ('django.db.models.fields.TextField', [], {'blank': 'True'}),
+            'date_created': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'blank': 'True'}),
+            'date_modified': ('django.db.models.fields.DateTimeField', [], {'auto_now': 'True', 'blank': 'True'}),
+            'dates_created': ('django.db.models.fields.TextField', [], {'blank': 'True'}),
+            'dates_modified': ('django.db.models.fields.TextField', [], {'blank': 'True'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'num_votes': ('django.db.models.fields.PositiveIntegerField', [], {'default': '0'}),
+            'poll': ('django.db.models.fields.related.OneToOneField', [], {'to': "orm['polls.Poll']", 'unique': 'True'}),
+            'user_ids': ('django.db.models.fields.TextField', [], {'blank': 'True'})
+        },
+        'polls.votecheckpoint': {
+            'as_of': ('django.db.models.fields.DateTimeField', [], {}),
+            'choice_ids': ('django.db.models.fields.TextField', [], {'blank': 'True'}),
+            'counts': ('django.db.models.fields.TextField', [], {'blank': 'True'}),
+            'date_created': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'blank': 'True'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'last_event_id': ('django.db.models.fields.PositiveIntegerField', [], {'unique': 'True'}),
+            'poll_ids': ('django.db.models.fields.TextField', [], {'blank': 'True'})
+        },
+        'polls.voteevent': {
+            'choice_id': ('django.db.models.fields.PositiveIntegerField', [], {}),
+            'date_created': ('django.db.models.fields.DateTimeField', [], {'db_index': 'True'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'kind': ('django.db.models.fields.CharField', [], {'max_length': '8'}),
+            'poll_id': ('django.db.models.fields.PositiveIntegerField', [], {}),
+            'previous_choice_id': ('django.db.models.fields.PositiveIntegerField', [], {'null': 'True', 'blank': 'True'}),
+            'user_id': ('django.db.models.fields.PositiveIntegerField', [], {})
+        },
+        'polls.voterset': {
+            'Meta': {'unique_together': "(('poll', 'choice'),)"},
+            'choice': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['polls.Choice']", 'null': 'True', 'blank': 'True'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'poll': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['polls.Poll']"}),
+            'version': ('django.db.models.fields.PositiveIntegerField', [], {'default': '0'}),
+            'voters': ('django.db.models.fields.TextField', [], {'blank': 'True'})
+        }
+    }
+    
+    complete_apps = ['polls']
@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+
+from south.db import db
+from django.db import models
+from molnet.polls.models import *
+
+# See 0006_composite_indexes and 0007_choice_position. Every manager query
+# is filtered by tenant, so the tenant leads the composite indexes in place
+# of those below.
+REPLACED_INDEXES = (
+    ('polls_poll', ['deleted_at', 'published_at', 'status']),
+    ('polls_poll', ['deleted_at', 'trending_score', 'status']),
+    ('polls_poll', ['user_id', 'deleted_at', 'published_at']),
+    ('polls_vote', ['user_id', 'date_modified']),
+    ('polls_vote', ['user_id', 'choice_id']),
+    ('polls_choice', ['poll_id', 'deleted_at', 'position', 'date_created']),
+    ('polls_poll', ['deleted_at', 'status', 'publish_at']),
+    ('polls_poll', ['deleted_at', 'status', 'close_at']),
+)
+INDEXES = (
+    # PollManager.recent
+    ('polls_poll', ['tenant', 'deleted_at', 'published_at', 'status']),
+    # PollManager.trending
+    ('polls_poll', ['tenant', 'deleted_at', 'trending_score', 'status']),
+    # PollManager.created_by_user
+    ('polls_poll', ['tenant', 'user_id', 'deleted_at', 'published_at']),
+    # PollManager.next_scheduled and apply_schedule
+    ('polls_poll', ['tenant', 'deleted_at', 'status', 'publish_at']),
+    ('polls_poll', ['tenant', 'deleted_at', 'status', 'close_at']),
+    # PollManager.answered_by_user and VoteManager.by_user
+    ('polls_vote', ['tenant', 'user_id', 'date_modified']),
+    # VoteManager.user_vote_for_poll
+    ('polls_vote', ['tenant', 'user_id', 'choice_id']),
+    # ChoiceManager.get_choices_and_votes_for_poll
+    ('polls_choice', ['tenant', 'poll_id', 'deleted_at', 'position',
+                      'date_created']),
+)
+
+class Migration:
+    
+    def forwards(self, orm):
+        
+        # Adding field 'Poll.tenant'
+        db.add_column('polls_poll', 'tenant', orm['polls.poll:tenant'])
+        
+        # Adding field 'Choice.tenant'
+        db.add_column('polls_choice', 'tenant', orm['polls.choice:tenant'])
+        
+        # Adding field 'Vote.tenant'
+        db.add_column('polls_vote', 'tenant', orm['polls.vote:tenant'])
+        
+        # Titles are unique per tenant
+        db.delete_unique('polls_poll', ['title'])
+        db.create_unique('polls_poll', ['tenant', 'title'])
+        
+        for table, columns in REPLACED_INDEXES:
+            db.delete_index(table, columns)
+        for table, columns in INDEXES:
+            db.create_index(table, columns)
+        
+    
+    
+    def backwards(self, orm):
+        
+        for table, columns in INDEXES:
+            db.delete_index(table, columns)
+        for table, columns in REPLACED_INDEXES:
+            db.create_index(table, columns)
+        
+        db.delete_unique('polls_poll', ['tenant', 'title'])
+        db.create_unique('polls_poll', ['title'])
+        
+        # Deleting field 'Poll.tenant'
+        db.delete_column('polls_poll', 'tenant')
+        
+        # Deleting field 'Choice.tenant'
+        db.delete_column('polls_choice', 'tenant')
+        
+        # Deleting field 'Vote.tenant'
+        db.delete_column('polls_vote', 'tenant')
+        
+    
+    
+    models = {
+        'auth.group': {
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '80', 'unique': 'True'}),
+            'permissions': ('django.db.models.fields.related.ManyToManyField', [], {'to': "orm['auth.Permission']", 'symmetrical': 'False', 'blank': 'True'})
+        },
+        'auth.permission': {
+            'Meta': {'unique_together': "(('content_type', 'codename'),)"},
+            'codename': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'content_type': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['contenttypes.ContentType']"}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '50'})
+        },
+        'auth.user': {
+            'date_joined': ('django.db.models.fields.DateTimeField', [], {'default': 'datetime.datetime.now'}),
+            'email': ('django.db.models.fields.EmailField', [], {'max_length': '75', 'blank': 'True'}),
+            'first_name': ('django.db.models.fields.CharField', [], {'max_length': '30', 'blank': 'True'}),
+            'groups': ('django.db.models.fields.related.ManyToManyField', [], {'to': "orm['auth.Group']", 'symmetrical': 'False', 'blank': 'True'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'is_active': ('django.db.models.fields.BooleanField', [], {'default': 'True', 'blank': 'True'}),
+            'is_staff': ('django.db.models.fields.BooleanField', [], {'default': 'False', 'blank': 'True'}),
+            'is_superuser': ('django.db.models.fields.BooleanField', [], {'default': 'False', 'blank': 'True'}),
+            'last_login': ('django.db.models.fields.DateTimeField', [], {'default': 'datetime.datetime.now'}),
+            'last_name': ('django.db.models.fields.CharField', [], {'max_length': '30', 'blank': 'True'}),
+            'password': ('django.db.models.fields.CharField', [], {'max_length': '128'}),
+            'user_permissions': ('django.db.models.fields.related.ManyToManyField', [], {'to': "orm['auth.Permission']", 'symmetrical': 'False', 'blank': 'True'}),
+            'username': ('django.db.models.fields.CharField', [], {'max_length': '30', 'unique': 'True'})
+        },
+        'contenttypes.contenttype': {
+            'Meta': {'unique_together': "(('app_label', 'model'),)", 'db_table': "'django_content_type'"},
+            'app_label': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'model': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '100'})
+        },
+        'polls.choice': {
+            'Meta': {'unique_together': "(('poll', 'choice'),)"},
+            'archived_votes': ('django.db.models.fields.PositiveIntegerField', [], {'default': '0'}),
+            'choice': ('django.db.models.fields.CharField', [], {'max_length': '255'}),
+            'date_created': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'db_index': 'True', 'blank': 'True'}),
+            'deleted_at': ('django.db.models.fields.DateTimeField', [], {'db_index': 'True', 'null': 'True', 'blank': 'True'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'poll': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['polls.Poll']"}),
+            'position': ('django.db.models.fields.PositiveIntegerField', [], {'default': '0'}),
+            'tenant': ('django.db.models.fields.CharField', [], {'default': "'default'", 'max_length': '32'}),
+            'user': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['auth.User']"})
+        },
+        'polls.poll': {
+            'Meta': {'unique_together': "(('tenant', 'title'),)"},
+            'allow_new_choices': ('django.db.models.fields.BooleanField', [], {'default': 'False', 'blank': 'True'}),
+            'archived_at': ('django.db.models.fields.DateTimeField', [], {'null': 'True', 'blank': 'True'}),
+            'close_at': ('django.db.models.fields.DateTimeField', [], {'null': 'True', 'blank': 'True'}),
+            'closed_at': ('django.db.models.fields.DateTimeField', [], {'db_index': 'True', 'null': 'True', 'blank': 'True'}),
+            'date_created': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'db_index': 'True', 'blank': 'True'}),
+            'date_modified': ('django.db.models.fields.DateTimeField', [], {'auto_now': 'True', 'db_index': 'True', 'blank': 'True'}),
+            'deleted_at': ('django.db.models.fields.DateTimeField', [], {'db_index': 'True', 'null': 'True', 'blank': 'True'}),
+            'description': ('django.db.models.fields.TextField', [], {'blank': 'True'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'publish_at': ('django.db.models.fields.DateTimeField', [], {'null': 'True', 'blank': 'True'}),
+            'published_at': ('django.db.models.fields.DateTimeField', [], {'db_index': 'True', 'null': 'True', 'blank': 'True'}),
+            'slug': ('autoslug.fields.AutoSlugField', [], {'unique_with': '()', 'max_length': '80', 'blank': 'True', 'unique': 'True', 'populate_from': 'None', 'db_index': 'True'}),
+            'status': ('django.db.models.fields.CharField', [], {'default': "'DRAFT'", 'max_length': '32', 'db_index': 'True'}),
+            'tenant': ('django.db.models.fields.CharField', [], {'default': "'default'", 'max_length': '32'}),
+            'title': ('django.db.models.fields.CharField', [], {'max_length': '140'}),
+            'trending_score': ('django.db.models.fields.FloatField', [], {'default': '0.0', 'db_index': 'True'}),
+            'user': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['auth.User']"})
+        },
+        'polls.vote': {
+            'choice': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['polls.Choice']"}),
+            'date_created': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'db_index': 'True', 'blank': 'True'}),
+            'date_modified': ('django.db.models.fields.DateTimeField', [], {'auto_now': 'True', 'db_index': 'True', 'blank': 'True'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'tenant': ('django.db.models.fields.CharField', [], {'default': "'default'", 'max_length': '32'}),
+            'user': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['auth.User']"})
+        },
+        'polls.votearchive': {
+            'choice_ids': ('django.db.models.fields.TextField', [], {'blank': 'True'}),
+            'date_created': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'blank': 'True'}),
+            'date_modified': ('django.db.models.fields.DateTimeField', [], {'auto_now': 'True', 'blank': 'True'}),
+            'dates_created': ('django.db.models.fields.TextField', [], {'blank': 'True'}),
+            'dates_modified': ('django.db.models.fields.TextField', [], {'blank': 'True'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'num_votes': ('django.db.models.fields.PositiveIntegerField', [], {'default': '0'}),
+            'poll': ('django.db.models.fields.related.OneToOneField', [], {'to': "orm['polls.Poll']", 'unique': 'True'}),
+            'user_ids': ('django.db.models.fields.TextField', [], {'blank': 'True'})
+        },
+        'polls.votecheckpoint': {
+            'as_of': ('django.db.models.fields.DateTimeField', [], {}),
+            'choice_ids': ('django.db.models.fields.TextField', [], {'blank': 'True'}),
+            'counts': ('django.db.models.fields.TextField', [], {'blank': 'True'}),
+            'date_created': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'blank': 'True'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'last_event_id': ('django.db.models.fields.PositiveIntegerField', [], {'unique': 'True'}),
+            'poll_ids': ('django.db.models.fields.TextField', [], {'blank': 'True'})
+        },
+        'polls.voteevent': {
+            'choice_id': ('django.db.models.fields.PositiveIntegerField', [], {}),
+            'date_created': ('django.db.models.fields.DateTimeField', [], {'db_index': 'True'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'kind': ('django.db.models.fields.CharField', [], {'max_length': '8'}),
+            'poll_id': ('django.db.models.fields.PositiveIntegerField', [], {}),
+            'previous_choice_id': ('django.db.models.fields.PositiveIntegerField', [], {'null': 'True', 'blank': 'True'}),
+            'user_id': ('django.db.models.fields.PositiveIntegerField', [], {})
+        },
+        'polls.voterset': {
+            'Meta': {'unique_together': "(('poll', 'choice'),)"},
+            'choice': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['polls.Choice']", 'null': 'True', 'blank': 'True'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'poll': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['polls.Poll']"}),
+            'version': ('django.db.models.fields.PositiveIntegerField', [], {'default': '0'}),
+            'voters': ('django.db.models.fields.TextField', [], {'blank': 'True'})
+        }
+    }
+    
+    complete_apps = ['polls']
@@ -0,0 +1,222 @@
+# -*- coding: utf-8 -*-
+
+from south.db import db
+from django.db import models
+from molnet.polls.models import *
+
+class Migration:
+    
+    def forwards(self, orm):
+        
+        # Adding model 'DailyStats'
+        db.create_table('polls_dailystats', (
+            ('id', orm['polls.dailystats:id']),
+            ('tenant', orm['polls.dailystats:tenant']),
+            ('date', orm['polls.dailystats:date']),
+            ('polls_created', orm['polls.dailystats:polls_created']),
+            ('votes_cast', orm['polls.dailystats:votes_cast']),
+            ('voters', orm['polls.dailystats:voters']),
+        ))
+        db.send_create_signal('polls', ['DailyStats'])
+        
+        # Adding model 'CreatorStats'
+        db.create_table('polls_creatorstats', (
+            ('id', orm['polls.creatorstats:id']),
+            ('tenant', orm['polls.creatorstats:tenant']),
+            ('date', orm['polls.creatorstats:date']),
+            ('user', orm['polls.creatorstats:user']),
+            ('polls_created', orm['polls.creatorstats:polls_created']),
+        ))
+        db.send_create_signal('polls', ['CreatorStats'])
+        
+        # Adding model 'StatsWatermark'
+        db.create_table('polls_statswatermark', (
+            ('id', orm['polls.statswatermark:id']),
+            ('tenant', orm['polls.statswatermark:tenant']),
+            ('created_until', orm['polls.statswatermark:created_until']),
+            ('modified_until', orm['polls.statswatermark:modified_until']),
+        ))
+        db.send_create_signal('polls', ['StatsWatermark'])
+        
+        # Creating unique_together for [tenant, date] on DailyStats.
+        db.create_unique('polls_dailystats', ['tenant', 'date'])
+        
+        # Creating unique_together for [tenant, date, user] on CreatorStats.
+        db.create_unique('polls_creatorstats', ['tenant', 'date', 'user_id'])
+        
+        # Adding indexes on 'AnonymousVote.date_created' and 'date_modified'
+        db.create_index('polls_anonymousvote', ['date_created'])
+        db.create_index('polls_anonymousvote', ['date_modified'])
+        
+    
+    
+    def backwards(self, orm):
+        
+        db.delete_index('polls_anonymousvote', ['date_created'])
+        db.delete_index('polls_anonymousvote', ['date_modified'])
+        
+        # Deleting unique_together for [tenant, date, user] on CreatorStats.
+        db.delete_unique('polls_creatorstats', ['tenant', 'date', 'user_id'])
+        
+        # Deleting unique_together for [tenant, date] on DailyStats.
+        db.delete_unique('polls_dailystats', ['tenant', 'date'])
+        
+        # Deleting model 'StatsWatermark'
+        db.delete_table('polls_statswatermark')
+        
+        # Deleting model 'CreatorStats'
+        db.delete_table('polls_creatorstats')
+        
+        # Deleting model 'DailyStats'
+        db.delete_table('polls_dailystats')
+        
+    
+    
+    models = {
+        'auth.group': {
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '80', 'unique': 'True'}),
+            'permissions': ('django.db.models.fields.related.ManyToManyField', [], {'to': "orm['auth.Permission']", 'symmetrical': 'False', 'blank': 'True'})
+        },
+        'auth.permission': {
+            'Meta': {'unique_together': "(('content_type', 'codename'),)"},
+            'codename': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'content_type': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['contenttypes.ContentType']"}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '50'})
+        },
+        'auth.user': {
+            'date_joined': ('django.db.models.fields.DateTimeField', [], {'default': 'datetime.datetime.now'}),
+            'email': ('django.db.models.fields.EmailField', [], {'max_length': '75', 'blank': 'True'}),
+            'first_name': ('django.db.models.fields.CharField', [], {'max_length': '30', 'blank': 'True'}),
+            'groups': ('django.db.models.fields.related.ManyToManyField', [], {'to': "orm['auth.Group']", 'symmetrical': 'False', 'blank': 'True'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'is_active': ('django.db.models.fields.BooleanField', [], {'default': 'True', 'blank': 'True'}),
+            'is_staff': ('django.db.models.fields.BooleanField', [], {'default': 'False', 'blank': 'True'}),
+            'is_superuser': ('django.db.models.fields.BooleanField', [], {'default': 'False', 'blank': 'True'}),
+            'last_login': ('django.db.models.fields.DateTimeField', [], {'default': 'datetime.datetime.now'}),
+            'last_name': ('django.db.models.fields.CharField', [], {'max_length': '30', 'blank': 'True'}),
+            'password': ('django.db.models.fields.CharField', [], {'max_length': '128'}),
+            'user_permissions': ('django.db.models.fields.related.ManyToManyField', [], {'to': "orm['auth.Permission']", 'symmetrical': 'False', 'blank': 'True'}),
+            'username': ('django.db.models.fields.CharField', [], {'max_length': '30', 'unique': 'True'})
+        },
+        'contenttypes.contenttype': {
+            'Meta': {'unique_together': "(('app_label', 'model'),)", 'db_table': "'django_content_type'"},
+            'app_label': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'model': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '100'})
+        },
+        'polls.anonymousvote': {
+            'Meta': {'unique_together': "(('poll', 'token_hash'),)"},
+            'choice': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['polls.Choice']"}),
+            'date_created': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'db_index': 'True', 'blank': 'True'}),
+            'date_modified': ('django.db.models.fields.DateTimeField', [], {'auto_now': 'True', 'db_index': 'True', 'blank': 'True'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'poll': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['polls.Poll']"}),
+            'token_hash': ('django.db.models.fields.CharField', [], {'max_length': '64'})
+        },
+        'polls.choice': {
+            'Meta': {'unique_together': "(('poll', 'choice'),)"},
+            'archived_votes': ('django.db.models.fields.PositiveIntegerField', [], {'default': '0'}),
+            'choice': ('django.db.models.fields.CharField', [], {'max_length': '255'}),
+            'date_created': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'db_index': 'True', 'blank': 'True'}),
+            'deleted_at': ('django.db.models.fields.DateTimeField', [], {'db_index': 'True', 'null': 'True', 'blank': 'True'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'poll': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['polls.Poll']"}),
+            'position': ('django.db.models.fields.PositiveIntegerField', [], {'default': '0'}),
+            'tenant': ('django.db.models.fields.CharField', [], {'default': "'default'", 'max_length': '32'}),
+            'user': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['auth.User']"})
+        },
+        'polls.creatorstats': {
+            'Meta': {'unique_together': "(('tenant', 'date', 'user'),)"},
+            'date': ('django.db.models.fields.DateField', [], {}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'polls_created': ('django.db.models.fields.PositiveIntegerField', [], {'default': '0'}),
+            'tenant': ('django.db.models.fields.CharField', [], {'default': "'default'", 'max_length': '32'}),
+            'user': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['auth.User']"})
+        },
+        'polls.dailystats': {
+            'Meta': {'unique_together': "(('tenant', 'date'),)"},
+            'date': ('django.db.models.fields.DateField', [], {}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'polls_created': ('django.db.models.fields.PositiveIntegerField', [], {'default': '0'}),
+            'tenant': ('django.db.models.fields.CharField', [], {'default': "'default'", 'max_length': '32'}),
+            'voters': ('django.db.models.fields.TextField', [], {'blank': 'True'}),
+            'votes_cast': ('django.db.models.fields.PositiveIntegerField', [], {'default': '0'})
+        },
+        'polls.poll': {
+            'Meta': {'unique_together': "(('tenant', 'title'),)"},
+            'allow_anonymous_votes': ('django.db.models.fields.BooleanField', [], {'default': 'False', 'blank': 'True'}),
+            'allow_new_choices': ('django.db.models.fields.BooleanField', [], {'default': 'False', 'blank': 'True'}),
+            'archived_at': ('django.db.models.fields.DateTimeField', [], {'null': 'True', 'blank': 'True'}),
+            'close_at': ('django.db.models.fields.DateTimeField', [], {'null': 'True', 'blank': 'True'}),
+            'closed_at': ('django.db.models.fields.DateTimeField', [], {'db_index': 'True', 'null': 'True', 'blank': 'True'}),
+            'date_created': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'db_index': 'True', 'blank': 'True'}),
+            'date_modified': ('django.db.models.fields.DateTimeField', [], {'auto_now': 'True', 'db_index': 'True', 'blank': 'True'}),
+            'deleted_at': ('django.db.models.fields.DateTimeField', [], {'db_index': 'True', 'null': 'True', 'blank': 'True'}),
+            'description': ('django.db.models.fields.TextField', [], {'blank': 'True'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'publish_at': ('django.db.models.fields.DateTimeField', [], {'null': 'True', 'blank': 'True'}),
+            'published_at': ('django.db.models.fields.DateTimeField', [], {'db_index': 'True', 'null': 'True', 'blank': 'True'}),
+            'slug': ('autoslug.fields.AutoSlugField', [], {'unique_with': '()', 'max_length': '80', 'blank': 'True', 'unique': 'True', 'populate_from': 'None', 'db_index': 'True'}),
+            'status': ('django.db.models.fields.CharField', [], {'default': "'DRAFT'", 'max_length': '32', 'db_index': 'True'}),
+            'tenant': ('django.db.models.fields.CharField', [], {'default': "'default'", 'max_length': '32'}),
+            'title': ('django.db.models.fields.CharField', [], {'max_length': '140'}),
+            'trending_score': ('django.db.models.fields.FloatField', [], {'default': '0.0', 'db_index': 'True'}),
+            'user': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['auth.User']"})
+        },
+        'polls.statswatermark': {
+            'created_until': ('django.db.models.fields.DateTimeField', [], {'null': 'True', 'blank': 'True'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'modified_until': ('django.db.models.fields.DateTimeField', [], {'null': 'True', 'blank': 'True'}),
+            'tenant': ('django.db.models.fields.CharField', [], {'max_length': '32', 'unique': 'True'})
+        },
+        'polls.vote': {
+            'choice': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['polls.Choice']"}),
+            'date_created': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'db_index': 'True', 'blank': 'True'}),
+            'date_modified': ('django.db.models.fields.DateTimeField', [], {'auto_now': 'True', 'db_index': 'True', 'blank': 'True'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'tenant': ('django.db.models.fields.CharField', [], {'default': "'default'", 'max_length': '32'}),
+            'user': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['auth.User']"})
+        },
+        'polls.votearchive': {
+            'choice_ids': ('django.db.models.fields.TextField', [], {'blank': 'True'}),
+            'date_created': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'blank': 'True'}),
+            'date_modified': ('django.db.models.fields.DateTimeField', [], {'auto_now': 'True', 'blank': 'True'}),
+            'dates_created': ('django.db.models.fields.TextField', [], {'blank': 'True'}),
+            'dates_modified': ('django.db.models.fields.TextField', [], {'blank': 'True'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'num_votes': ('django.db.models.fields.PositiveIntegerField', [], {'default': '0'}),
+            'poll': ('django.db.models.fields.related.OneToOneField', [], {'to': "orm['polls.Poll']", 'unique': 'True'}),
+            'user_ids': ('django.db.models.fields.TextField', [], {'blank': 'True'})
+        },
+        'polls.votecheckpoint': {
+            'as_of': ('django.db.models.fields.DateTimeField', [], {}),
+            'choice_ids': ('django.db.models.fields.TextField', [], {'blank': 'True'}),
+            'counts': ('django.db.models.fields.TextField', [], {'blank': 'True'}),
+            'date_created': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'blank': 'True'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'last_event_id': ('django.db.models.fields.PositiveIntegerField', [], {'unique': 'True'}),
+            'poll_ids': ('django.db.models.fields.TextField', [], {'blank': 'True'})
+        },
+        'polls.voteevent': {
+            'choice_id': ('django.db.models.fields.PositiveIntegerField', [], {}),
+            'date_created': ('django.db.models.fields.DateTimeField', [], {'db_index': 'True'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'kind': ('django.db.models.fields.CharField', [], {'max_length': '8'}),
+            'poll_id': ('django.db.models.fields.PositiveIntegerField', [], {}),
+            'previous_choice_id': ('django.db.models.fields.PositiveIntegerField', [], {'null': 'True', 'blank': 'True'}),
+            'user_id': ('django.db.models.fields.PositiveIntegerField', [], {})
+        },
+        'polls.voterset': {
+            'Meta': {'unique_together': "(('poll', 'choice'),)"},
+            'choice': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['polls.Choice']", 'null': 'True', 'blank': 'True'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'poll': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['polls.Poll']"}),
+            'version': ('django.db.models.fields.PositiveIntegerField', [], {'default': '0'}),
+            'voters': ('django.db.models.fields.TextField', [], {'blank': 'True'})
+        }
+    }
+    
+    complete_apps = ['polls']
@@ -0,0 +1,273 @@
+# -*- coding: utf-8 -*-
+
+from south.db import db
+from django.db import models
+from molnet.polls.models import *
+from molnet.polls.packing import pack, unpack
+from molnet.polls.tenancy import DEFAULT_TENANT
+
+# See 0006_composite_indexes and 0010_tenants
+REPLACED_INDEXES = (
+    ('polls_voteevent', ['poll_id', 'id']),
+)
+INDEXES = (
+    # VoteEventManager.events
+    ('polls_voteevent', ['tenant', 'id']),
+    # VoteEventManager.events for a poll
+    ('polls_voteevent', ['tenant', 'poll_id', 'id']),
+    # DailyStatsManager.refresh
+    ('polls_anonymousvote', ['tenant', 'date_created']),
+    ('polls_anonymousvote', ['tenant', 'date_modified']),
+)
+
+class Migration:
+    
+    def forwards(self, orm):
+        
+        # Adding field 'AnonymousVote.tenant'
+        db.add_column('polls_anonymousvote', 'tenant', orm['polls.anonymousvote:tenant'])
+        
+        # Adding field 'VoteArchive.tenant'
+        db.add_column('polls_votearchive', 'tenant', orm['polls.votearchive:tenant'])
+        
+        # Adding field 'VoterSet.tenant'
+        db.add_column('polls_voterset', 'tenant', orm['polls.voterset:tenant'])
+        
+        # Adding field 'VoteEvent.tenant'
+        db.add_column('polls_voteevent', 'tenant', orm['polls.voteevent:tenant'])
+        
+        # Adding field 'VoteCheckpoint.tenant'
+        db.add_column('polls_votecheckpoint', 'tenant', orm['polls.votecheckpoint:tenant'])
+        
+        # Rows take the tenant of their poll. Events of purged polls stay
+        # with the default tenant.
+        for table in ('polls_anonymousvote', 'polls_votearchive',
+                      'polls_voterset', 'polls_voteevent'):
+            db.execute('UPDATE %s SET tenant = (SELECT tenant FROM polls_poll '
+                       'WHERE polls_poll.id = %s.poll_id) '
+                       'WHERE poll_id IN (SELECT id FROM polls_poll)' %
+                       (table, table))
+        
+        # Deleting unique for last_event_id on VoteCheckpoint.
+        db.delete_unique('polls_votecheckpoint', ['last_event_id'])
+        
+        # Creating unique_together for [tenant, last_event_id] on VoteCheckpoint.
+        db.create_unique('polls_votecheckpoint', ['tenant', 'last_event_id'])
+        
+        # Split checkpoints into one per tenant
+        tenants = dict(db.execute('SELECT id, tenant FROM polls_poll'))
+        for checkpoint in orm['polls.votecheckpoint'].objects.all():
+            rows = {}
+            for row in zip(unpack(checkpoint.poll_ids),
+                           unpack(checkpoint.choice_ids),
+                           unpack(checkpoint.counts)):
+                tenant = tenants.get(row[0], checkpoint.tenant)
+                rows.setdefault(tenant, []).append(row)
+            # The checkpoint itself keeps the rows of its own tenant, the
+            # rows of other tenants go into copies of it
+            own = rows.pop(checkpoint.tenant, [])
+            for tenant, tenant_rows in [(checkpoint.tenant, own)] + \
+                                       rows.items():
+                checkpoint.tenant = tenant
+                checkpoint.poll_ids = pack([row[0] for row in tenant_rows])
+                checkpoint.choice_ids = pack([row[1] for row in tenant_rows])
+                checkpoint.counts = pack([row[2] for row in tenant_rows])
+                checkpoint.save()
+                checkpoint.id = None
+        
+        for table, columns in REPLACED_INDEXES:
+            db.delete_index(table, columns)
+        for table, columns in INDEXES:
+            db.create_index(table, columns)
+        
+    
+    
+    def backwards(self, orm):
+        
+        for table, columns in INDEXES:
+            db.delete_index(table, columns)
+        for table, columns in REPLACED_INDEXES:
+            db.create_index(table, columns)
+        
+        # Deleting unique_together for [tenant, last_event_id] on VoteCheckpoint.
+        db.delete_unique('polls_votecheckpoint', ['tenant', 'last_event_id'])
+        
+        # Checkpoints of other tenants than the default one can't be told
+        # apart any more
+        orm['polls.votecheckpoint'].objects.exclude(tenant=DEFAULT_TENANT).delete()
+        
+        # Creating unique for last_event_id on VoteCheckpoint.
+        db.create_unique('polls_votecheckpoint', ['last_event_id'])
+        
+        # Deleting field 'AnonymousVote.tenant'
+        db.delete_column('polls_anonymousvote', 'tenant')
+        
+        # Deleting field 'VoteArchive.tenant'
+        db.delete_column('polls_votearchive', 'tenant')
+        
+        # Deleting field 'VoterSet.tenant'
+        db.delete_column('polls_voterset', 'tenant')
+        
+        # Deleting field 'VoteEvent.tenant'
+        db.delete_column('polls_voteevent', 'tenant')
+        
+        # Deleting field 'VoteCheckpoint.tenant'
+        db.delete_column('polls_votecheckpoint', 'tenant')
+        
+    
+    
+    models = {
+        'auth.group': {
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '80', 'unique': 'True'}),
+            'permissions': ('django.db.models.fields.related.ManyToManyField', [], {'to': "orm['auth.Permission']", 'symmetrical': 'False', 'blank': 'True'})
+        },
+        'auth.permission': {
+            'Meta': {'unique_together': "(('content_type', 'codename'),)"},
+            'codename': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'content_type': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['contenttypes.ContentType']"}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '50'})
+        },
+        'auth.user': {
+            'date_joined': ('django.db.models.fields.DateTimeField', [], {'default': 'datetime.datetime.now'}),
+            'email': ('django.db.models.fields.EmailField', [], {'max_length': '75', 'blank': 'True'}),
+            'first_name': ('django.db.models.fields.CharField', [], {'max_length': '30', 'blank': 'True'}),
+            'groups': ('django.db.models.fields.related.ManyToManyField', [], {'to': "orm['auth.Group']", 'symmetrical': 'False', 'blank': 'True'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'is_active': ('django.db.models.fields.BooleanField', [], {'default': 'True', 'blank': 'True'}),
+            'is_staff': ('django.db.models.fields.BooleanField', [], {'default': 'False', 'blank': 'True'}),
+            'is_superuser': ('django.db.models.fields.BooleanField', [], {'default': 'False', 'blank': 'True'}),
+            'last_login': ('django.db.models.fields.DateTimeField', [], {'default': 'datetime.datetime.now'}),
+            'last_name': ('django.db.models.fields.CharField', [], {'max_length': '30', 'blank': 'True'}),
+            'password': ('django.db.models.fields.CharField', [], {'max_length': '128'}),
+            'user_permissions': ('django.db.models.fields.related.ManyToManyField', [], {'to': "orm['auth.Permission']", 'symmetrical': 'False', 'blank': 'True'}),
+            'username': ('django.db.models.fields.CharField', [], {'max_length': '30', 'unique': 'True'})
+        },
+        'contenttypes.contenttype': {
+            'Meta': {'unique_together': "(('app_label', 'model'),)", 'db_table': "'django_content_type'"},
+            'app_label': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'model': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '100'})
+        },
+        'polls.anonymousvote': {
+            'Meta': {'unique_together': "(('poll', 'token_hash'),)"},
+            'choice': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['polls.Choice']"}),
+            'date_created': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'db_index': 'True', 'blank': 'True'}),
+            'date_modified': ('django.db.models.fields.DateTimeField', [], {'auto_now': 'True', 'db_index': 'True', 'blank': 'True'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'poll': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['polls.Poll']"}),
+            'tenant': ('django.db.models.fields.CharField', [], {'default': "'default'", 'max_length': '32'}),
+            'token_hash': ('django.db.models.fields.CharField', [], {'max_length': '64'})
+        },
+        'polls.choice': {
+            'Meta': {'unique_together': "(('poll', 'normalized'),)"},
+            'archived_votes': ('django.db.models.fields.PositiveIntegerField', [], {'default': '0'}),
+            'choice': ('django.db.models.fields.CharField', [], {'max_length': '255'}),
+            'date_created': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'db_index': 'True', 'blank': 'True'}),
+            'deleted_at': ('django.db.models.fields.DateTimeField', [], {'db_index': 'True', 'null': 'True', 'blank': 'True'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'normalized': ('django.db.models.fields.CharField', [], {'max_length': '255'}),
+            'poll': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['polls.Poll']"}),
+            'position': ('django.db.models.fields.PositiveIntegerField', [], {'default': '0'}),
+            'tenant': ('django.db.models.fields.CharField', [], {'default': "'default'", 'max_length': '32'}),
+            'user': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['auth.User']"})
+        },
+        'polls.creatorstats': {
+            'Meta': {'unique_together': "(('tenant', 'date', 'user'),)"},
+            'date': ('django.db.models.fields.DateField', [], {}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'polls_created': ('django.db.models.fields.PositiveIntegerField', [], {'default': '0'}),
+            'tenant': ('django.db.models.fields.CharField', [], {'default': "'default'", 'max_length': '32'}),
+            'user': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['auth.User']"})
+        },
+        'polls.dailystats': {
+            'Meta': {'unique_together': "(('tenant', 'date'),)"},
+            'date': ('django.db.models.fields.DateField', [], {}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'polls_created': ('django.db.models.fields.PositiveIntegerField', [], {'default': '0'}),
+            'tenant': ('django.db.models.fields.CharField', [], {'default': "'default'", 'max_length': '32'}),
+            'voters': ('django.db.models.fields.TextField', [], {'blank': 'True'}),
+            'votes_cast': ('django.db.models.fields.PositiveIntegerField', [], {'default': '0'})
+        },
+        'polls.poll': {
+            'Meta': {'unique_together': "(('tenant', 'title'), ('tenant', 'slug'))"},
+            'allow_anonymous_votes': ('django.db.models.fields.BooleanField', [], {'default': 'False', 'blank': 'True'}),
+            'allow_new_choices': ('django.db.models.fields.BooleanField', [], {'default': 'False', 'blank': 'True'}),
+            'archived_at': ('django.db.models.fields.DateTimeField', [], {'null': 'True', 'blank': 'True'}),
+            'close_at': ('django.db.models.fields.DateTimeField', [], {'null': 'True', 'blank': 'True'}),
+            'closed_at': ('django.db.models.fields.DateTimeField', [], {'db_index': 'True', 'null': 'True', 'blank': 'True'}),
+            'date_created': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'db_index': 'True', 'blank': 'True'}),
+            'date_modified': ('django.db.models.fields.DateTimeField', [], {'auto_now': 'True', 'db_index': 'True', 'blank': 'True'}),
+            'deleted_at': ('django.db.models.fields.DateTimeField', [], {'db_index': 'True', 'null': 'True', 'blank': 'True'}),
+            'description': ('django.db.models.fields.TextField', [], {'blank': 'True'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'publish_at': ('django.db.models.fields.DateTimeField', [], {'null': 'True', 'blank': 'True'}),
+            'published_at': ('django.db.models.fields.DateTimeField', [], {'db_index': 'True', 'null': 'True', 'blank': 'True'}),
+            'slug': ('autoslug.fields.AutoSlugField', [], {'unique_with': "('tenant',)", 'max_length': '80', 'blank': 'True', 'populate_from': 'None', 'db_index': 'True'}),
+            'status': ('django.db.models.fields.CharField', [], {'default': "'DRAFT'", 'max_length': '32', 'db_index': 'True'}),
+            'tenant': ('django.db.models.fields.CharField', [], {'default': "'default'", 'max_length': '32'}),
+            'title': ('django.db.models.fields.CharField', [], {'max_length': '140'}),
+            'trending_score': ('django.db.models.fields.FloatField', [], {'default': '0.0', 'db_index': 'True'}),
+            'user': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['auth.User']"})
+        },
+        'polls.statswatermark': {
+            'created_until': ('django.db.models.fields.DateTimeField', [], {'null': 'True', 'blank': 'True'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'modified_until': ('django.db.models.fields.DateTimeField', [], {'null': 'True', 'blank': 'True'}),
+            'tenant': ('django.db.models.fields.CharField', [], {'max_length': '32', 'unique': 'True'})
+        },
+        'polls.vote': {
+            'choice': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['polls.Choice']"}),
+            'date_created': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'db_index': 'True', 'blank': 'True'}),
+            'date_modified': ('django.db.models.fields.DateTimeField', [], {'auto_now': 'True', 'db_index': 'True', 'blank': 'True'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'tenant': ('django.db.models.fields.CharField', [], {'default': "'default'", 'max_length': '32'}),
+            'user': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['auth.User']"})
+        },
+        'polls.votearchive': {
+            'choice_ids': ('django.db.models.fields.TextField', [], {'blank': 'True'}),
+            'date_created': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'blank': 'True'}),
+            'date_modified': ('django.db.models.fields.DateTimeField', [], {'auto_now': 'True', 'blank': 'True'}),
+            'dates_created': ('django.db.models.fields.TextField', [], {'blank': 'True'}),
+            'dates_modified': ('django.db.models.fields.TextField', [], {'blank': 'True'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'num_votes': ('django.db.models.fields.PositiveIntegerField', [], {'default': '0'}),
+            'poll': ('django.db.models.fields.related.OneToOneField', [], {'to': "orm['polls.Poll']", 'unique': 'True'}),
+            'tenant': ('django.db.models.fields.CharField', [], {'default': "'default'", 'max_length': '32'}),
+            'user_ids': ('django.db.models.fields.TextField', [], {'blank': 'True'})
+        },
+        'polls.votecheckpoint': {
+            'Meta': {'unique_together': "(('tenant', 'last_event_id'),)"},
+            'as_of': ('django.db.models.fields.DateTimeField', [], {}),
+            'choice_ids': ('django.db.models.fields.TextField', [], {'blank': 'True'}),
+            'counts': ('django.db.models.fields.TextField', [], {'blank': 'True'}),
+            'date_created': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'blank': 'True'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'last_event_id': ('django.db.models.fields.PositiveIntegerField', [], {}),
+            'poll_ids': ('django.db.models.fields.TextField', [], {'blank': 'True'}),
+            'tenant': ('django.db.models.fields.CharField', [], {'default': "'default'", 'max_length': '32'})
+        },
+        'polls.voteevent': {
+            'choice_id': ('django.db.models.fields.PositiveIntegerField', [], {}),
+            'date_created': ('django.db.models.fields.DateTimeField', [], {'db_index': 'True'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'kind': ('django.db.models.fields.CharField', [], {'max_length': '8'}),
+            'poll_id': ('django.db.models.fields.PositiveIntegerField', [], {}),
+            'previous_choice_id': ('django.db.models.fields.PositiveIntegerField', [], {'null': 'True', 'blank': 'True'}),
+            'tenant': ('django.db.models.fields.CharField', [], {'default': "'default'", 'max_length': '32'}),
+            'user_id': ('django.db.models.fields.PositiveIntegerField', [], {})
+        },
+        'polls.voterset': {
+            'Meta': {'unique_together': "(('poll', 'choice'),)"},
+            'choice': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['polls.Choice']", 'null': 'True', 'blank': 'True'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'poll': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['polls.Poll']"}),
+            'tenant': ('django.db.models.fields.CharField', [], {'default': "'default'", 'max_length': '32'}),
+            'version': ('django.db.models.fields.PositiveIntegerField', [], {'default': '0'}),
+            'voters': ('django.db.models.fields.TextField', [], {'blank': 'True'})
+        }
+    }
+    
+    complete_apps = ['polls']
@@ -1,26 +1,347 @@
 # -*- coding: utf-8 -*-
+import bisect
+import datetime
+import hashlib
+import itertools
+import math
 import re
+import threading
+import time
+import unicodedata
 
 from autoslug import AutoSlugField
+from django.conf import settings
 from django.contrib.auth.models import User
-from django.db import connection
+from django.core.cache import cache
+from django.db import connection, IntegrityError, transaction
 from django.db.models import (BooleanField, CharField, Count, DateField,
-                              DateTimeField, ForeignKey, Manager, Model,
-                              permalink, Q, TextField, TimeField)
+                              DateTimeField, F, FloatField, ForeignKey,
+                              Max, Min, Model, OneToOneField,
+                              permalink, PositiveIntegerField, Q, Sum,
+                              TextField, TimeField)
+from django.db.models.signals import (post_delete, post_init, post_save,
+                                      pre_save)
+from django.utils.encoding import force_unicode
 from django.utils.translation import ugettext_lazy as _
 
+from bitmaps import RoaringBitmap
+from bloom import BloomFilter
+from caching import (bump_poll_generation, bump_version, get_version,
+                     poll_generation, poll_key, poll_keys, versioned_key)
+from hyperloglog import HyperLogLog
+from packing import (from_timestamp, pack, Packer, to_timestamp, unpack,
+                     unpack_chunks)
+from tenancy import get_current_tenant, TenantManager
 
-class PollManager(Manager):
+
+# Popularity decays by half every TRENDING_HALF_LIFE seconds. Scores are
+# stored as log2 of the sum of all vote weights, where a vote cast at
+# time t weighs 2 ** ((t - TRENDING_EPOCH) / TRENDING_HALF_LIFE). As every
+# score decays by the same factor as time passes, the decay never has to
+# be applied to the stored values for the ordering to stay correct.
+TRENDING_EPOCH = datetime.datetime(2010, 1, 1)
+TRENDING_HALF_LIFE = getattr(settings, 'POLLS_TRENDING_HALF_LIFE', 24 * 3600)
+
+
+# Voter sets are kept in the cache for this many seconds
+VOTER_SET_CACHE_TIMEOUT = getattr(settings, 'POLLS_VOTER_SET_CACHE_TIMEOUT',
+                                  24 * 3600)
+# Concurrent updates of a voter set are retried this many times
+VOTER_SET_RETRIES = 5
+
+# Bloom filters of voters are kept in the cache for this many seconds
+VOTER_FILTER_CACHE_TIMEOUT = getattr(settings,
+                                     'POLLS_VOTER_FILTER_CACHE_TIMEOUT',
+                                     3600)
+VOTER_FILTER_ERROR_RATE = 0.01
+VOTER_FILTER_MIN_CAPACITY = 1000
+# Seconds after which the lock on updates of a filter is let go anyway
+VOTER_FILTER_LOCK_TIMEOUT = 10
+
+# Tallies are kept in the cache for this many seconds
+TALLY_CACHE_TIMEOUT = getattr(settings, 'POLLS_TALLY_CACHE_TIMEOUT', 3600)
+# Rankings of choices are kept in the cache for this many seconds, which
+# is how long they can be paged through as they stood
+RANKING_CACHE_TIMEOUT = getattr(settings, 'POLLS_RANKING_CACHE_TIMEOUT', 3600)
+
+# Vote events are written in batches of up to this many rows
+VOTE_EVENT_BATCH_SIZE = getattr(settings, 'POLLS_VOTE_EVENT_BATCH_SIZE', 100)
+
+# Summary tables are refreshed up to this many seconds ago, so that rows
+# of transactions still in progress are not skipped
+STATS_LAG = getattr(settings, 'POLLS_STATS_LAG', 60)
+
+# Per-thread state of the vote signal handlers, see suspend_vote_signals
+_vote_signals = threading.local()
+# Per-thread buffer of vote events not yet written
+_vote_events = threading.local()
+# Per-thread voters added to filters in a transaction not yet committed
+_voter_filters = threading.local()
+
+
+def suspend_vote_signals(func, *args, **kwargs):
+    """ Calls func(*args, **kwargs) with the per-vote signal handlers
+    at the end of this module turned off. This is for bulk operations
+    that update (or invalidate) the data derived from votes themselves.
+
+    """
+    _vote_signals.suspended = True
+    try:
+        return func(*args, **kwargs)
+    finally:
+        _vote_signals.suspended = False
+
+
+def suspend_vote_events(func, *args, **kwargs):
+    """ Calls func(*args, **kwargs) without logging vote events, for
+    votes that are only moved around, such as votes restored from an
+    archive.
+
+    """
+    _vote_signals.no_events = True
+    try:
+        return func(*args, **kwargs)
+    finally:
+        _vote_signals.no_events = False
+
+
+def normalize_choice(text):
+    """ The key of a choice text under which choices of a poll count
+    as the same, ignoring case, spacing and Unicode representation.
+
+    """
+    text = unicodedata.normalize('NFKC', force_unicode(text))
+    return u' '.join(text.split()).lower()[:255]
+
+
+def with_suffix(text, suffix, max_length):
+    """ Appends `suffix` to `text`, cutting `text` short to fit. """
+
+    return text[:max_length - len(suffix)] + suffix
+
+
+def _next(iterator):
+    try:
+        return iterator.next()
+    except StopIteration:
+        return None
+
+
+def merge_sorted(first, second):
+    """ Merges two sorted iterables (of anything but None) into one
+    sorted iterator.
+
+    """
+    first, second = iter(first), iter(second)
+    a, b = _next(first), _next(second)
+    while a is not None or b is not None:
+        if b is None or (a is not None and a <= b):
+            yield a
+            a = _next(first)
+        else:
+            yield b
+            b = _next(second)
+
+
+def chunked(iterable, size):
+    """ Yields the items of an iterable in lists of at most `size`. """
+
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def vote_position(vote):
+    """ The (date_modified, id) of a vote, on which the votes of
+    `VoteManager.history` are ordered. Archived votes, which have no id,
+    take minus the id of their poll, so that they come after the live
+    votes of the same second.
+
+    """
+    if vote.id is None:
+        return vote.date_modified, -vote.choice.poll_id
+    return vote.date_modified, vote.id
+
+
+def trending_weight(when):
+    """ Returns the (log2) weight of a vote cast at `when`. """
+
+    delta = when - TRENDING_EPOCH
+    seconds = delta.days * 86400 + delta.seconds
+    return float(seconds) / TRENDING_HALF_LIFE
+
+
+def add_trending_weight(score, weight):
+    """ Adds a vote weight to a score, both in log2 space. """
+
+    high, low = max(score, weight), min(score, weight)
+    return high + math.log(1.0 + 2.0 ** (low - high), 2)
+
+
+# Number of votes for a choice: live, anonymous and archived
+CHOICE_VOTES_SQL = ('(SELECT COUNT(*) FROM polls_vote '
+                    'WHERE polls_vote.choice_id = polls_choice.id) '
+                    '+ (SELECT COUNT(*) FROM polls_anonymousvote '
+                    'WHERE polls_anonymousvote.choice_id = polls_choice.id) '
+                    '+ polls_choice.archived_votes')
+
+
+class PollManager(TenantManager):
+    def live(self):
+        return self.filter(deleted_at__isnull=True)
     def recent(self):
-        return self.exclude(status='DRAFT') \
+        return self.live() \
+                   .exclude(status='DRAFT') \
                    .order_by('-published_at')
+    def trending(self):
+        return self.live() \
+                   .exclude(status='DRAFT') \
+                   .order_by('-trending_score')
     def created_by_user(self, userid):
-        return self.filter(user=userid) \
+        return self.live() \
+                   .filter(user=userid) \
                    .order_by('-published_at')
-    def answered_by_user(self, userid):
-        return self.filter(choice__vote__user=userid) \
-                   .exclude(status='DRAFT') \
-                   .order_by('-choice__vote__date_modified')
+    def answered_by_user(self, userid, count):
+        """ The `count` published polls that a user has most recently
+        voted on, including polls whose votes have been archived (see
+        `VoteManager.history`). Returns a list.
+
+        """
+        return [vote.choice.poll for vote in
+                Vote.objects.history(userid, count)]
+    def closed(self):
+        return self.live() \
+                   .filter(status='CLOSED') \
+                   .order_by('-closed_at')
+    def purge_deleted(self, chunk_size=1000, pause=0):
+        """ Removes soft-deleted polls, their choices and votes.
+
+        Votes, anonymous ones too, are deleted in chunks (see
+        `VoteManager.delete_in_chunks`) before the choices and the poll
+        itself, so that the cascading delete has nothing left to
+        collect. Returns the number of purged polls and votes.
+
+        """
+        polls = votes = 0
+        for pollid in self.filter(deleted_at__isnull=False) \
+                          .values_list('id', flat=True):
+            votes += Vote.objects.delete_in_chunks(chunk_size,
+                                                   pause,
+                                                   choice__poll=pollid)
+            votes += AnonymousVote.objects.delete_in_chunks(chunk_size,
+                                                            pause,
+                                                            poll=pollid)
+            transaction.commit_on_success(self._delete_poll)(pollid)
+            polls += 1
+        return polls, votes
+    def _delete_poll(self, pollid):
+        VoterSet.objects.invalidate(pollid)
+        Choice.objects.filter(poll=pollid).delete()
+        self.filter(id=pollid).delete()
+    def voters(self, pollid):
+        """ Returns the ids of the users who have voted on a poll. """
+
+        return VoterSet.objects.get_voters(pollid)
+    def has_voted(self, pollid, userid):
+        return userid in VoterSet.objects.get_voters(pollid)
+    def distinct_voters(self, pollids):
+        """ Returns the ids of the users who have voted on any of the
+        polls. Use len() on the result to count them.
+
+        """
+        voters = RoaringBitmap()
+        for pollid in pollids:
+            voters = voters | VoterSet.objects.get_voters(pollid)
+        return voters
+    def common_voters(self, pollids):
+        """ Returns the ids of the users who have voted on all polls. """
+
+        voters = None
+        for pollid in pollids:
+            poll_voters = VoterSet.objects.get_voters(pollid)
+            voters = poll_voters if voters is None else voters & poll_voters
+        return voters or RoaringBitmap()
+    def due_to_publish(self, now):
+        return self.live() \
+                   .filter(status='DRAFT', publish_at__lte=now) \
+                   .order_by()
+    def due_to_close(self, now):
+        return self.live() \
+                   .filter(status='PUBLISHED', close_at__lte=now) \
+                   .order_by()
+    def next_scheduled(self):
+        """ Returns the earliest time a poll is scheduled to be published
+        or closed, or None if there is nothing scheduled.
+
+        Each of the two lookups is a single seek in an index on
+        (deleted_at, status, publish_at/close_at), see migration 0008.
+
+        """
+        publish_at = self.live().filter(status='DRAFT') \
+                         .aggregate(due=Min('publish_at'))['due']
+        close_at = self.live().filter(status='PUBLISHED') \
+                       .aggregate(due=Min('close_at'))['due']
+        due = [when for when in (publish_at, close_at) if when is not None]
+        return min(due) if due else None
+    def apply_schedule(self, now=None, batch_size=100):
+        """ Publishes and closes the polls that are due at `now`, in
+        batches of `batch_size` polls per transaction. Returns the number
+        of published and closed polls.
+
+        """
+        if now is None:
+            now = datetime.datetime.now()
+        published = self._apply_transitions(
+            self.due_to_publish(now),
+            batch_size,
+            status='PUBLISHED',
+            published_at=now,
+            publish_at=None,
+            date_modified=now)
+        for pollid in published:
+            # Give new polls a chance to show up among trending polls
+            self.register_activity(pollid, now)
+        closed = self._apply_transitions(
+            self.due_to_close(now),
+            batch_size,
+            status='CLOSED',
+            closed_at=now,
+            close_at=None,
+            date_modified=now)
+        return len(published), len(closed)
+    def _apply_transitions(self, due, batch_size, **values):
+        done = []
+        while True:
+            ids = list(due.values_list('id', flat=True)[:batch_size])
+            if not ids:
+                return done
+            transaction.commit_on_success(self.filter(id__in=ids).update)(
+                **values)
+            # update() sends no signals
+            for pollid in ids:
+                bump_poll_generation(pollid)
+            done.extend(ids)
+    def register_activity(self, pollid, when):
+        """ Adds the weight of an event (a vote or the poll being
+        published) at `when` to the poll's trending score.
+
+        This is a constant-time read and write of a single row. Two
+        concurrent votes may race and have one of their weights lost,
+        which is acceptable for a popularity measure.
+
+        """
+        scores = self.filter(id=pollid) \
+                     .values_list('trending_score', flat=True)
+        if not scores:
+            return
+        score = add_trending_weight(scores[0], trending_weight(when))
+        # update() keeps date_modified intact as this is not an edit
+        self.filter(id=pollid).update(trending_score=score)
 
 
 class Poll(Model):
@@ -28,35 +349,42 @@ class Poll(Model):
     choices that users can pick amongst. Users vote by selecting
     one choice, or optionally, create a new choice _and_ vote on it).
 
-    By answering a poll, a user increases the poll's popularity.
+    By answering a poll, a user increases the poll's popularity. The
+    popularity decays over time (see `TRENDING_HALF_LIFE`) so that
+    polls with many recent votes are trending.
 
     Polls are created by a specific user, which becomes the poll's
     administrator. Polls are either in draft mode or published.
 
     Polls have a title and an optional description (markdown).
 
+    Polls, their choices and votes belong to a tenant (see tenancy.py).
+
     """
 
     STATUS_CHOICES = (('DRAFT', _("Draft")),
                       ('PUBLISHED', _("Published")),
                       ('CLOSED', _("Closed")))
 
+    # Unique per tenant, like titles
     slug = AutoSlugField(_("Slug"),
                          populate_from='title',
                          editable=False,
-                         unique=True,
+                         unique_with='tenant',
                          blank=True,
                          max_length=80)
     user = ForeignKey(User,
                       verbose_name=_('created by'),
                       db_index=True)
     title = CharField(_('title'),
-                      max_length=140,
-                      unique=True)
+                      max_length=140)
     description = TextField(_('description'),
                             blank=True)
     allow_new_choices = BooleanField(_('allow users to add choices?'),
                                      default=False)
+    allow_anonymous_votes = BooleanField(_('allow voting without logging '
+                                           'in?'),
+                                         default=False)
     status = CharField(_("Status"),
                        db_index=True,
                        max_length=32,
@@ -72,14 +400,81 @@ class Poll(Model):
     date_modified = DateTimeField(_('modified (date)'),
                                   db_index=True,
                                   auto_now=True)
+    trending_score = FloatField(_('trending score'),
+                                db_index=True,
+                                default=0.0,
+                                editable=False)
+    deleted_at = DateTimeField(_('deleted at'),
+                               null=True,
+                               blank=True,
+                               db_index=True,
+                               editable=False)
+    closed_at = DateTimeField(_('closed at'),
+                              null=True,
+                              blank=True,
+                              db_index=True,
+                              editable=False)
+    archived_at = DateTimeField(_('votes archived at'),
+                                null=True,
+                                blank=True,
+                                editable=False)
+    publish_at = DateTimeField(_('publish at'),
+                               null=True,
+                               blank=True)
+    close_at = DateTimeField(_('close at'),
+                             null=True,
+                             blank=True)
+    tenant = CharField(_('tenant'),
+                       max_length=32,
+                       default=get_current_tenant,
+                       editable=False)
     objects = PollManager()
 
     def __unicode__(self):
         return self.title
 
     def number_of_votes(self):
-        q = self.choice_set.aggregate(num_votes=Count('vote'))
-        return q['num_votes']
+        choices = self.choice_set.filter(deleted_at__isnull=True)
+        q = choices.aggregate(num_votes=Count('vote'))
+        num_votes = q['num_votes']
+        num_votes += AnonymousVote.objects.filter(poll=self.id,
+                                                  choice__in=choices).count()
+        if self.archived_at:
+            q = choices.aggregate(archived_votes=Sum('archived_votes'))
+            num_votes += q['archived_votes'] or 0
+        return num_votes
+
+    def archived_vote(self, userid):
+        """ Returns the id of the choice the user voted for, if the
+        vote has been archived, or None.
+
+        """
+        if not self.archived_at:
+            return None
+        try:
+            return self.votearchive.vote_for_user(userid)
+        except VoteArchive.DoesNotExist:
+            return None
+
+    def soft_delete(self):
+        """ Hides the poll at once. Removing it and its votes is left
+        to `PollManager.purge_deleted`, as it may take a long time.
+        Meanwhile the title and slug get a suffix, so that new polls
+        may take them.
+
+        """
+        self.deleted_at = datetime.datetime.now()
+        self.title = with_suffix(self.title, u" (deleted %d)" % self.id,
+                                 self._meta.get_field('title').max_length)
+        self.slug = with_suffix(self.slug, u"-deleted-%d" % self.id,
+                                self._meta.get_field('slug').max_length)
+        Poll.objects.filter(id=self.id).update(deleted_at=self.deleted_at,
+                                               title=self.title,
+                                               slug=self.slug)
+        bump_poll_generation(self.id)
+
+    def is_deleted(self):
+        return (self.deleted_at is not None)
 
     def is_draft(self):
         return (self.status == 'DRAFT')
@@ -91,15 +486,302 @@ class Poll(Model):
         return (self.status == 'CLOSED')
 
     class Meta:
+        unique_together = (('tenant', 'title'), ('tenant', 'slug'))
         ordering = ['-published_at']
         verbose_name = _('poll')
         verbose_name_plural = _('polls')
 
 
-class ChoiceManager(Manager):
+class ChoiceManager(TenantManager):
+    def live(self):
+        return self.filter(deleted_at__isnull=True)
     def get_choices_and_votes_for_poll(self, pollid):
-        return self.filter(poll=pollid) \
-                   .annotate(num_votes=Count('vote'))
+        return self.live() \
+                   .filter(poll=pollid) \
+                   .extra(select={'num_votes': CHOICE_VOTES_SQL})
+    def ranked_for_poll(self, pollid):
+        """ Like `get_choices_and_votes_for_poll`, but most voted for
+        first.
+
+        """
+        return self.get_choices_and_votes_for_poll(pollid) \
+                   .extra(order_by=['-num_votes', 'position', 'id'])
+    def ranking(self, pollid, generation=None):
+        """ Returns the live choices of a poll as (choice id, number of
+        votes) tuples, most voted for first (see `ranked_for_poll`), and
+        the generation of the poll that they were counted at.
+
+        Rankings are cached under the generation (see caching.py), the
+        current one unless given. Paging through the ranking of a given
+        generation neither skips nor repeats choices whose votes change
+        meanwhile, and counts the votes once rather than for every page.
+        Once the ranking has expired it is counted afresh.
+
+        """
+        if generation is None:
+            generation = poll_generation(pollid)
+        key = versioned_key('ranking', generation, pollid)
+        ranking = cache.get(key)
+        if ranking is None:
+            ranking = [(row['id'], row['num_votes']) for row in
+                       self.ranked_for_poll(pollid).values('id', 'num_votes')]
+            cache.set(key, ranking, RANKING_CACHE_TIMEOUT)
+        return ranking, generation
+    def top_for_poll(self, pollid, limit):
+        """ Returns the `limit` most voted for live choices of a poll
+        with their votes, the number of choices left out, and the
+        generation of the current `ranking`, from which the choices left
+        out are to be paged.
+
+        Polls with no more than `limit` choices have all of them returned
+        in their usual order.
+
+        """
+        ranking, generation = self.ranking(pollid)
+        votes = dict(ranking[:limit])
+        choices = list(self.live().filter(id__in=votes.keys()))
+        for choice in choices:
+            choice.num_votes = votes[choice.id]
+        if len(ranking) <= limit:
+            choices.sort(key=lambda c: (c.position, c.date_created))
+            return choices, 0, generation
+        choices.sort(key=lambda c: (-c.num_votes, c.position, c.id))
+        return choices, len(ranking) - limit, generation
+    def tallies_for_polls(self, pollids):
+        """ Returns a dict mapping each poll id to a list of the poll's
+        choices as (choice id, choice, number of votes) tuples.
+
+        Tallies are cached per poll under the poll's generation (see
+        caching.py), so only polls that have changed since they were
+        cached are looked up, all of them in a single query.
+
+        """
+        keys = dict([(key, pollid) for pollid, key in
+                     poll_keys('tally', pollids).items()])
+        cached = cache.get_many(keys.keys())
+        tallies = {}
+        for key, pollid in keys.items():
+            if key in cached:
+                tallies[pollid] = cached[key]
+        misses = [pollid for pollid in pollids if pollid not in tallies]
+        if misses:
+            for pollid in misses:
+                tallies[pollid] = []
+            for row in self.live() \
+                           .filter(poll__in=misses) \
+                           .extra(select={'num_votes': CHOICE_VOTES_SQL}) \
+                           .values('id', 'poll', 'choice', 'num_votes'):
+                tallies[row['poll']].append((row['id'],
+                                             row['choice'],
+                                             row['num_votes']))
+            for key, pollid in keys.items():
+                if pollid in misses:
+                    cache.set(key, tallies[pollid], TALLY_CACHE_TIMEOUT)
+        return tallies
+    def get_or_restore(self, poll, choice, user):
+        """ Like get_or_create, but choices are looked up by their
+        normalized text (see `normalize_choice`). A soft-deleted choice
+        with the same text is moved out of the way of the unique (poll,
+        normalized) constraint, by a suffix that no normalized text has,
+        and left to `purge_deleted` along with its votes.
+
+        """
+        position = self.next_position(poll)
+        normalized = normalize_choice(choice)
+        obj, created = self.get_or_create(poll=poll,
+                                          normalized=normalized,
+                                          defaults={'choice': choice,
+                                                    'user': user,
+                                                    'position': position})
+        if obj.deleted_at is not None:
+            max_length = obj._meta.get_field('normalized').max_length
+            self.filter(id=obj.id).update(normalized=with_suffix(
+                normalized, u"\tdeleted %d" % obj.id, max_length))
+            obj = self.create(poll=poll,
+                              choice=choice,
+                              user=user,
+                              position=position)
+            created = True
+        return obj, created
+    def next_position(self, poll):
+        """ Returns the position after the last choice of a poll. """
+
+        q = self.filter(poll=poll).aggregate(last=Max('position'))
+        if q['last'] is None:
+            return 0
+        return q['last'] + 1
+    def replace_choices(self, poll, user, texts):
+        """ Makes `texts` the choices of a poll, in that order.
+
+        Choices not in `texts` are soft-deleted and new ones are
+        inserted. Soft-deleted choices added again are new choices, as
+        in `get_or_restore`. The existing choices are fetched in a
+        single query and all changes are applied in bulk, in one
+        transaction.
+
+        """
+        return transaction.commit_on_success(self._replace_choices)(
+            poll, user, texts)
+    def _replace_choices(self, poll, user, texts):
+        now = datetime.datetime.now()
+        keys = [normalize_choice(text) for text in texts]
+        existing = dict([(c.normalized, c) for c in
+                         self.filter(poll=poll, normalized__in=keys)])
+
+        deleted = self.live() \
+                      .filter(poll=poll) \
+                      .exclude(normalized__in=keys) \
+                      .update(deleted_at=now)
+
+        qn = connection.ops.quote_name
+        cursor = connection.cursor()
+        # Soft-deleted choices are moved out of the way of the new ones
+        # and left to `purge_deleted` along with their votes
+        max_length = self.model._meta.get_field('normalized').max_length
+        aside = [(with_suffix(key, u"\tdeleted %d" % c.id, max_length), c.id)
+                 for key, c in existing.items() if c.deleted_at is not None]
+        if aside:
+            cursor.executemany('UPDATE %s SET %s = %%s WHERE %s = %%s' %
+                               (qn(self.model._meta.db_table),
+                                qn('normalized'), qn('id')),
+                               aside)
+            existing = dict([(key, c) for key, c in existing.items()
+                             if c.deleted_at is None])
+        new = [(poll.id, text, user.id,
+                connection.ops.value_to_db_datetime(now), 0, position,
+                poll.tenant, key)
+               for position, (text, key) in enumerate(zip(texts, keys))
+               if key not in existing]
+        if new:
+            cursor.executemany('INSERT INTO %s (%s, %s, %s, %s, %s, %s, %s, '
+                               '%s) VALUES (%%s, %%s, %%s, %%s, %%s, %%s, '
+                               '%%s, %%s)' %
+                               (qn(self.model._meta.db_table),
+                                qn('poll_id'), qn('choice'), qn('user_id'),
+                                qn('date_created'), qn('archived_votes'),
+                                qn('position'), qn('tenant'),
+                                qn('normalized')),
+                               new)
+        # Existing choices may have moved or been respelled
+        moved = [(position, text, existing[key].id)
+                 for position, (text, key) in enumerate(zip(texts, keys))
+                 if key in existing and
+                    (existing[key].position != position or
+                     existing[key].choice != text)]
+        if moved:
+            cursor.executemany('UPDATE %s SET %s = %%s, %s = %%s '
+                               'WHERE %s = %%s' %
+                               (qn(self.model._meta.db_table),
+                                qn('position'), qn('choice'), qn('id')),
+                               moved)
+        if aside or new or moved:
+            # Raw SQL does not tell the transaction management about it
+            transaction.set_dirty()
+        if deleted:
+            VoterSet.objects.invalidate(poll.id)
+        bump_poll_generation(poll.id)
+    def voters(self, choiceid):
+        """ Returns the ids of the users who have voted for a choice. """
+
+        choice = self.values_list('poll', flat=True).get(id=choiceid)
+        return VoterSet.objects.get_voters(choice, choiceid)
+    def purge_deleted(self, chunk_size=1000, pause=0):
+        """ Removes soft-deleted choices of live polls and their votes,
+        which are logged as retracted. Returns the number of purged
+        choices and votes.
+
+        """
+        choices = votes = 0
+        for choiceid, pollid in self.filter(deleted_at__isnull=False,
+                                            poll__deleted_at__isnull=True) \
+                                    .values_list('id', 'poll'):
+            VoteEvent.objects.retract_votes(
+                pollid, Vote.objects.filter(choice=choiceid))
+            VoteEvent.objects.flush()
+            votes += Vote.objects.delete_in_chunks(chunk_size,
+                                                   pause,
+                                                   choice=choiceid)
+            votes += AnonymousVote.objects.delete_in_chunks(chunk_size,
+                                                            pause,
+                                                            choice=choiceid)
+            transaction.commit_on_success(self._delete_choice)(choiceid)
+            choices += 1
+        return choices, votes
+    def _delete_choice(self, choiceid):
+        self.filter(id=choiceid).delete()
+    def merge_duplicates(self, chunk_size=1000):
+        """ Merges the choices of a poll that have the same normalized
+        text (see `normalize_choice`) into the oldest live one. Votes for
+        the other live choices, live, anonymous and archived alike, are
+        moved to it in bulk, in a transaction per poll. Votes for
+        soft-deleted duplicates are then retracted and deleted in chunks
+        (see `VoteManager.delete_in_chunks`), anonymous ones too, and the
+        duplicates with them. Returns the number of choices merged away.
+
+        """
+        duplicates = list(self.order_by()
+                              .values('poll', 'normalized')
+                              .annotate(count=Count('id'))
+                              .filter(count__gt=1))
+        merged = 0
+        for row in duplicates:
+            pollid = row['poll']
+            others = transaction.commit_on_success(self._merge_duplicates)(
+                pollid, row['normalized'])
+            # The votes left are those of soft-deleted duplicates
+            for choiceid in others:
+                VoteEvent.objects.retract_votes(
+                    pollid, Vote.objects.filter(choice=choiceid))
+                VoteEvent.objects.flush()
+                Vote.objects.delete_in_chunks(chunk_size, choice=choiceid)
+                AnonymousVote.objects.delete_in_chunks(chunk_size,
+                                                       choice=choiceid)
+                transaction.commit_on_success(self._delete_choice)(choiceid)
+            VoterSet.objects.invalidate(pollid)
+            bump_poll_generation(pollid)
+            merged += len(others)
+        return merged
+    def _merge_duplicates(self, pollid, normalized):
+        """ Moves the votes of the live duplicates to the choice kept,
+        and soft-deletes them. Returns the ids of the duplicates.
+
+        """
+        choices = list(self.filter(poll=pollid, normalized=normalized)
+                           .order_by('id'))
+        live = [c for c in choices if c.deleted_at is None]
+        keep = (live or choices)[0]
+        moved = [c.id for c in live if c.id != keep.id]
+        others = [c.id for c in choices if c.id != keep.id]
+
+        if moved:
+            votes = Vote.objects.filter(choice__in=moved)
+            for userid, choiceid in votes.order_by() \
+                                         .values_list('user', 'choice') \
+                                         .iterator():
+                VoteEvent.objects.record('CHANGE', pollid, userid, keep.id,
+                                         choiceid)
+            VoteEvent.objects.flush()
+            votes.update(choice=keep)
+            AnonymousVote.objects.filter(choice__in=moved).update(choice=keep)
+
+            archived = sum([c.archived_votes for c in live if c.id in moved])
+            self.filter(id=keep.id) \
+                .update(archived_votes=F('archived_votes') + archived)
+            for archive in VoteArchive.objects.filter(poll=pollid):
+                rows = archive.rows()
+                archive.set_rows([(userid,
+                                   keep.id if choiceid in moved else choiceid,
+                                   created, modified)
+                                  for userid, choiceid, created, modified
+                                  in rows])
+                archive.save()
+                UserVoteArchive.objects.add_votes(
+                    pollid, [(userid, keep.id, created, modified)
+                             for userid, choiceid, created, modified
+                             in rows if choiceid in moved])
+            self.filter(id__in=moved).update(
+                deleted_at=datetime.datetime.now())
+        return others
 
 class Choice(Model):
     """ A poll consists of multiple choices which users can "vote" on. """
@@ -109,27 +791,264 @@ class Choice(Model):
                       db_index=True)
     choice = CharField(_('choice'),
                       max_length=255)
+    # See normalize_choice, kept up to date by normalize_choice_text
+    normalized = CharField(_('normalized choice'),
+                           max_length=255,
+                           editable=False)
     user = ForeignKey(User,
                       verbose_name=_('added by'),
                       db_index=True)
     date_created = DateTimeField(_('created (date)'),
                                  db_index=True,
                                  auto_now_add=True)
+    deleted_at = DateTimeField(_('deleted at'),
+                               null=True,
+                               blank=True,
+                               db_index=True,
+                               editable=False)
+    archived_votes = PositiveIntegerField(_('archived votes'),
+                                          default=0,
+                                          editable=False)
+    position = PositiveIntegerField(_('position'),
+                                    default=0,
+                                    editable=False)
+    tenant = CharField(_('tenant'),
+                       max_length=32,
+                       default=get_current_tenant,
+                       editable=False)
     objects = ChoiceManager()
 
     def __unicode__(self):
         return self.choice
 
+    def soft_delete(self):
+        """ Hides the choice at once. Removing it and its votes is left
+        to `ChoiceManager.purge_deleted`.
+
+        """
+
+        self.deleted_at = datetime.datetime.now()
+        Choice.objects.filter(id=self.id).update(deleted_at=self.deleted_at)
+        VoterSet.objects.invalidate(self.poll_id)
+        bump_poll_generation(self.poll_id)
+
     class Meta:
-        unique_together = (('poll', 'choice'),)
-        ordering = ['date_created']
+        unique_together = (('poll', 'normalized'),)
+        ordering = ['position', 'date_created']
         verbose_name = _('choice')
         verbose_name_plural = _('choices')
 
 
-class VoteManager(Manager):
+class VoteManager(TenantManager):
     def votes_for_poll(self, pollid):
-        return self.filter(choice__poll=pollid)
+        return self.filter(choice__poll=pollid,
+                           choice__deleted_at__isnull=True)
+    def user_vote_for_poll(self, userid, pollid):
+        # At most one vote, no need to order
+        return self.filter(user=userid,
+                           choice__poll=pollid,
+                           choice__deleted_at__isnull=True) \
+                   .order_by()
+    def by_user(self, userid, before=None):
+        """ Votes of a user on published polls, most recently modified
+        first, with their choices and polls joined in.
+
+        For keyset pagination `before` is the (date_modified, id) of the
+        last vote of the previous page. The order is served by the index
+        on (tenant, user_id, date_modified, id).
+
+        """
+        votes = self.filter(user=userid,
+                            choice__deleted_at__isnull=True,
+                            choice__poll__deleted_at__isnull=True) \
+                    .exclude(choice__poll__status='DRAFT')
+        if before is not None:
+            date_modified, voteid = before
+            votes = votes.filter(Q(date_modified__lt=date_modified) |
+                                 Q(date_modified=date_modified,
+                                   id__lt=voteid))
+        return votes.select_related('choice', 'choice__poll') \
+                    .order_by('-date_modified', '-id')
+    def history(self, userid, count, before=None):
+        """ The `count` most recently modified votes of a user on
+        published polls, like `by_user` but including archived votes
+        (see `UserVoteArchive`). Returns a list.
+
+        Archived votes are unsaved votes without an id; see
+        `vote_position` for how they are paged.
+
+        """
+        votes = list(self.by_user(userid, before)[:count])
+        archived = [(from_timestamp(modified), -pollid, choiceid)
+                    for modified, pollid, choiceid in
+                    UserVoteArchive.objects.votes_for_user(userid)]
+        if before is not None:
+            archived = [row for row in archived if row[:2] < before]
+        archived.sort(reverse=True)
+        # Choices are fetched a page at a time, skipping those of
+        # deleted and draft polls, until there are enough votes
+        found = 0
+        for rows in chunked(archived, count):
+            choices = dict([(c.id, c) for c in
+                            Choice.objects.filter(
+                                id__in=[row[2] for row in rows],
+                                deleted_at__isnull=True,
+                                poll__deleted_at__isnull=True)
+                            .exclude(poll__status='DRAFT')
+                            .select_related('poll')])
+            for date_modified, key, choiceid in rows:
+                if choiceid in choices:
+                    votes.append(Vote(user_id=userid,
+                                      choice=choices[choiceid],
+                                      date_modified=date_modified))
+                    found += 1
+            if found >= count:
+                break
+        votes.sort(key=vote_position, reverse=True)
+        return votes[:count]
+    def delete_in_chunks(self, chunk_size=1000, pause=0, **filters):
+        """ Deletes the votes matching `filters`, at most `chunk_size`
+        at a time and each chunk in a short transaction of its own, so
+        that neither memory use nor locks grow with the number of votes.
+        Sleeps `pause` seconds between chunks to let other writers in.
+        Returns the number of deleted votes.
+
+        """
+        deleted = 0
+        while True:
+            ids = list(self.filter(**filters)
+                           .order_by()
+                           .values_list('id', flat=True)[:chunk_size])
+            if not ids:
+                return deleted
+            suspend_vote_signals(transaction.commit_on_success(self._delete_ids),
+                                 ids)
+            deleted += len(ids)
+            if pause:
+                time.sleep(pause)
+    def _delete_ids(self, ids):
+        self.filter(id__in=ids).delete()
+    def might_have_voted(self, pollid, userid):
+        """ Checks a poll's Bloom filter of voters. A False answer means
+        the user has not voted on the poll and the database need not be
+        asked. A True answer may be wrong, see `record_filter_miss`.
+
+        The filter is read from the cache and rebuilt from the votes
+        when missing or full.
+
+        """
+        key = self._voter_filter_key(pollid)
+        voters = cache.get(key)
+        if voters is not None and voters.count > voters.capacity:
+            self._drop_voter_filter(pollid)
+            key = self._voter_filter_key(pollid)
+            voters = None
+        if voters is None:
+            voters = self.build_voter_filter(pollid)
+            # A filter stored meanwhile may have voters this one lacks
+            cache.add(key, voters, VOTER_FILTER_CACHE_TIMEOUT)
+        if voters.might_contain(userid):
+            _incr_stat('polls:voter-filter:positives')
+            return True
+        _incr_stat('polls:voter-filter:negatives')
+        return False
+    def record_filter_miss(self):
+        """ Records that `might_have_voted` answered a false positive. """
+
+        _incr_stat('polls:voter-filter:false-positives')
+    def build_voter_filter(self, pollid):
+        """ Builds a Bloom filter of the users who have voted on a
+        poll, with room for twice as many voters.
+
+        """
+        userids = list(self.votes_for_poll(pollid)
+                           .order_by()
+                           .values_list('user', flat=True))
+        try:
+            archive = VoteArchive.objects.get(poll=pollid)
+            userids.extend(unpack(archive.user_ids))
+        except VoteArchive.DoesNotExist:
+            pass
+        voters = BloomFilter(max(2 * len(userids),
+                                 VOTER_FILTER_MIN_CAPACITY),
+                             VOTER_FILTER_ERROR_RATE)
+        for userid in userids:
+            voters.add(userid)
+        return voters
+    def _voter_filter_key(self, pollid):
+        # A version of its own, as the poll's generation changes with
+        # every vote
+        return versioned_key('voter-filter',
+                             get_version('voter-filter:%d' % pollid),
+                             pollid)
+    def _drop_voter_filter(self, pollid):
+        bump_version('voter-filter:%d' % pollid)
+    def add_to_voter_filter(self, pollid, userid):
+        """ Adds a voter to a poll's cached Bloom filter.
+
+        Updates are serialized by a lock in the cache. If the lock is
+        taken, or there is no filter (one may be being built from votes
+        read before this one), the filter is dropped instead, to be
+        rebuilt, so that no voter is ever missing from it.
+
+        A filter may still be built from the votes before this one is
+        committed, so in a managed transaction the voter is added again
+        by `add_committed_voters`.
+
+        """
+        if transaction.is_managed():
+            voters = getattr(_voter_filters, 'voters', None)
+            if voters is None:
+                voters = _voter_filters.voters = set()
+            voters.add((pollid, userid))
+        self._add_to_voter_filter(pollid, userid)
+    def add_committed_voters(self):
+        """ Adds the voters of this thread's transaction to the filters
+        again, once it has been committed. Called by
+        `CommittedCacheMiddleware`.
+
+        """
+        voters = getattr(_voter_filters, 'voters', None)
+        if not voters:
+            return
+        _voter_filters.voters = set()
+        for pollid, userid in voters:
+            self._add_to_voter_filter(pollid, userid)
+    def _add_to_voter_filter(self, pollid, userid):
+        lock = 'polls:voter-filter-lock:%d' % pollid
+        if not cache.add(lock, 1, VOTER_FILTER_LOCK_TIMEOUT):
+            self._drop_voter_filter(pollid)
+            return
+        try:
+            key = self._voter_filter_key(pollid)
+            voters = cache.get(key)
+            if voters is None:
+                self._drop_voter_filter(pollid)
+            else:
+                voters.add(userid)
+                cache.set(key, voters, VOTER_FILTER_CACHE_TIMEOUT)
+        finally:
+            cache.delete(lock)
+    def voter_filter_stats(self):
+        """ Returns the number of positive, negative and false positive
+        answers of `might_have_voted` and the observed false positive
+        rate (false positives out of all users that had not voted).
+
+        """
+        stats = cache.get_many(['polls:voter-filter:positives',
+                                'polls:voter-filter:negatives',
+                                'polls:voter-filter:false-positives'])
+        positives = stats.get('polls:voter-filter:positives', 0)
+        negatives = stats.get('polls:voter-filter:negatives', 0)
+        false_positives = stats.get('polls:voter-filter:false-positives', 0)
+        if false_positives + negatives:
+            rate = float(false_positives) / (false_positives + negatives)
+        else:
+            rate = 0.0
+        return {'positives': positives,
+                'negatives': negatives,
+                'false_positives': false_positives,
+                'false_positive_rate': rate}
 
 
 class Vote(Model):
@@ -147,9 +1066,1101 @@ class Vote(Model):
     date_modified = DateTimeField(_('modified (date)'),
                                   db_index=True,
                                   auto_now=True)
+    tenant = CharField(_('tenant'),
+                       max_length=32,
+                       default=get_current_tenant,
+                       editable=False)
     objects = VoteManager()
 
     class Meta:
         ordering = ['-date_created']
         verbose_name = _('vote')
         verbose_name_plural = _('votes')
+
+
+class AnonymousVoteManager(TenantManager):
+    def token_hash(self, pollid, token):
+        """ The stored form of a voter token. It is salted with the
+        secret key and the poll, so that neither the token nor the
+        votes of one voter in different polls can be told from it.
+
+        """
+        return hashlib.sha256('%s:%d:%s' % (settings.SECRET_KEY, pollid,
+                                            token)).hexdigest()
+    def vote_for_token(self, pollid, token):
+        """ Returns the id of the choice voted for with `token`, or None. """
+
+        try:
+            return self.filter(poll=pollid,
+                               token_hash=self.token_hash(pollid, token),
+                               choice__deleted_at__isnull=True) \
+                       .values_list('choice', flat=True).get()
+        except self.model.DoesNotExist:
+            return None
+    def cast(self, choice, token):
+        """ Records a vote for `choice`, replacing any earlier vote cast
+        in the poll with `token`. Returns True if the vote is new.
+
+        """
+        token_hash = self.token_hash(choice.poll_id, token)
+        now = datetime.datetime.now()
+        votes = self.filter(poll=choice.poll_id, token_hash=token_hash)
+        created = False
+        if not votes.update(choice=choice, date_modified=now):
+            # The unique (poll, token_hash) index settles races between
+            # two first votes with the same token
+            sid = transaction.savepoint()
+            try:
+                self.create(poll_id=choice.poll_id,
+                            choice=choice,
+                            token_hash=token_hash)
+                transaction.savepoint_commit(sid)
+                created = True
+            except IntegrityError:
+                transaction.savepoint_rollback(sid)
+                votes.update(choice=choice, date_modified=now)
+        transaction.commit_unless_managed()
+        bump_poll_generation(choice.poll_id)
+        return created
+    def delete_in_chunks(self, chunk_size=1000, pause=0, **filters):
+        """ Deletes the anonymous votes matching `filters` like
+        `VoteManager.delete_in_chunks`. Returns the number of deleted
+        votes.
+
+        """
+        deleted = 0
+        while True:
+            ids = list(self.filter(**filters)
+                           .order_by()
+                           .values_list('id', flat=True)[:chunk_size])
+            if not ids:
+                return deleted
+            transaction.commit_on_success(self._delete_ids)(ids)
+            deleted += len(ids)
+            if pause:
+                time.sleep(pause)
+    def _delete_ids(self, ids):
+        self.filter(id__in=ids).delete()
+
+
+class AnonymousVote(Model):
+    """ A vote by a visitor who is not logged in, identified only by a
+    hashed token kept in a cookie (see `AnonymousVoteManager`). Counted
+    together with regular votes.
+
+    """
+    poll = ForeignKey(Poll,
+                      verbose_name=_('poll'))
+    choice = ForeignKey(Choice,
+                        verbose_name=_('choice'),
+                        db_index=True)
+    token_hash = CharField(_('token hash'),
+                           max_length=64)
+    date_created = DateTimeField(_('created (date)'),
+                                 db_index=True,
+                                 auto_now_add=True)
+    date_modified = DateTimeField(_('modified (date)'),
+                                  db_index=True,
+                                  auto_now=True)
+    tenant = CharField(_('tenant'),
+                       max_length=32,
+                       default=get_current_tenant,
+                       editable=False)
+    objects = AnonymousVoteManager()
+
+    class Meta:
+        unique_together = (('poll', 'token_hash'),)
+        verbose_name = _('anonymous vote')
+        verbose_name_plural = _('anonymous votes')
+
+
+class VoteArchiveManager(TenantManager):
+    def polls_to_archive(self, closed_before):
+        """ Polls closed before `closed_before` with unarchived votes. """
+
+        return Poll.objects.live() \
+                           .filter(status='CLOSED',
+                                   closed_at__lt=closed_before) \
+                           .filter(Q(archived_at__isnull=True)|
+                                   Q(archived_at__lt=F('closed_at')))
+
+    def archive_poll(self, poll, chunk_size=1000):
+        """ Moves the votes of a poll into its archive.
+
+        The tallies are frozen into `Choice.archived_votes` and the
+        votes are packed into the poll's `VoteArchive`, merged with any
+        votes archived earlier, and into the `UserVoteArchive` of each
+        voter. Votes are read, deleted and packed `chunk_size` at a
+        time, so that memory use does not grow with the number of
+        votes. Everything happens in one transaction so that no vote is
+        ever counted twice or not at all; as the poll is closed nobody
+        else writes to these rows meanwhile. Returns the number of
+        archived votes.
+
+        """
+        return transaction.commit_on_success(self._archive_poll)(poll,
+                                                                 chunk_size)
+
+    def _archive_poll(self, poll, chunk_size):
+        archive, created = self.get_or_create(poll=poll)
+        tallies = {}
+        archived = (row for rows in archive.row_chunks(chunk_size)
+                        for row in rows)
+        live = self._take_votes(poll, chunk_size, tallies)
+        archive.set_row_chunks(chunked(merge_sorted(archived, live),
+                                       chunk_size))
+        archive.save()
+        for choice_id, count in tallies.items():
+            Choice.objects.filter(id=choice_id) \
+                          .update(archived_votes=F('archived_votes') + count)
+        poll.archived_at = datetime.datetime.now()
+        Poll.objects.filter(id=poll.id).update(archived_at=poll.archived_at)
+        bump_poll_generation(poll.id)
+        return sum(tallies.values())
+
+    def _take_votes(self, poll, chunk_size, tallies):
+        """ Yields the live votes of a poll as archive rows sorted by
+        user id, deleting them and adding them to the voters' archives
+        a chunk at a time. Counts them per choice in `tallies`.
+
+        """
+        votes = Vote.objects.filter(choice__poll=poll.id,
+                                    choice__deleted_at__isnull=True) \
+                            .order_by('user', 'id') \
+                            .values_list('id', 'user', 'choice',
+                                         'date_created', 'date_modified')
+        while True:
+            # Each chunk is deleted before the next is read
+            chunk = list(votes[:chunk_size])
+            if not chunk:
+                break
+            rows = [(user_id, choice_id, to_timestamp(created),
+                     to_timestamp(modified))
+                    for (vote_id, user_id, choice_id, created, modified)
+                    in chunk]
+            UserVoteArchive.objects.add_votes(poll.id, rows)
+            suspend_vote_signals(Vote.objects._delete_ids,
+                                 [row[0] for row in chunk])
+            for row in rows:
+                tallies[row[1]] = tallies.get(row[1], 0) + 1
+                yield row
+
+    def rows_for_poll(self, poll):
+        """ The archived votes of a poll, see `VoteArchive.rows`. """
+
+        try:
+            return self.get(poll=poll).rows()
+        except VoteArchive.DoesNotExist:
+            return []
+
+    def restore_vote(self, poll, user):
+        """ Moves a user's vote out of the archive of a (re-opened) poll
+        so that it can be changed. Returns the new `Vote`, or None if
+        the user has no archived vote.
+
+        """
+        return transaction.commit_on_success(self._restore_vote)(poll, user)
+
+    def _restore_vote(self, poll, user):
+        try:
+            archive = self.get(poll=poll)
+        except VoteArchive.DoesNotExist:
+            return None
+        rows = archive.rows()
+        i = bisect.bisect_left(rows, (user.id,))
+        if i == len(rows) or rows[i][0] != user.id:
+            return None
+        user_id, choice_id, created, modified = rows.pop(i)
+        archive.set_rows(rows)
+        archive.save()
+        Choice.objects.filter(id=choice_id) \
+                      .update(archived_votes=F('archived_votes') - 1)
+        UserVoteArchive.objects.remove_vote(poll.id, user.id)
+        # The vote was logged when cast
+        vote = suspend_vote_events(Vote.objects.create,
+                                   user=user,
+                                   choice=Choice.objects.get(id=choice_id))
+        # Keep the original creation date rather than the auto_now_add one
+        vote.date_created = from_timestamp(created)
+        Vote.objects.filter(id=vote.id).update(date_created=vote.date_created)
+        return vote
+
+
+class VoteArchive(Model):
+    """ The votes of a closed poll, packed into columns of integers.
+
+    Row i of the archive is made up of item i of each column. Rows are
+    sorted on user id so that a user's vote can be found by bisection.
+    Dates are stored with a precision of one second.
+
+    """
+
+    poll = OneToOneField(Poll,
+                         verbose_name=_('poll'))
+    num_votes = PositiveIntegerField(_('number of votes'),
+                                     default=0)
+    user_ids = TextField(_('user ids'),
+                         blank=True)
+    choice_ids = TextField(_('choice ids'),
+                           blank=True)
+    dates_created = TextField(_('votes created (dates)'),
+                              blank=True)
+    dates_modified = TextField(_('votes modified (dates)'),
+                               blank=True)
+    date_created = DateTimeField(_('created (date)'),
+                                 auto_now_add=True)
+    date_modified = DateTimeField(_('modified (date)'),
+                                  auto_now=True)
+    tenant = CharField(_('tenant'),
+                       max_length=32,
+                       default=get_current_tenant,
+                       editable=False)
+    objects = VoteArchiveManager()
+
+    def __unicode__(self):
+        return unicode(self.poll)
+
+    def rows(self):
+        """ Returns the archived votes as a list of (user id, choice id,
+        created, modified) tuples, with dates as timestamps.
+
+        """
+        return zip(unpack(self.user_ids),
+                   unpack(self.choice_ids),
+                   unpack(self.dates_created),
+                   unpack(self.dates_modified))
+
+    def row_chunks(self, chunk_size=1000):
+        """ Yields the archived votes in lists of at most `chunk_size`
+        rows (see `rows`), unpacking the columns as it goes.
+
+        """
+        columns = [unpack_chunks(column, chunk_size)
+                   for column in (self.user_ids, self.choice_ids,
+                                  self.dates_created, self.dates_modified)]
+        for chunks in itertools.izip(*columns):
+            yield zip(*chunks)
+
+    def set_row_chunks(self, chunks):
+        """ Packs lists of rows that are together sorted by user id (see
+        `rows`), a list at a time.
+
+        """
+        packers = [Packer(), Packer(), Packer(), Packer()]
+        for rows in chunks:
+            for packer, column in zip(packers, zip(*rows)):
+                packer.add(column)
+        self.user_ids, self.choice_ids, self.dates_created, \
+            self.dates_modified = [packer.packed() for packer in packers]
+        self.num_votes = packers[0].count
+
+    def set_rows(self, rows):
+        """ Packs a list of rows sorted by user id (see `rows`). """
+
+        columns = zip(*rows) or [(), (), (), ()]
+        self.user_ids = pack(columns[0])
+        self.choice_ids = pack(columns[1])
+        self.dates_created = pack(columns[2])
+        self.dates_modified = pack(columns[3])
+        self.num_votes = len(rows)
+
+    def vote_for_user(self, userid):
+        """ Returns the id of the choice the user voted for, or None. """
+
+        user_ids = unpack(self.user_ids)
+        i = bisect.bisect_left(user_ids, userid)
+        if i == len(user_ids) or user_ids[i] != userid:
+            return None
+        return unpack(self.choice_ids)[i]
+
+    class Meta:
+        verbose_name = _('vote archive')
+        verbose_name_plural = _('vote archives')
+
+
+class UserVoteArchiveManager(TenantManager):
+    def add_votes(self, pollid, rows):
+        """ Adds archived votes on a poll, given as rows of its
+        `VoteArchive`, to the archives of their users.
+
+        """
+        archives = dict([(archive.user_id, archive) for archive in
+                         self.filter(user__in=[row[0] for row in rows])])
+        for (user_id, choice_id, created, modified) in rows:
+            archive = archives.get(user_id) or UserVoteArchive(user_id=user_id)
+            votes = [vote for vote in archive.votes() if vote[1] != pollid]
+            votes.append((modified, pollid, choice_id))
+            archive.set_votes(votes)
+            archive.save()
+
+    def remove_vote(self, pollid, userid):
+        """ Removes a user's archived vote on a poll. """
+
+        try:
+            archive = self.get(user=userid)
+        except UserVoteArchive.DoesNotExist:
+            return
+        archive.set_votes([vote for vote in archive.votes()
+                           if vote[1] != pollid])
+        archive.save()
+
+    def votes_for_user(self, userid):
+        """ The archived votes of a user, see `UserVoteArchive.votes`. """
+
+        try:
+            return self.get(user=userid).votes()
+        except UserVoteArchive.DoesNotExist:
+            return []
+
+
+class UserVoteArchive(Model):
+    """ The archived votes of a user, packed like a `VoteArchive` but
+    kept per user, so that the polls a user has voted on can be listed
+    without unpacking the archive of every poll. Rows are sorted newest
+    first.
+
+    """
+
+    user = ForeignKey(User,
+                      verbose_name=_('user'))
+    num_votes = PositiveIntegerField(_('number of votes'),
+                                     default=0)
+    dates_modified = TextField(_('votes modified (dates)'),
+                               blank=True)
+    poll_ids = TextField(_('poll ids'),
+                         blank=True)
+    choice_ids = TextField(_('choice ids'),
+                           blank=True)
+    tenant = CharField(_('tenant'),
+                       max_length=32,
+                       default=get_current_tenant,
+                       editable=False)
+    objects = UserVoteArchiveManager()
+
+    def __unicode__(self):
+        return unicode(self.user)
+
+    def votes(self):
+        """ Returns the archived votes as a list of (modified, poll id,
+        choice id) tuples, with dates as timestamps.
+
+        """
+        return zip(unpack(self.dates_modified),
+                   unpack(self.poll_ids),
+                   unpack(self.choice_ids))
+
+    def set_votes(self, votes):
+        """ Packs a list of votes (see `votes`) in any order. """
+
+        votes = sorted(votes, reverse=True)
+        columns = zip(*votes) or [(), (), ()]
+        self.dates_modified = pack(columns[0])
+        self.poll_ids = pack(columns[1])
+        self.choice_ids = pack(columns[2])
+        self.num_votes = len(votes)
+
+    class Meta:
+        unique_together = (('tenant', 'user'),)
+        verbose_name = _('archived votes of a user')
+        verbose_name_plural = _('archived votes of users')
+
+
+class VoterSetManager(TenantManager):
+    """ Sets of voters are kept in the cache, backed by the database
+    and built from the votes when missing from both.
+
+    Sets are updated vote by vote through optimistic locking on
+    `VoterSet.version`. Cached copies are stored under the poll's
+    generation (see caching.py), so that each update, like any write to
+    the poll, has them reloaded from the database on the next read.
+
+    """
+    def _cache_key(self, pollid, choiceid):
+        return poll_key('voters', pollid, choiceid or 0)
+
+    def get_voters(self, pollid, choiceid=None):
+        """ Returns the voters of a poll (or one of its choices). """
+
+        key = self._cache_key(pollid, choiceid)
+        voters = cache.get(key)
+        if voters is None:
+            voters = RoaringBitmap.loads(self._row(pollid, choiceid).voters)
+            cache.set(key, voters, VOTER_SET_CACHE_TIMEOUT)
+        return voters
+
+    def _row(self, pollid, choiceid):
+        choice_key = choiceid or 0
+        try:
+            return self.get(poll=pollid, choice_key=choice_key)
+        except VoterSet.DoesNotExist:
+            voters = self.build(pollid, choiceid)
+            # The unique (poll, choice_key) index settles races between
+            # two requests building the same set
+            sid = transaction.savepoint()
+            try:
+                row = self.create(poll_id=pollid,
+                                  choice_key=choice_key,
+                                  voters=voters.dumps())
+                transaction.savepoint_commit(sid)
+                return row
+            except IntegrityError:
+                transaction.savepoint_rollback(sid)
+                return self.get(poll=pollid, choice_key=choice_key)
+
+    def build(self, pollid, choiceid=None):
+        """ Builds a voter set from the live and archived votes. """
+
+        if choiceid is None:
+            votes = Vote.objects.votes_for_poll(pollid)
+        else:
+            votes = Vote.objects.filter(choice=choiceid)
+        voters = RoaringBitmap(votes.order_by()
+                                    .values_list('user', flat=True)
+                                    .iterator())
+        try:
+            archive = VoteArchive.objects.get(poll=pollid)
+            for (userid, archived_choiceid, created, modified) in \
+                    archive.rows():
+                if choiceid is None or archived_choiceid == choiceid:
+                    voters.add(userid)
+        except VoteArchive.DoesNotExist:
+            pass
+        return voters
+
+    def update_voters(self, pollid, choiceid, userid, add=True):
+        """ Adds (or removes) a user to the voter set of a poll or of
+        one of its choices.
+
+        """
+        for attempt in range(VOTER_SET_RETRIES):
+            row = self._row(pollid, choiceid)
+            voters = RoaringBitmap.loads(row.voters)
+            if add:
+                voters.add(userid)
+            else:
+                voters.discard(userid)
+            if self.filter(id=row.id, version=row.version) \
+                   .update(voters=voters.dumps(), version=row.version + 1):
+                break
+        else:
+            # Give up and let the set be rebuilt on the next read
+            self.filter(id=row.id).delete()
+        cache.delete(self._cache_key(pollid, choiceid))
+
+    def invalidate(self, pollid):
+        """ Drops all voter sets of a poll, to be rebuilt when needed. """
+
+        self.filter(poll=pollid).delete()
+        bump_poll_generation(pollid)
+
+
+class VoterSet(Model):
+    """ The ids of the users who have voted on a poll, or on one choice
+    of a poll if `choice_key` is set, as a serialized `RoaringBitmap`.
+
+    """
+
+    poll = ForeignKey(Poll,
+                      verbose_name=_('poll'))
+    # The id of the choice, or 0 for the whole poll rather than NULL,
+    # which the unique index would let through any number of times
+    choice_key = PositiveIntegerField(_('choice'),
+                                      default=0)
+    voters = TextField(_('voters'),
+                       blank=True)
+    version = PositiveIntegerField(_('version'),
+                                   default=0)
+    tenant = CharField(_('tenant'),
+                       max_length=32,
+                       default=get_current_tenant,
+                       editable=False)
+    objects = VoterSetManager()
+
+    class Meta:
+        unique_together = (('poll', 'choice_key'),)
+        verbose_name = _('voter set')
+        verbose_name_plural = _('voter sets')
+
+
+class VoteEventManager(TenantManager):
+    def record(self, kind, pollid, userid, choiceid, previous_choiceid=None,
+               when=None):
+        """ Logs a vote event. Events are buffered per thread and written
+        in batches, see `flush`.
+
+        """
+        if when is None:
+            when = datetime.datetime.now()
+        if not hasattr(_vote_events, 'buffer'):
+            _vote_events.buffer = []
+        _vote_events.buffer.append((get_current_tenant(), kind, pollid,
+                                    userid, choiceid, previous_choiceid,
+                                    when))
+        if len(_vote_events.buffer) >= VOTE_EVENT_BATCH_SIZE:
+            self.flush()
+    def retract_votes(self, pollid, votes):
+        """ Logs the retraction of `votes` (a Vote queryset) before they
+        are deleted in bulk.
+
+        """
+        for userid, choiceid in votes.values_list('user', 'choice') \
+                                     .iterator():
+            self.record('RETRACT', pollid, userid, choiceid)
+    def discard(self):
+        """ Drops the buffered events of this thread, e.g. when the
+        transaction of their votes is rolled back.
+
+        """
+        _vote_events.buffer = []
+    def flush(self):
+        """ Writes the buffered events of this thread, in one statement.
+        Called by `VoteEventMiddleware` before each response is returned
+        and by bulk operations.
+
+        """
+        events = getattr(_vote_events, 'buffer', None)
+        if not events:
+            return
+        _vote_events.buffer = []
+        qn = connection.ops.quote_name
+        columns = ('tenant', 'kind', 'poll_id', 'user_id', 'choice_id',
+                   'previous_choice_id', 'date_created')
+        rows = [event[:-1] +
+                (connection.ops.value_to_db_datetime(event[-1]),)
+                for event in events]
+        cursor = connection.cursor()
+        cursor.executemany('INSERT INTO %s (%s) VALUES (%s)' %
+                           (qn(self.model._meta.db_table),
+                            ', '.join([qn(c) for c in columns]),
+                            ', '.join(['%s'] * len(columns))),
+                           rows)
+        transaction.commit_unless_managed()
+    def events(self, after=0, pollid=None, until=None, chunk_size=1000):
+        """ Yields the events after event id `after`, in id order, as
+        (id, kind, poll id, user id, choice id, previous choice id, date)
+        tuples. Rows are fetched in chunks keyed on id, so that no
+        chunk has to skip over the ones before it.
+
+        """
+        events = self.order_by('id')
+        if pollid is not None:
+            events = events.filter(poll_id=pollid)
+        if until is not None:
+            events = events.filter(date_created__lte=until)
+        while True:
+            chunk = list(events.filter(id__gt=after)
+                               .values_list('id', 'kind', 'poll_id',
+                                            'user_id', 'choice_id',
+                                            'previous_choice_id',
+                                            'date_created')[:chunk_size])
+            for event in chunk:
+                yield event
+            if len(chunk) < chunk_size:
+                return
+            after = chunk[-1][0]
+    def replay(self, reducer=None, pollid=None, until=None,
+               chunk_size=1000):
+        """ Feeds the events up to `until` (or all of them) into
+        `reducer`, by default a `Tally`, and returns it.
+
+        Replay starts from the latest checkpoint (see `compact`), whose
+        tallies are handed to the reducer's `load` method. Events before
+        a checkpoint are gone, so `until` cannot be earlier than the
+        latest checkpoint.
+
+        """
+        self.flush()
+        if reducer is None:
+            reducer = Tally()
+        checkpoints = list(VoteCheckpoint.objects
+                                         .order_by('-last_event_id')[:1])
+        if until is not None and checkpoints and \
+           checkpoints[0].as_of > until:
+            raise ValueError("Events before %s have been compacted." %
+                             checkpoints[0].as_of)
+        after = 0
+        if checkpoints:
+            checkpoint = checkpoints[0]
+            after = checkpoint.last_event_id
+            reducer.load([row for row in checkpoint.rows()
+                          if pollid is None or row[0] == pollid])
+        for event in self.events(after, pollid, until, chunk_size):
+            reducer.apply(*event[1:])
+        return reducer
+    def compact(self, before, chunk_size=1000):
+        """ Folds the events before `before` into a new checkpoint and
+        deletes them, so that replays stay short. Returns the number of
+        compacted events.
+
+        """
+        self.flush()
+        last = self.filter(date_created__lt=before) \
+                   .aggregate(last=Max('id'))['last']
+        if last is None:
+            return 0
+        return transaction.commit_on_success(self._compact)(last,
+                                                           chunk_size)
+    def seed(self):
+        """ Writes a checkpoint of the tallies of the current votes, from
+        which replays start. For vote logs started after votes have been
+        cast; votes loaded from fixtures are not logged either.
+
+        """
+        self.flush()
+        return transaction.commit_on_success(self._seed)()
+    def _seed(self):
+        last = self.aggregate(last=Max('id'))['last'] or 0
+        counts = {}
+        for row in Vote.objects.order_by() \
+                               .values('choice__poll', 'choice') \
+                               .annotate(count=Count('id')):
+            counts[(row['choice__poll'], row['choice'])] = row['count']
+        for pollid, choiceid, count in \
+                Choice.objects.filter(archived_votes__gt=0) \
+                              .values_list('poll', 'id', 'archived_votes'):
+            counts[(pollid, choiceid)] = counts.get((pollid, choiceid), 0) + \
+                                         count
+        checkpoint, created = VoteCheckpoint.objects.get_or_create(
+            last_event_id=last,
+            defaults={'as_of': datetime.datetime.now()})
+        checkpoint.set_rows(sorted([key + (count,)
+                                    for key, count in counts.items()]))
+        checkpoint.save()
+        return checkpoint
+    def _compact(self, last, chunk_size):
+        checkpoints = list(VoteCheckpoint.objects
+                                         .order_by('-last_event_id')[:1])
+        tally = Tally()
+        after = 0
+        if checkpoints:
+            after = checkpoints[0].last_event_id
+            tally.load(checkpoints[0].rows())
+        count = 0
+        for event in self.events(after, chunk_size=chunk_size):
+            if event[0] > last:
+                break
+            tally.apply(*event[1:])
+            as_of = event[-1]
+            count += 1
+        if not count:
+            return 0
+        checkpoint = VoteCheckpoint(last_event_id=last, as_of=as_of)
+        checkpoint.set_rows(tally.rows())
+        checkpoint.save()
+        while True:
+            ids = list(self.filter(id__lte=last)
+                           .order_by('id')
+                           .values_list('id', flat=True)[:chunk_size])
+            if not ids:
+                return count
+            self.filter(id__in=ids).delete()
+
+
+class VoteEvent(Model):
+    """ An entry in the append-only log of votes being cast, changed and
+    retracted. Polls, users and choices are referred to by id only, so
+    that events outlive the rows they refer to.
+
+    """
+
+    KIND_CHOICES = (('CAST', _("Cast")),
+                    ('CHANGE', _("Change")),
+                    ('RETRACT', _("Retract")))
+
+    kind = CharField(_('kind'),
+                     max_length=8,
+                     choices=KIND_CHOICES)
+    poll_id = PositiveIntegerField(_('poll'))
+    user_id = PositiveIntegerField(_('user'))
+    choice_id = PositiveIntegerField(_('choice'))
+    previous_choice_id = PositiveIntegerField(_('previous choice'),
+                                              null=True,
+                                              blank=True)
+    date_created = DateTimeField(_('created (date)'),
+                                 db_index=True)
+    tenant = CharField(_('tenant'),
+                       max_length=32,
+                       default=get_current_tenant,
+                       editable=False)
+    objects = VoteEventManager()
+
+    class Meta:
+        ordering = ['id']
+        verbose_name = _('vote event')
+        verbose_name_plural = _('vote events')
+
+
+class Tally(object):
+    """ Votes per choice, rebuilt by replaying vote events (see
+    `VoteEventManager.replay`). Other reducers need the same two methods.
+
+    """
+
+    def __init__(self):
+        self.counts = {}
+
+    def load(self, rows):
+        """ Starts from (poll id, choice id, count) rows of a checkpoint. """
+
+        for pollid, choiceid, count in rows:
+            self.counts[(pollid, choiceid)] = count
+
+    def apply(self, kind, pollid, userid, choiceid, previous_choiceid, when):
+        if kind == 'CHANGE':
+            self._add(pollid, previous_choiceid, -1)
+        self._add(pollid, choiceid, -1 if kind == 'RETRACT' else 1)
+
+    def _add(self, pollid, choiceid, n):
+        key = (pollid, choiceid)
+        self.counts[key] = self.counts.get(key, 0) + n
+
+    def for_poll(self, pollid):
+        """ Returns a dict mapping choice ids to numbers of votes. """
+
+        return dict([(choiceid, count) for (p, choiceid), count
+                     in self.counts.items() if p == pollid and count])
+
+    def rows(self):
+        return sorted([(pollid, choiceid, count) for (pollid, choiceid), count
+                       in self.counts.items() if count])
+
+
+class VoteCheckpoint(Model):
+    """ Tallies as of vote event `last_event_id`, from which replays
+    start. The tallies are packed into columns like in `VoteArchive`.
+
+    """
+
+    last_event_id = PositiveIntegerField(_('last event id'))
+    as_of = DateTimeField(_('as of (date)'))
+    poll_ids = TextField(_('poll ids'),
+                         blank=True)
+    choice_ids = TextField(_('choice ids'),
+                           blank=True)
+    counts = TextField(_('number of votes'),
+                       blank=True)
+    date_created = DateTimeField(_('created (date)'),
+                                 auto_now_add=True)
+    tenant = CharField(_('tenant'),
+                       max_length=32,
+                       default=get_current_tenant,
+                       editable=False)
+    objects = TenantManager()
+
+    def rows(self):
+        return zip(unpack(self.poll_ids),
+                   unpack(self.choice_ids),
+                   unpack(self.counts))
+
+    def set_rows(self, rows):
+        self.poll_ids = pack([row[0] for row in rows])
+        self.choice_ids = pack([row[1] for row in rows])
+        self.counts = pack([row[2] for row in rows])
+
+    class Meta:
+        unique_together = (('tenant', 'last_event_id'),)
+        verbose_name = _('vote checkpoint')
+        verbose_name_plural = _('vote checkpoints')
+
+
+class DailyStatsManager(TenantManager):
+    def refresh(self, until=None):
+        """ Adds the polls and votes created or modified since the last
+        refresh, up to `until`, to the summary tables. By default
+        `until` is `STATS_LAG` seconds ago. Only rows past the
+        watermarks of the last refresh are read, through the indexes on
+        `date_created` and `date_modified`. Returns the number of rows
+        read.
+
+        Each refresh first claims the rows up to `until` by moving the
+        watermarks with a conditional UPDATE, so that of concurrent
+        refreshes only one counts them; the others wait for its lock on
+        the watermarks, find them moved and read nothing.
+
+        """
+        if until is None:
+            until = datetime.datetime.now() - \
+                    datetime.timedelta(seconds=STATS_LAG)
+        return transaction.commit_on_success(self._refresh)(until)
+    def _refresh(self, until):
+        watermark, created = StatsWatermark.objects.get_or_create(
+            tenant=get_current_tenant())
+        if watermark.created_until is not None and \
+           watermark.created_until >= until:
+            return 0
+        watermarks = StatsWatermark.objects.filter(
+            id=watermark.id,
+            created_until=watermark.created_until,
+            modified_until=watermark.modified_until)
+        if not watermarks.update(created_until=until, modified_until=until):
+            return 0
+        days = {}
+        creators = {}
+        rows = 0
+
+        def day(when):
+            date = when.date()
+            if date not in days:
+                days[date] = {'polls': 0, 'votes': 0,
+                              'voters': HyperLogLog()}
+            return days[date]
+
+        def since(queryset, field, mark, value='user'):
+            queryset = queryset.filter(**{field + '__lte': until})
+            if mark is not None:
+                queryset = queryset.filter(**{field + '__gt': mark})
+            return queryset.order_by().values_list(field, value).iterator()
+
+        for when, userid in since(Poll.objects.all(), 'date_created',
+                                  watermark.created_until):
+            day(when)['polls'] += 1
+            key = (when.date(), userid)
+            creators[key] = creators.get(key, 0) + 1
+            rows += 1
+        for when, userid in since(Vote.objects.all(), 'date_created',
+                                  watermark.created_until):
+            day(when)['votes'] += 1
+            rows += 1
+        # Voters are active on the day they last cast or changed a vote
+        for when, userid in since(Vote.objects.all(), 'date_modified',
+                                  watermark.modified_until):
+            day(when)['voters'].add(userid)
+            rows += 1
+
+        anonymous = AnonymousVote.objects.all()
+        for when, token_hash in since(anonymous, 'date_created',
+                                      watermark.created_until,
+                                      'token_hash'):
+            day(when)['votes'] += 1
+            rows += 1
+        for when, token_hash in since(anonymous, 'date_modified',
+                                      watermark.modified_until,
+                                      'token_hash'):
+            day(when)['voters'].add(token_hash)
+            rows += 1
+
+        for date, counts in days.items():
+            stats, created = self.get_or_create(date=date)
+            stats.polls_created += counts['polls']
+            stats.votes_cast += counts['votes']
+            stats.voters = (stats.voter_sketch() | counts['voters']).dumps()
+            stats.save()
+        for (date, userid), count in creators.items():
+            try:
+                stats = CreatorStats.objects.get(date=date, user=userid)
+            except CreatorStats.DoesNotExist:
+                stats = CreatorStats(date=date, user_id=userid)
+            stats.polls_created += count
+            stats.save()
+        return rows
+    def voters_between(self, start, end):
+        """ Estimated number of distinct voters from `start` to `end`,
+        both dates included.
+
+        """
+        sketch = HyperLogLog()
+        for voters in self.filter(date__gte=start, date__lte=end) \
+                          .values_list('voters', flat=True):
+            sketch.update(HyperLogLog.loads(voters))
+        return len(sketch)
+
+
+class DailyStats(Model):
+    """ Site-wide numbers of a day, kept up to date by
+    `DailyStatsManager.refresh` so that they never have to be counted
+    from the polls and votes themselves.
+
+    """
+    tenant = CharField(_('tenant'),
+                       max_length=32,
+                       default=get_current_tenant,
+                       editable=False)
+    date = DateField(_('date'))
+    polls_created = PositiveIntegerField(_('polls created'),
+                                         default=0)
+    votes_cast = PositiveIntegerField(_('votes cast'),
+                                      default=0)
+    # HyperLogLog sketch of the voters of the day
+    voters = TextField(_('voters'),
+                       blank=True)
+    objects = DailyStatsManager()
+
+    def voter_sketch(self):
+        return HyperLogLog.loads(self.voters)
+
+    def active_voters(self):
+        """ Estimated number of distinct voters of the day. """
+
+        return len(self.voter_sketch())
+
+    class Meta:
+        unique_together = (('tenant', 'date'),)
+        ordering = ['-date']
+        verbose_name = _('daily statistics')
+        verbose_name_plural = _('daily statistics')
+
+
+class CreatorStats(Model):
+    """ Number of polls created by a user on a day. """
+
+    tenant = CharField(_('tenant'),
+                       max_length=32,
+                       default=get_current_tenant,
+                       editable=False)
+    date = DateField(_('date'))
+    user = ForeignKey(User,
+                      verbose_name=_('user'))
+    polls_created = PositiveIntegerField(_('polls created'),
+                                         default=0)
+    objects = TenantManager()
+
+    class Meta:
+        unique_together = (('tenant', 'date', 'user'),)
+        verbose_name = _('poll creator statistics')
+        verbose_name_plural = _('poll creator statistics')
+
+
+class StatsWatermark(Model):
+    """ How far the summary tables of a tenant have been refreshed. """
+
+    tenant = CharField(_('tenant'),
+                       max_length=32,
+                       unique=True)
+    created_until = DateTimeField(_('created until'),
+                                  null=True,
+                                  blank=True)
+    modified_until = DateTimeField(_('modified until'),
+                                   null=True,
+                                   blank=True)
+
+    class Meta:
+        verbose_name = _('statistics watermark')
+        verbose_name_plural = _('statistics watermarks')
+
+
+def _incr_stat(key):
+    """ Increments a counter in the cache, creating it if needed. """
+
+    if not cache.add(key, 1):
+        try:
+            cache.incr(key)
+        except ValueError:
+            # Expired since add()
+            cache.add(key, 1)
+
+
+def remember_choice(sender, instance, **kwargs):
+    """ Keeps track of the choice a vote had when loaded, to tell
+    which choice the vote has been moved from when saved.
+
+    """
+    instance._loaded_choice_id = instance.choice_id
+
+def log_vote_event(sender, instance, created, **kwargs):
+    """ Logs votes being cast or changed. Must run before
+    `update_voter_sets`, which resets the loaded choice.
+
+    """
+    if getattr(_vote_signals, 'suspended', False) or \
+       getattr(_vote_signals, 'no_events', False) or kwargs.get('raw'):
+        return
+    if created:
+        VoteEvent.objects.record('CAST', instance.choice.poll_id,
+                                 instance.user_id, instance.choice_id,
+                                 when=instance.date_modified)
+    elif instance._loaded_choice_id != instance.choice_id:
+        VoteEvent.objects.record('CHANGE', instance.choice.poll_id,
+                                 instance.user_id, instance.choice_id,
+                                 instance._loaded_choice_id,
+                                 when=instance.date_modified)
+
+def log_vote_retraction(sender, instance, **kwargs):
+    if getattr(_vote_signals, 'suspended', False) or \
+       getattr(_vote_signals, 'no_events', False):
+        return
+    try:
+        pollid = instance.choice.poll_id
+    except Choice.DoesNotExist:
+        return
+    VoteEvent.objects.record('RETRACT', pollid, instance.user_id,
+                             instance.choice_id)
+
+def update_voter_sets(sender, instance, created, **kwargs):
+    if getattr(_vote_signals, 'suspended', False):
+        return
+    old_choice_id = None if created else instance._loaded_choice_id
+    if old_choice_id != instance.choice_id:
+        pollid = instance.choice.poll_id
+        if old_choice_id is None:
+            VoterSet.objects.update_voters(pollid, None, instance.user_id)
+        else:
+            VoterSet.objects.update_voters(pollid, old_choice_id,
+                                           instance.user_id, add=False)
+        VoterSet.objects.update_voters(pollid, instance.choice_id,
+                                       instance.user_id)
+    instance._loaded_choice_id = instance.choice_id
+
+def remove_from_voter_sets(sender, instance, **kwargs):
+    if getattr(_vote_signals, 'suspended', False):
+        return
+    try:
+        pollid = Choice.objects.values_list('poll', flat=True) \
+                               .get(id=instance.choice_id)
+    except Choice.DoesNotExist:
+        # Deleted along with its choice, and so are the voter sets
+        return
+    VoterSet.objects.update_voters(pollid, None, instance.user_id,
+                                   add=False)
+    VoterSet.objects.update_voters(pollid, instance.choice_id,
+                                   instance.user_id, add=False)
+
+def bump_generation(sender, instance, **kwargs):
+    """ Any write to a poll, a choice or a vote invalidates everything
+    cached for the poll.
+
+    """
+    if sender is Poll:
+        pollid = instance.id
+    elif sender is Choice:
+        pollid = instance.poll_id
+    else:
+        if getattr(_vote_signals, 'suspended', False):
+            return
+        try:
+            pollid = instance.choice.poll_id
+        except Choice.DoesNotExist:
+            return
+    bump_poll_generation(pollid)
+
+def update_voter_filter(sender, instance, created, **kwargs):
+    if created:
+        Vote.objects.add_to_voter_filter(instance.choice.poll_id,
+                                         instance.user_id)
+
+post_init.connect(remember_choice, sender=Vote)
+post_save.connect(log_vote_event, sender=Vote)
+post_delete.connect(log_vote_retraction, sender=Vote)
+post_save.connect(update_voter_sets, sender=Vote)
+post_delete.connect(remove_from_voter_sets, sender=Vote)
+post_save.connect(update_voter_filter, sender=Vote)
+for model in (Poll, Choice, Vote):
+    post_save.connect(bump_generation, sender=model)
+    post_delete.connect(bump_generation, sender=model)
+
+
+def update_trending_score(sender, instance, created, **kwargs):
+    """ Casting a vote (but not changing it) makes a poll more popular. """
+
+    if created:
+        Poll.objects.register_activity(instance.choice.poll_id,
+                                       instance.date_created)
+
+post_save.connect(update_trending_score, sender=Vote)
+
+
+def normalize_choice_text(sender, instance, **kwargs):
+    """ Also run for raw saves, such as when loading fixtures. """
+
+    instance.normalized = normalize_choice(instance.choice)
+
+pre_save.connect(normalize_choice_text, sender=Choice)
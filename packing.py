@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+""" Compact storage of integer columns in text fields.
+
+A column is packed into an array of unsigned 32-bit integers in little
+endian byte order, compressed with zlib and base64 encoded so that it
+can be stored in an ordinary TextField.
+
+"""
+import base64
+import calendar
+import datetime
+import sys
+import zlib
+from array import array
+
+TYPECODE = 'I'
+
+
+def pack(values):
+    """ Packs an iterable of non-negative integers into a string. """
+
+    a = array(TYPECODE, values)
+    if sys.byteorder == 'big':
+        a.byteswap()
+    return base64.b64encode(zlib.compress(a.tostring()))
+
+
+def unpack(data):
+    """ Unpacks a string created by `pack` into an array. """
+
+    a = array(TYPECODE)
+    if data:
+        a.fromstring(zlib.decompress(base64.b64decode(data)))
+        if sys.byteorder == 'big':
+            a.byteswap()
+    return a
+
+
+def unpack_chunks(data, chunk_size=1000):
+    """ Unpacks a string created by `pack` into arrays of at most
+    `chunk_size` integers, decompressing only as much as is needed for
+    each array.
+
+    """
+    if not data:
+        return
+    size = chunk_size * array(TYPECODE).itemsize
+    decompressor = zlib.decompressobj()
+    data = base64.b64decode(data)
+    pending = ''
+    while data:
+        pending += decompressor.decompress(data, size)
+        data = decompressor.unconsumed_tail
+        if not data:
+            pending += decompressor.flush()
+        while len(pending) >= size or (pending and not data):
+            a = array(TYPECODE)
+            a.fromstring(pending[:size])
+            pending = pending[size:]
+            if sys.byteorder == 'big':
+                a.byteswap()
+            yield a
+
+
+class Packer(object):
+    """ Packs a column a chunk at a time, compressing as it goes, into
+    a string that `unpack` reads like one created by `pack`.
+
+    """
+
+    def __init__(self):
+        self.compressor = zlib.compressobj()
+        self.parts = []
+        self.count = 0
+
+    def add(self, values):
+        a = array(TYPECODE, values)
+        if sys.byteorder == 'big':
+            a.byteswap()
+        self.parts.append(self.compressor.compress(a.tostring()))
+        self.count += len(a)
+
+    def packed(self):
+        self.parts.append(self.compressor.flush())
+        return base64.b64encode(''.join(self.parts))
+
+
+def to_timestamp(dt):
+    """ Converts a (naive) datetime to whole seconds for packing. """
+
+    return calendar.timegm(dt.timetuple())
+
+
+def from_timestamp(ts):
+    """ Converts whole seconds back into a (naive) datetime. """
+
+    return datetime.datetime.utcfromtimestamp(ts)
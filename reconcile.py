@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+""" Reconciliation of the counts stored or cached for polls with the votes
+they are derived from.
+
+Polls are checked in chunks, each read from a single snapshot in a short
+read-only transaction of its own, so that no long-running transaction or
+global scan holds locks. Chunks are spread over a pool of processes. Per
+poll, the checks are:
+
+* 'tally': cached tallies (see `ChoiceManager.tallies_for_polls`),
+* 'archive': archived tallies (`Choice.archived_votes`) and the number
+  of votes of the poll's `VoteArchive`,
+* 'voters': stored voter sets (`VoterSet`).
+
+Cached tallies are read at the start of the transaction. As the cache
+is not part of the snapshot, tallies of polls whose generation (see
+caching.py) moves on while they are being checked are not compared;
+they are left to the next run.
+
+Cached tallies and voter sets are repaired by dropping them, to be
+rebuilt when needed. Archived tallies are recounted from the archive.
+
+"""
+import multiprocessing
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models import Count
+
+from bitmaps import RoaringBitmap
+from caching import bump_poll_generation, poll_keys
+from models import AnonymousVote, Choice, Poll, Vote, VoteArchive, VoterSet
+
+
+def _read_only(func, *args):
+    """ Calls func(*args) in a transaction of its own that is rolled back
+    afterwards, and declared read-only where the database supports it.
+    All of its queries read from the same snapshot.
+
+    """
+    transaction.enter_transaction_management()
+    transaction.managed(True)
+    try:
+        if settings.DATABASE_ENGINE.startswith('postgresql'):
+            connection.cursor().execute('SET TRANSACTION ISOLATION LEVEL '
+                                        'REPEATABLE READ READ ONLY')
+        return func(*args)
+    finally:
+        transaction.rollback()
+        transaction.leave_transaction_management()
+
+
+def _read_chunk(pollids):
+    # Before the snapshot is taken by the first query
+    keys = poll_keys('tally', pollids)
+    cached = cache.get_many(keys.values())
+    # Choices in the order tallies are served in
+    choices = list(Choice.objects.filter(poll__in=pollids)
+                                 .order_by('position', 'date_created')
+                                 .values_list('id', 'poll', 'choice',
+                                              'deleted_at', 'archived_votes'))
+    votes = list(Vote.objects.filter(choice__poll__in=pollids)
+                             .order_by()
+                             .values_list('choice', 'user'))
+    anonymous = [(row['choice'], row['count']) for row in
+                 AnonymousVote.objects.filter(poll__in=pollids)
+                                      .order_by()
+                                      .values('choice')
+                                      .annotate(count=Count('id'))]
+    archives = list(VoteArchive.objects.filter(poll__in=pollids))
+    voter_sets = list(VoterSet.objects.filter(poll__in=pollids)
+                                      .values_list('poll', 'choice_key',
+                                                   'voters'))
+    return choices, votes, anonymous, archives, voter_sets, keys, cached
+
+
+def check_polls(pollids):
+    """ Checks a chunk of polls. Returns a dict mapping the ids of the
+    inconsistent polls to lists of their problems, and a dict mapping
+    the ids of the choices with wrong archived tallies to correct ones.
+
+    """
+    choices, votes, anonymous, archives, voter_sets, keys, cached = \
+        _read_only(_read_chunk, pollids)
+
+    live = dict([(c[0], c[1]) for c in choices if c[3] is None])
+    live_counts = {}
+    archived_counts = {}
+    poll_voters = {}
+    choice_voters = {}
+
+    def add_voter(pollid, choiceid, userid, archived):
+        choice_voters.setdefault(choiceid, RoaringBitmap()).add(userid)
+        # Poll voter sets leave out live votes of deleted choices
+        if archived or choiceid in live:
+            poll_voters.setdefault(pollid, RoaringBitmap()).add(userid)
+
+    polls = dict([(c[0], c[1]) for c in choices])
+    for choiceid, userid in votes:
+        live_counts[choiceid] = live_counts.get(choiceid, 0) + 1
+        add_voter(polls[choiceid], choiceid, userid, False)
+
+    # Anonymous votes are counted in tallies but have no voters
+    for choiceid, count in anonymous:
+        live_counts[choiceid] = live_counts.get(choiceid, 0) + count
+
+    problems = {}
+
+    def problem(pollid, name):
+        if name not in problems.setdefault(pollid, []):
+            problems[pollid].append(name)
+
+    for archive in archives:
+        rows = archive.rows()
+        for userid, choiceid, created, modified in rows:
+            archived_counts[choiceid] = archived_counts.get(choiceid, 0) + 1
+            add_voter(archive.poll_id, choiceid, userid, True)
+        if archive.num_votes != len(rows):
+            problem(archive.poll_id, 'archive')
+
+    archive_repairs = {}
+    for choiceid, pollid, text, deleted_at, archived in choices:
+        if archived != archived_counts.get(choiceid, 0):
+            problem(pollid, 'archive')
+            archive_repairs[choiceid] = archived_counts.get(choiceid, 0)
+
+    # Tallies missing from the cache can't be wrong, and those of polls
+    # that have changed since they were read can't be told to be
+    current = poll_keys('tally', pollids)
+    for pollid, key in keys.items():
+        if key not in cached or current[pollid] != key:
+            continue
+        expected = [(choiceid, text,
+                     live_counts.get(choiceid, 0) +
+                     archived_counts.get(choiceid, 0))
+                    for choiceid, p, text, deleted_at, archived in choices
+                    if p == pollid and deleted_at is None]
+        if list(cached[key]) != expected:
+            problem(pollid, 'tally')
+
+    for pollid, choiceid, voters in voter_sets:
+        if not choiceid:
+            expected = poll_voters.get(pollid, RoaringBitmap())
+        else:
+            expected = choice_voters.get(choiceid, RoaringBitmap())
+        if RoaringBitmap.loads(voters) != expected:
+            problem(pollid, 'voters')
+
+    return problems, archive_repairs
+
+
+def repair_polls(problems, archive_repairs):
+    """ Repairs the problems found by `check_polls`. """
+
+    def repair():
+        for choiceid, count in archive_repairs.items():
+            Choice.objects.filter(id=choiceid).update(archived_votes=count)
+        for pollid, names in problems.items():
+            if 'archive' in names:
+                for archive in VoteArchive.objects.filter(poll=pollid):
+                    VoteArchive.objects.filter(id=archive.id) \
+                        .update(num_votes=len(archive.rows()))
+            if 'voters' in names:
+                VoterSet.objects.invalidate(pollid)
+    transaction.commit_on_success(repair)()
+    for pollid in problems:
+        bump_poll_generation(pollid)
+
+
+def _check_chunk(args):
+    pollids, repair = args
+    problems, archive_repairs = check_polls(pollids)
+    if repair and problems:
+        repair_polls(problems, archive_repairs)
+    return len(pollids), problems
+
+
+def reconcile(pollids=None, processes=4, chunk_size=100, repair=False):
+    """ Checks (and optionally repairs) `pollids`, by default all polls,
+    in chunks of `chunk_size` polls spread over `processes` processes.
+
+    Returns a dict with the number of checked polls, the problems of the
+    inconsistent polls (see `check_polls`), the time taken and the
+    throughput in polls per second.
+
+    """
+    start = time.time()
+    if pollids is None:
+        pollids = list(Poll.objects.order_by('id')
+                                   .values_list('id', flat=True))
+    chunks = [(pollids[i:i + chunk_size], repair)
+              for i in range(0, len(pollids), chunk_size)]
+    if processes > 1:
+        # The processes open database connections of their own
+        connection.close()
+        pool = multiprocessing.Pool(processes)
+        try:
+            results = pool.map(_check_chunk, chunks)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = map(_check_chunk, chunks)
+    checked = 0
+    problems = {}
+    for count, chunk_problems in results:
+        checked += count
+        problems.update(chunk_problems)
+    elapsed = time.time() - start
+    return {'polls': checked,
+            'problems': problems,
+            'elapsed': elapsed,
+            'throughput': checked / max(elapsed, 1e-9)}
@@ -0,0 +1,204 @@
+# -*- coding: utf-8 -*-
+""" A log of slow database queries, with their query plans.
+
+Add `SlowQueryMiddleware` to MIDDLEWARE_CLASSES and set
+`POLLS_SLOW_QUERY_THRESHOLD` to a number of seconds to turn it on. Every
+statement that takes longer than that is logged with its parameters,
+the functions of the app it was run from (e.g. a manager method and a
+view) and the view of the request, and, for SELECT statements, the
+output of the backend's EXPLAIN. Statements that fail are not logged.
+The log is a ring buffer of the last `POLLS_SLOW_QUERY_LOG_SIZE` slow
+queries, kept in the cache so that it is shared by all processes.
+
+"""
+import datetime
+import os
+import sys
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connection
+
+# Queries taking longer than this many seconds are logged; None for none
+SLOW_QUERY_THRESHOLD = getattr(settings, 'POLLS_SLOW_QUERY_THRESHOLD', None)
+SLOW_QUERY_LOG_SIZE = getattr(settings, 'POLLS_SLOW_QUERY_LOG_SIZE', 100)
+# Logged queries are kept in the cache for this many seconds
+SLOW_QUERY_TIMEOUT = 7 * 24 * 3600
+# Longer statements and parameters are cut short
+MAX_SQL_LENGTH = 4000
+# Number of the innermost functions of the app logged with a query
+MAX_CALLERS = 5
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+
+_state = threading.local()
+# The connection class's own cursor method, see `install`
+_raw_cursor = None
+
+
+def _app_frames():
+    """ Yields the frames of the app's own code that are on the stack,
+    innermost first, leaving out this module.
+
+    """
+    frame = sys._getframe(1)
+    while frame is not None:
+        filename = os.path.abspath(frame.f_code.co_filename)
+        if filename.startswith(APP_DIR) and \
+           not os.path.basename(filename).startswith('slowlog.'):
+            yield frame
+        frame = frame.f_back
+
+
+def _describe(frame):
+    """ E.g. 'models.py:420 ChoiceManager.ranked_for_poll'. """
+
+    name = frame.f_code.co_name
+    obj = frame.f_locals.get('self')
+    if obj is not None:
+        name = '%s.%s' % (obj.__class__.__name__, name)
+    return '%s:%d %s' % (os.path.basename(frame.f_code.co_filename),
+                         frame.f_lineno,
+                         name)
+
+
+def explain(sql, params):
+    """ The query plan of a SELECT statement as a list of lines, or
+    None for other statements.
+
+    """
+    if not sql.lstrip().upper().startswith('SELECT'):
+        return None
+    if 'sqlite3' in connection.__class__.__module__:
+        sql = 'EXPLAIN QUERY PLAN ' + sql
+    else:
+        sql = 'EXPLAIN ' + sql
+    # A cursor of its own, so as not to lose the rows of the query
+    if _raw_cursor is not None:
+        cursor = _raw_cursor(connection)
+    else:
+        cursor = connection.cursor()
+    try:
+        cursor.execute(sql, params)
+        return [' '.join([unicode(column) for column in row])
+                for row in cursor.fetchall()]
+    except Exception, e:
+        return [u"EXPLAIN failed: %s" % e]
+
+
+def record(sql, params, duration):
+    """ Adds a slow query to the log. """
+
+    callers = []
+    for frame in _app_frames():
+        callers.append(_describe(frame))
+        if len(callers) == MAX_CALLERS:
+            break
+    entry = {'time': datetime.datetime.now(),
+             'duration': duration,
+             'sql': sql[:MAX_SQL_LENGTH],
+             'params': repr(tuple(params or ()))[:MAX_SQL_LENGTH],
+             'callers': callers,
+             'view': getattr(_state, 'view', None),
+             'path': getattr(_state, 'path', None),
+             'plan': explain(sql, params)}
+    # Slots are written in turn, overwriting the oldest entry
+    count = 0
+    if not cache.add('polls:slow-queries:count', count):
+        try:
+            count = cache.incr('polls:slow-queries:count')
+        except ValueError:
+            # Expired since add()
+            cache.add('polls:slow-queries:count', count)
+    cache.set('polls:slow-queries:%d' % (count % SLOW_QUERY_LOG_SIZE),
+              entry,
+              SLOW_QUERY_TIMEOUT)
+
+
+def slow_queries():
+    """ The logged slow queries, most recent first. """
+
+    keys = ['polls:slow-queries:%d' % slot
+            for slot in range(SLOW_QUERY_LOG_SIZE)]
+    entries = cache.get_many(keys).values()
+    entries.sort(key=lambda entry: entry['time'], reverse=True)
+    return entries
+
+
+class SlowQueryCursor(object):
+    """ Wraps a database cursor, logging statements that take longer
+    than `SLOW_QUERY_THRESHOLD`.
+
+    """
+    def __init__(self, cursor):
+        self.cursor = cursor
+
+    def _timed(self, method, sql, params):
+        start = time.time()
+        result = method(sql, params)
+        duration = time.time() - start
+        # Queries run while logging, e.g. by a database cache, are not
+        # logged themselves
+        if duration > SLOW_QUERY_THRESHOLD and \
+           not getattr(_state, 'recording', False):
+            _state.recording = True
+            try:
+                record(sql, params, duration)
+            finally:
+                _state.recording = False
+        return result
+
+    def execute(self, sql, params=()):
+        return self._timed(self.cursor.execute, sql, params)
+
+    def executemany(self, sql, param_list):
+        return self._timed(self.cursor.executemany, sql, param_list)
+
+    def __getattr__(self, attr):
+        return getattr(self.cursor, attr)
+
+    def __iter__(self):
+        return iter(self.cursor)
+
+
+def install():
+    """ Makes the connection hand out cursors that log slow queries.
+
+    The connection keeps its state per thread, so the method is
+    replaced on its class rather than on the connection, which would
+    only wrap the cursors of the current thread.
+
+    """
+    global _raw_cursor
+    if _raw_cursor is not None:
+        return
+    _raw_cursor = connection.__class__.cursor
+
+    def slow_query_cursor(self):
+        return SlowQueryCursor(_raw_cursor(self))
+    connection.__class__.cursor = slow_query_cursor
+
+
+class SlowQueryMiddleware(object):
+    """ Turns on the slow query log, and keeps track of the view that
+    queries are run from.
+
+    """
+
+    def __init__(self):
+        if SLOW_QUERY_THRESHOLD is None:
+            raise MiddlewareNotUsed
+        install()
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        _state.view = '%s.%s' % (view_func.__module__,
+                                 getattr(view_func, '__name__',
+                                         view_func.__class__.__name__))
+        _state.path = request.path
+
+    def process_response(self, request, response):
+        _state.view = _state.path = None
+        return response
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+""" Start-up benchmark of the polls app.
+
+Worker processes are restarted often, so the time it takes to import the
+app and to serve the first request matters. Both are measured in a fresh
+interpreter, as anything imported already would not be counted.
+
+"""
+import os
+import subprocess
+import sys
+
+from django.conf import settings
+from django.utils import simplejson
+
+# Name of the package of the app, e.g. molnet.polls
+PACKAGE = __name__.rsplit('.', 1)[0]
+
+# Budgets in seconds, enforced by the tests
+IMPORT_BUDGET = getattr(settings, 'POLLS_STARTUP_IMPORT_BUDGET', 1.0)
+FIRST_REQUEST_BUDGET = getattr(settings, 'POLLS_FIRST_REQUEST_BUDGET', 2.0)
+
+# Modules that should only be imported when used
+LAZY_MODULES = ('django.contrib.syndication.feeds',
+                PACKAGE + '.feeds',
+                PACKAGE + '.forms')
+
+SCRIPT = """
+import sys
+import time
+
+from django.conf import settings
+# A database of its own, created before the timed request
+settings.DATABASE_ENGINE = 'sqlite3'
+settings.DATABASE_NAME = ':memory:'
+
+start = time.time()
+__import__(%(package)r + '.urls')
+import_time = time.time() - start
+modules = [name for name, module in sys.modules.items() if module]
+
+first_request_time = status_code = None
+if %(path)r:
+    from django.core.management.commands.syncdb import Command
+    from django.test.client import Client
+    Command().execute(verbosity=0, interactive=False)
+    start = time.time()
+    status_code = Client().get(%(path)r).status_code
+    first_request_time = time.time() - start
+from django.utils import simplejson
+print simplejson.dumps({'import_time': import_time,
+                        'first_request_time': first_request_time,
+                        'status_code': status_code,
+                        'modules': modules})
+"""
+
+
+def measure(path=None):
+    """ Imports the app's URLs in a new interpreter and, if `path` is
+    given, requests it. Returns a dict with the import time, the time and
+    status code of the first request (or None) and the names of the
+    imported modules.
+
+    """
+    env = os.environ.copy()
+    env['DJANGO_SETTINGS_MODULE'] = settings.SETTINGS_MODULE
+    env['PYTHONPATH'] = os.pathsep.join(sys.path)
+    script = SCRIPT % {'package': PACKAGE, 'path': path}
+    process = subprocess.Popen([sys.executable, '-c', script],
+                               stdout=subprocess.PIPE,
+                               stderr=subprocess.PIPE,
+                               env=env)
+    out, err = process.communicate()
+    if process.returncode:
+        raise RuntimeError("Start-up benchmark failed:\n%s" % err)
+    # The result is the last line; anything before it is chatter
+    return simplejson.loads(out.strip().splitlines()[-1])
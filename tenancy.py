@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+""" Tenants, i.e. separate sites sharing one installation of the app.
+
+Polls, choices and votes, and the rows kept alongside them (anonymous
+votes, vote archives, voter sets and the vote log), belong to a tenant,
+and their managers only ever see the rows of the current tenant. The current tenant is set per
+request by `TenantMiddleware` from the host name (see `POLLS_TENANTS`),
+and otherwise is `POLLS_DEFAULT_TENANT`. Management commands take a
+`--tenant` option.
+
+To keep a tenant in a database of its own, run a separate instance for
+it with its own database settings and `POLLS_DEFAULT_TENANT`.
+
+"""
+import threading
+from optparse import make_option
+
+from django.conf import settings
+from django.db.models import Manager
+
+DEFAULT_TENANT = getattr(settings, 'POLLS_DEFAULT_TENANT', 'default')
+# Maps host names to tenants
+TENANTS = getattr(settings, 'POLLS_TENANTS', {})
+
+_state = threading.local()
+
+# Option of the management commands that work on the polls of a tenant
+tenant_option = make_option('--tenant', dest='tenant',
+                            default=DEFAULT_TENANT,
+                            help="Tenant whose polls to work on.")
+
+
+def get_current_tenant():
+    return getattr(_state, 'tenant', DEFAULT_TENANT)
+
+
+def set_current_tenant(tenant):
+    _state.tenant = tenant
+
+
+def tenant_for_host(host):
+    """ The tenant of a host name, which may include a port. """
+
+    return TENANTS.get(host.split(':')[0].lower(), DEFAULT_TENANT)
+
+
+class TenantMiddleware(object):
+    """ Makes the tenant of the requested host the current tenant. """
+
+    def process_request(self, request):
+        set_current_tenant(tenant_for_host(request.get_host()))
+
+    def process_response(self, request, response):
+        set_current_tenant(DEFAULT_TENANT)
+        return response
+
+
+class TenantManager(Manager):
+    """ A manager of the rows of the current tenant only. """
+
+    def get_query_set(self):
+        return super(TenantManager, self).get_query_set() \
+                                         .filter(tenant=get_current_tenant())
@@ -3,17 +3,45 @@
 Tests for polls.
 
 """
-from datetime import datetime
-
+import os
+import re
+import threading
+import zipfile
+from cStringIO import StringIO
+from datetime import datetime, timedelta
+
+from django.contrib import admin
 from django.contrib.auth import authenticate, login, logout
 from django.contrib.auth.models import User
+from django.core.cache import cache
 from django.core.exceptions import ObjectDoesNotExist
 from django.core.urlresolvers import reverse
+from django.db import connection
+from django.http import HttpResponse
 from django.test import TestCase
+from django.utils import simplejson
 from django.utils.http import urlquote
 from django.utils.translation import ugettext
 
-from models import Choice, Poll, Vote
+from bitmaps import RoaringBitmap
+from bloom import BloomFilter
+from caching import (bump_committed_generations, bump_poll_generation,
+                     listing_key, poll_key)
+from hyperloglog import HyperLogLog
+from loadtest import LoadTest, percentile
+from middleware import CommittedCacheMiddleware, VoteEventMiddleware
+import reconcile as reconcile_module
+from reconcile import reconcile
+import slowlog
+from slowlog import slow_queries, SlowQueryCursor
+from startup import (FIRST_REQUEST_BUDGET, IMPORT_BUDGET, LAZY_MODULES,
+                     measure)
+from tenancy import (DEFAULT_TENANT, TENANTS, set_current_tenant,
+                     tenant_for_host)
+from views import parse_vote_cursor, vote_cursor
+from models import (AnonymousVote, Choice, CreatorStats, DailyStats,
+                    normalize_choice, Poll, StatsWatermark, Vote,
+                    VoteArchive, VoteEvent, VoterSet)
 
 
 class PollModelTests(TestCase):
@@ -37,6 +65,14 @@ class PollModelTests(TestCase):
         p.delete()
         self.assertRaises(ObjectDoesNotExist, Poll.objects.get, id=p.id)
 
+    def test_deleted_poll_frees_title_and_slug(self):
+        p = Poll.objects.get(id=1)
+        title, slug = p.title, p.slug
+        p.soft_delete()
+        self.failIfEqual(Poll.objects.get(id=1).slug, slug)
+        new = Poll.objects.create(user=p.user, title=title)
+        self.failUnlessEqual(new.slug, slug)
+
     def test_choice_creation(self):
         u = User.objects.all()[1]
         p = Poll.objects.all()[0]
@@ -77,6 +113,153 @@ class PollTests(TestCase):
                                    kwargs={'url': 'latest'}))
         self.failUnlessEqual(response.status_code, 200)
 
+    def test_trending_feed(self):
+        response = self.client.get(reverse('molnet-polls-feed',
+                                   kwargs={'url': 'trending'}))
+        self.failUnlessEqual(response.status_code, 200)
+
+    def test_user_feeds(self):
+        for url in ('user/user', 'results'):
+            response = self.client.get(reverse('molnet-polls-feed',
+                                       kwargs={'url': url}))
+            self.failUnlessEqual(response.status_code, 200)
+        response = self.client.get(reverse('molnet-polls-feed',
+                                   kwargs={'url': 'user/nobody'}))
+        self.failUnlessEqual(response.status_code, 404)
+
+    def test_answered_feed(self):
+        """ Only the user knows the URL of the feed of polls they have
+        answered.
+
+        """
+        for url in ('answered/user', 'answered/user/guess'):
+            response = self.client.get(reverse('molnet-polls-feed',
+                                       kwargs={'url': url}))
+            self.failUnlessEqual(response.status_code, 404)
+
+        login = self.client.login(username='user', password='password')
+        self.failUnless(login, 'Could not log in')
+        response = self.client.get(reverse('molnet-polls-answered-feed'))
+        self.failUnlessEqual(response.status_code, 302)
+        response = self.client.get(response['Location'])
+        self.failUnlessEqual(response.status_code, 200)
+
+    def test_cached_feed_follows_votes(self):
+        """ A cached feed is rendered again after a vote. """
+
+        url = reverse('molnet-polls-feed', kwargs={'url': 'latest'})
+        response = self.client.get(url)
+        self.failUnless('(3 votes)' in response.content)
+        Vote.objects.create(user=User.objects.get(id=2),
+                            choice=Choice.objects.get(id=2))
+        response = self.client.get(url)
+        self.failUnless('(4 votes)' in response.content)
+
+    def test_trending_order(self):
+        """ A recent vote should make a poll more popular than an old
+        poll with more, but older, votes.
+
+        """
+        self.failUnlessEqual(Poll.objects.trending()[0].trending_score, 0.0)
+
+        u = User.objects.get(username='testclient')
+        Vote.objects.create(user=u, choice=Choice.objects.get(id=6))
+        trending = Poll.objects.trending()
+        self.failUnlessEqual(trending[0].id, 3)
+
+        old = datetime(2010, 4, 18)
+        Poll.objects.register_activity(1, old)
+        Poll.objects.register_activity(1, old)
+        self.failUnlessEqual(Poll.objects.trending()[0].id, 3)
+
+        # Draft polls are never trending
+        self.failIf(Poll.objects.trending().filter(status='DRAFT'))
+
+    def test_trending_score_accumulates(self):
+        """ Two simultaneous votes count twice as much as one. """
+
+        now = datetime.now()
+        Poll.objects.register_activity(1, now)
+        Poll.objects.register_activity(4, now)
+        Poll.objects.register_activity(4, now)
+        p1 = Poll.objects.get(id=1)
+        p4 = Poll.objects.get(id=4)
+        self.failUnlessAlmostEqual(p4.trending_score - p1.trending_score,
+                                   1.0, places=6)
+
+
+class ScheduleTests(TestCase):
+    fixtures = ['users.json',
+                'polls.json',
+                'choices.json',
+                'votes.json']
+
+    def test_apply_schedule(self):
+        """ Polls are published and closed once they are due. """
+
+        Poll.objects.filter(id=2).update(publish_at=datetime(2010, 5, 1))
+        Poll.objects.filter(id=1).update(close_at=datetime(2010, 5, 2))
+        self.failUnlessEqual(Poll.objects.next_scheduled(),
+                             datetime(2010, 5, 1))
+
+        self.failUnlessEqual(
+            Poll.objects.apply_schedule(datetime(2010, 4, 30)), (0, 0))
+        self.failUnlessEqual(
+            Poll.objects.apply_schedule(datetime(2010, 5, 1)), (1, 0))
+        poll = Poll.objects.get(id=2)
+        self.failUnlessEqual(poll.status, 'PUBLISHED')
+        self.failUnlessEqual(poll.publish_at, None)
+        self.failUnlessEqual(Poll.objects.next_scheduled(),
+                             datetime(2010, 5, 2))
+
+        self.failUnlessEqual(
+            Poll.objects.apply_schedule(datetime(2010, 5, 3)), (0, 1))
+        poll = Poll.objects.get(id=1)
+        self.failUnlessEqual(poll.status, 'CLOSED')
+        self.failUnlessEqual(poll.closed_at, datetime(2010, 5, 3))
+        self.failUnlessEqual(Poll.objects.next_scheduled(), None)
+
+
+class GenerationTests(TestCase):
+    fixtures = ['users.json',
+                'polls.json',
+                'choices.json',
+                'votes.json']
+
+    def assertBumped(self, write, pollid=1):
+        keys = (poll_key('test', pollid), poll_key('test', 3),
+                listing_key('test'))
+        write()
+        self.failIfEqual(poll_key('test', pollid), keys[0])
+        self.failUnlessEqual(poll_key('test', 3), keys[1])
+        self.failIfEqual(listing_key('test'), keys[2])
+
+    def test_writes_bump_generation(self):
+        """ Any write for a poll gives its cache entries new keys. """
+
+        poll = Poll.objects.get(id=1)
+        self.assertBumped(poll.save)
+        self.assertBumped(lambda: Choice.objects.get(id=2).save())
+        self.assertBumped(lambda: Vote.objects.create(
+            user=User.objects.get(id=2), choice=Choice.objects.get(id=2)))
+        self.assertBumped(lambda: Vote.objects.get(id=1).delete())
+        self.assertBumped(lambda: Choice.objects.get(id=2).soft_delete())
+        self.assertBumped(poll.soft_delete)
+
+    def test_bumped_again_after_commit(self):
+        """ Entries rebuilt before a write is committed are invalidated
+        after the commit.
+
+        """
+        bump_committed_generations()
+        Poll.objects.get(id=1).save()
+        # Test cases run in a managed transaction
+        self.assertBumped(lambda: CommittedCacheMiddleware().process_response(
+            None, HttpResponse()))
+        key = poll_key('test', 1)
+        bump_committed_generations()
+        self.failUnlessEqual(poll_key('test', 1), key)
+
 
 class ChoiceTests(TestCase):
     fixtures = ['users.json',
@@ -93,6 +276,899 @@ class ChoiceTests(TestCase):
         self.failUnlessEqual(choices_with_votes[1].num_votes, 0)
         self.failUnlessEqual(choices_with_votes[2].num_votes, 1)
 
+    def test_normalized_choices(self):
+        """ Choices differing only in case, spacing or Unicode
+        representation are the same choice.
+
+        """
+        self.failUnlessEqual(normalize_choice(u"  YES \t please "),
+                             u"yes please")
+        self.failUnlessEqual(normalize_choice(u"\uff39es"), u"yes")
+
+        p = Poll.objects.get(id=1)
+        u = User.objects.get(id=2)
+        choice, created = Choice.objects.get_or_restore(p, u"  KITTENS! ", u)
+        self.failIf(created)
+        self.failUnlessEqual(choice.id, 1)
+        choice, created = Choice.objects.get_or_restore(p, u"Puppies", u)
+        self.failUnless(created)
+        self.failUnlessEqual(choice.normalized, u"puppies")
+        self.failUnlessEqual(Choice.objects.merge_duplicates(), 0)
+
+    def test_deleted_choice_added_again(self):
+        """ A deleted choice added again is a new choice; the old one
+        and its votes are left to the purge.
+
+        """
+        p = Poll.objects.get(id=1)
+        u = User.objects.get(id=2)
+        Choice.objects.get(id=1).soft_delete()
+        choice, created = Choice.objects.get_or_restore(p, u"Kittens!", u)
+        self.failUnless(created)
+        self.failIfEqual(choice.id, 1)
+        self.failUnlessEqual(choice.normalized, u"kittens!")
+        self.failUnlessEqual(Vote.objects.filter(choice=1).count(), 2)
+        self.failUnlessEqual(Choice.objects.purge_deleted(), (1, 2))
+        self.failIf(Vote.objects.filter(choice=choice))
+
+    def test_tallies_for_polls(self):
+        """ Batched tallies match per poll tallies, also after a vote. """
+
+        tallies = Choice.objects.tallies_for_polls([1, 3])
+        for pollid in (1, 3):
+            self.failUnlessEqual(
+                tallies[pollid],
+                [(c.id, c.choice, c.num_votes) for c in
+                 Choice.objects.get_choices_and_votes_for_poll(pollid)])
+
+        Vote.objects.create(user=User.objects.get(id=2),
+                            choice=Choice.objects.get(id=2))
+        tallies = Choice.objects.tallies_for_polls([1, 3])
+        self.failUnlessEqual([votes for id, choice, votes in tallies[1]],
+                             [2, 1, 1])
+
+    def test_results_json(self):
+        """ Drafts are left out of the results. """
+
+        response = self.client.get(reverse('molnet-polls-results-json'),
+                                   {'poll': ['1', '2'],
+                                    'slug': 'a-close-call'})
+        self.failUnlessEqual(response.status_code, 200)
+        polls = simplejson.loads(response.content)['polls']
+        self.failUnlessEqual(sorted([p['id'] for p in polls]), [1, 3])
+        for poll in polls:
+            if poll['id'] == 1:
+                self.failUnlessEqual(poll['number_of_votes'], 3)
+                self.failUnlessEqual([c['votes'] for c in poll['choices']],
+                                     [2, 0, 1])
+
+    def test_top_choices(self):
+        """ Polls with many choices show the most voted for ones, and
+        the rest are fetched a page at a time.
+
+        """
+        choices, others, generation = Choice.objects.top_for_poll(1, 2)
+        self.failUnlessEqual([c.id for c in choices], [1, 3])
+        self.failUnlessEqual(others, 1)
+        self.failUnlessEqual(generation, Choice.objects.ranking(1)[1])
+        # Polls with few choices keep their order
+        choices, others, generation = Choice.objects.top_for_poll(1, 3)
+        self.failUnlessEqual([c.id for c in choices], [1, 2, 3])
+        self.failUnlessEqual(others, 0)
+
+        url = reverse('molnet-polls-choices-json',
+                      args=['kittens-or-kaboodles'])
+        response = self.client.get(url, {'offset': '2'})
+        self.failUnlessEqual(response.status_code, 200)
+        data = simplejson.loads(response.content)
+        self.failUnlessEqual(data['choices'],
+                             [{'id': 2, 'choice': u"Kaboodles!", 'votes': 0}])
+        self.failUnlessEqual(data['next'], None)
+        response = self.client.get(url, {'offset': 'garbage'})
+        self.failUnlessEqual(response.status_code, 404)
+
+    def test_choice_pages_keep_their_ranking(self):
+        """ Votes cast while paging through the choices of a poll do not
+        move choices between pages.
+
+        """
+        ranking, generation = Choice.objects.ranking(1)
+        self.failUnlessEqual(ranking, [(1, 2), (3, 1), (2, 0)])
+        Vote.objects.create(user=User.objects.get(id=2),
+                            choice=Choice.objects.get(id=2))
+
+        url = reverse('molnet-polls-choices-json',
+                      args=['kittens-or-kaboodles'])
+        response = self.client.get(url, {'offset': '2',
+                                         'generation': str(generation)})
+        data = simplejson.loads(response.content)
+        self.failUnlessEqual(data['choices'],
+                             [{'id': 2, 'choice': u"Kaboodles!", 'votes': 0}])
+        response = self.client.get(url, {'offset': '2'})
+        data = simplejson.loads(response.content)
+        self.failUnlessEqual([c['id'] for c in data['choices']], [3])
+
+
+class TenancyTests(TestCase):
+    fixtures = ['users.json',
+                'polls.json',
+                'choices.json',
+                'votes.json']
+
+    def tearDown(self):
+        set_current_tenant(DEFAULT_TENANT)
+
+    def test_managers_are_scoped(self):
+        """ Polls, choices and votes of other tenants are never seen. """
+
+        title = Poll.objects.get(id=1).title
+        u = User.objects.get(id=3)
+
+        set_current_tenant('other')
+        self.failIf(Poll.objects.all())
+        self.failIf(Choice.objects.all())
+        self.failIf(Vote.objects.all())
+
+        # Titles and slugs are only unique per tenant
+        p = Poll.objects.create(user=u,
+                                title=title,
+                                status='PUBLISHED',
+                                published_at=datetime.now())
+        self.failUnlessEqual(p.tenant, 'other')
+        self.failUnlessEqual(p.slug, 'kittens-or-kaboodles')
+        c = Choice.objects.create(poll=p, user=u, choice="Yes")
+        v = Vote.objects.create(user=u, choice=c)
+        self.failUnlessEqual([vote.id for vote in Vote.objects.by_user(3)],
+                             [v.id])
+        self.failUnlessEqual(list(p.choice_set.all()), [c])
+
+        set_current_tenant(DEFAULT_TENANT)
+        self.failIf(Poll.objects.filter(id=p.id))
+        self.failIf(Choice.objects.filter(poll=p.id))
+        self.failIf(v.id in [vote.id for vote in Vote.objects.by_user(3)])
+
+    def test_vote_tables_are_scoped(self):
+        """ Vote events, checkpoints and voter sets of other tenants are
+        never seen.
+
+        """
+        Vote.objects.create(user=User.objects.get(id=1),
+                            choice=Choice.objects.get(id=1))
+        VoteEvent.objects.compact(datetime.now() + timedelta(seconds=1))
+        Vote.objects.create(user=User.objects.get(id=2),
+                            choice=Choice.objects.get(id=3))
+        Poll.objects.voters(1)
+
+        set_current_tenant('other')
+        self.failIf(VoteEvent.objects.replay().rows())
+        self.failIf(VoterSet.objects.all())
+
+        set_current_tenant(DEFAULT_TENANT)
+        self.failUnlessEqual(VoteEvent.objects.replay().for_poll(1),
+                             {1: 1, 3: 1})
+        self.failUnless(VoterSet.objects.all())
+
+    def test_tenant_for_host(self):
+        TENANTS['polls.example.com'] = 'example'
+        try:
+            self.failUnlessEqual(tenant_for_host('Polls.example.com:8000'),
+                                 'example')
+            self.failUnlessEqual(tenant_for_host('testserver'),
+                                 DEFAULT_TENANT)
+        finally:
+            del TENANTS['polls.example.com']
+
+
+class AnonymousVoteTests(TestCase):
+    fixtures = ['users.json',
+                'polls.json',
+                'choices.json',
+                'votes.json']
+
+    def show_poll_url(self, p):
+        p_at = p.published_at
+        return reverse('molnet-polls-show-poll',
+                       kwargs={'year': p_at.year,
+                               'month': p_at.month,
+                               'day': p_at.day,
+                               'slug': p.slug})
+
+    def test_anonymous_voting(self):
+        """ Anonymous votes are counted, and changed rather than repeated
+        by the same visitor.
+
+        """
+        p = Poll.objects.get(id=1)
+        url = self.show_poll_url(p)
+
+        # Not open to anonymous votes
+        response = self.client.post(url, {'choices': '2'})
+        self.failUnlessEqual(response.status_code, 200)
+        self.failIf(AnonymousVote.objects.all())
+
+        Poll.objects.filter(id=1).update(allow_anonymous_votes=True)
+        response = self.client.post(url, {'choices': '2'})
+        self.failUnlessEqual(response.status_code, 200)
+        self.failUnlessEqual(response.context['vote_id'], 2)
+        token = response.cookies['polls_voter'].value
+        self.failUnlessEqual(AnonymousVote.objects.vote_for_token(1, token),
+                             2)
+        self.failUnlessEqual(p.number_of_votes(), 4)
+        tallies = Choice.objects.tallies_for_polls([1])[1]
+        self.failUnlessEqual([votes for choiceid, choice, votes in tallies],
+                             [2, 1, 1])
+
+        # The same visitor changes the vote
+        response = self.client.post(url, {'choices': '3'})
+        self.failUnlessEqual(response.context['vote_id'], 3)
+        self.failUnlessEqual(AnonymousVote.objects.count(), 1)
+        self.failUnlessEqual(p.number_of_votes(), 4)
+        response = self.client.get(url)
+        self.failUnlessEqual(response.context['vote_id'], 3)
+
+    def test_token_hash(self):
+        """ Tokens are stored salted by poll. """
+
+        token_hash = AnonymousVote.objects.token_hash(1, 'a' * 32)
+        self.failUnlessEqual(len(token_hash), 64)
+        self.failIf('a' * 32 in token_hash)
+        self.failIfEqual(token_hash,
+                         AnonymousVote.objects.token_hash(2, 'a' * 32))
+
+
+class VoteArchiveTests(TestCase):
+    fixtures = ['users.json',
+                'polls.json',
+                'choices.json',
+                'votes.json']
+
+    def setUp(self):
+        self.poll = Poll.objects.get(id=3)
+        self.poll.closed_at = datetime(2010, 4, 19)
+        self.poll.save()
+
+    def test_archive_closed_poll(self):
+        """ Archiving keeps tallies but removes the votes. """
+
+        polls = VoteArchive.objects.polls_to_archive(datetime(2010, 5, 1))
+        self.failUnlessEqual([p.id for p in polls], [3])
+        tallies = [c.num_votes for c in
+                   Choice.objects.get_choices_and_votes_for_poll(3)]
+
+        archived = VoteArchive.objects.archive_poll(self.poll)
+        self.failUnlessEqual(archived, 3)
+        self.failIf(Vote.objects.votes_for_poll(3))
+        self.failUnlessEqual(tallies,
+                             [c.num_votes for c in
+                              Choice.objects.get_choices_and_votes_for_poll(3)])
+        poll = Poll.objects.get(id=3)
+        self.failUnlessEqual(poll.number_of_votes(), 3)
+        self.failUnlessEqual(poll.archived_vote(4), 7)
+        self.failUnlessEqual(poll.archived_vote(2), None)
+
+        # Nothing left to archive
+        polls = VoteArchive.objects.polls_to_archive(datetime(2010, 5, 1))
+        self.failIf(polls)
+
+    def test_change_archived_vote(self):
+        """ Votes can be changed after re-opening an archived poll. """
+
+        VoteArchive.objects.archive_poll(self.poll)
+        Poll.objects.filter(id=3).update(status='PUBLISHED', closed_at=None)
+
+        login = self.client.login(username='user', password='password')
+        self.failUnless(login, 'Could not log in')
+        p_at = self.poll.published_at
+        url = reverse('molnet-polls-show-poll',
+                      kwargs={'year': p_at.year,
+                              'month': p_at.month,
+                              'day': p_at.day,
+                              'slug': self.poll.slug})
+        response = self.client.get(url)
+        self.failUnlessEqual(response.context['vote_id'], 9)
+
+        response = self.client.post(url, {'choices_0': '7',
+                                          'choices_1': ''})
+        self.failUnlessEqual(response.status_code, 200)
+        self.failUnlessEqual(Vote.objects.get(user__username='user',
+                                              choice__poll=3).choice_id, 7)
+        self.failUnlessEqual(Poll.objects.get(id=3).archived_vote(3), None)
+        choices = Choice.objects.get_choices_and_votes_for_poll(3)
+        self.failUnlessEqual([c.num_votes for c in choices], [0, 2, 1, 0])
+        self.failUnlessEqual(
+            [p.id for p in Poll.objects.answered_by_user(3, 10)], [3, 1])
+
+    def test_archive_in_chunks(self):
+        """ Archiving a chunk at a time merges with earlier archives. """
+
+        Vote.objects.get(id=6).delete()
+        self.failUnlessEqual(
+            VoteArchive.objects.archive_poll(self.poll, chunk_size=1), 2)
+        Vote.objects.create(user=User.objects.get(id=3),
+                            choice=Choice.objects.get(id=7))
+        self.failUnlessEqual(
+            VoteArchive.objects.archive_poll(self.poll, chunk_size=1), 1)
+        archive = VoteArchive.objects.get(poll=3)
+        self.failUnlessEqual(archive.num_votes, 3)
+        self.failUnlessEqual([row[0] for row in archive.rows()], [2, 3, 4])
+        self.failUnlessEqual(Poll.objects.get(id=3).archived_vote(3), 7)
+        self.failUnlessEqual(Poll.objects.get(id=3).number_of_votes(), 3)
+
+    def test_archived_votes_of_user(self):
+        """ Archived votes are still listed among the user's votes,
+        after the live votes of the same second.
+
+        """
+        VoteArchive.objects.archive_poll(self.poll)
+        self.failUnlessEqual(
+            [p.id for p in Poll.objects.answered_by_user(3, 10)], [1, 3])
+
+        votes = Vote.objects.history(3, 1)
+        self.failUnlessEqual([v.id for v in votes], [1])
+        before = parse_vote_cursor(vote_cursor(votes[0]))
+        votes = Vote.objects.history(3, 1, before)
+        self.failUnlessEqual(votes[0].id, None)
+        self.failUnlessEqual(votes[0].choice.id, 9)
+        before = parse_vote_cursor(vote_cursor(votes[0]))
+        self.failIf(Vote.objects.history(3, 1, before))
+
+        login = self.client.login(username='user', password='password')
+        self.failUnless(login, 'Could not log in')
+        response = self.client.get(reverse('molnet-polls-my-votes'))
+        self.failUnlessEqual([v.choice.poll.id
+                              for v in response.context['votes']], [1, 3])
+
+        # Deleted polls are left out
+        Poll.objects.get(id=3).soft_delete()
+        self.failUnlessEqual(
+            [p.id for p in Poll.objects.answered_by_user(3, 10)], [1])
+
+
+class VoteEventTests(TestCase):
+    fixtures = ['users.json',
+                'polls.json',
+                'choices.json',
+                'votes.json']
+
+    def test_replay(self):
+        """ Casting, changing and retracting votes are logged and
+        replayed, also across a compaction.
+
+        """
+        # The votes of the fixtures were not logged
+        VoteEvent.objects.seed()
+        self.failUnlessEqual(
+            VoteEvent.objects.replay(pollid=1).for_poll(1), {1: 2, 3: 1})
+
+        user = User.objects.get(id=2)
+        vote = Vote.objects.create(user=user,
+                                   choice=Choice.objects.get(id=2))
+        vote = Vote.objects.get(id=vote.id)
+        vote.choice = Choice.objects.get(id=3)
+        vote.save()
+        Vote.objects.create(user=User.objects.get(id=1),
+                            choice=Choice.objects.get(id=1))
+        self.failUnlessEqual(
+            VoteEvent.objects.replay(pollid=1).for_poll(1), {1: 3, 3: 2})
+
+        VoteEvent.objects.compact(datetime.now() + timedelta(seconds=1))
+        self.failIf(VoteEvent.objects.all())
+        Vote.objects.get(user=1, choice=1).delete()
+        self.failUnlessEqual(VoteEvent.objects.replay().for_poll(1),
+                             {1: 2, 3: 2})
+        self.assertRaises(ValueError, VoteEvent.objects.replay,
+                          until=datetime(2010, 1, 1))
+
+    def test_middleware(self):
+        """ Events are written before the response is returned, and
+        dropped when the request fails in a transaction.
+
+        """
+        middleware = VoteEventMiddleware()
+        VoteEvent.objects.record('CAST', 1, 1, 1)
+        middleware.process_response(None, HttpResponse())
+        self.failUnlessEqual(VoteEvent.objects.count(), 1)
+
+        # Test cases run in a managed transaction
+        VoteEvent.objects.record('CAST', 1, 2, 1)
+        middleware.process_exception(None, ValueError())
+        middleware.process_response(None, HttpResponse())
+        self.failUnlessEqual(VoteEvent.objects.count(), 1)
+
+    def test_replaced_choice_votes_are_purged(self):
+        """ A deleted choice added again is a new choice; the old votes
+        are retracted when purged.
+
+        """
+        VoteEvent.objects.seed()
+        poll = Poll.objects.get(id=1)
+        user = User.objects.get(id=3)
+        Choice.objects.replace_choices(poll, user,
+                                       [u"Kaboodles!",
+                                        u"I can't decide, I like both!"])
+        Choice.objects.replace_choices(poll, user,
+                                       [u"Kittens!",
+                                        u"Kaboodles!",
+                                        u"I can't decide, I like both!"])
+        kittens = Choice.objects.live().get(poll=1, normalized=u"kittens!")
+        self.failIfEqual(kittens.id, 1)
+        self.failIf(Vote.objects.filter(choice=kittens))
+        self.failUnlessEqual(Choice.objects.purge_deleted(), (1, 2))
+        self.failUnlessEqual(VoteEvent.objects.replay().for_poll(1), {3: 1})
+
+    def test_restore_is_not_logged(self):
+        """ Votes restored from an archive were logged when cast. """
+
+        poll = Poll.objects.get(id=3)
+        poll.closed_at = datetime(2010, 4, 19)
+        poll.save()
+        VoteArchive.objects.archive_poll(poll)
+        Poll.objects.filter(id=3).update(status='PUBLISHED', closed_at=None)
+        VoteArchive.objects.restore_vote(poll, User.objects.get(id=3))
+        self.failIf(VoteEvent.objects.replay().for_poll(3))
+
+
+class ReconcileTests(TestCase):
+    fixtures = ['users.json',
+                'polls.json',
+                'choices.json',
+                'votes.json']
+
+    def test_reconcile(self):
+        """ Drift in stored counts is found and repaired. """
+
+        Choice.objects.tallies_for_polls([1, 3])
+        Poll.objects.voters(1)
+        result = reconcile(processes=1, chunk_size=2)
+        self.failUnlessEqual(result['polls'], Poll.objects.count())
+        self.failIf(result['problems'])
+
+        Choice.objects.filter(id=1).update(archived_votes=5)
+        result = reconcile(processes=1, repair=True)
+        self.failUnlessEqual(result['problems'], {1: ['archive']})
+        self.failUnlessEqual(Choice.objects.get(id=1).archived_votes, 0)
+        self.failIf(reconcile(processes=1)['problems'])
+
+    def test_changed_tally(self):
+        """ Cached tallies of polls changed while being checked are not
+        compared with the votes read.
+
+        """
+        cache.set(poll_key('tally', 1), [])
+        self.failUnlessEqual(reconcile(processes=1)['problems'],
+                             {1: ['tally']})
+
+        read_chunk = reconcile_module._read_chunk
+        def read_and_vote(pollids):
+            result = read_chunk(pollids)
+            bump_poll_generation(1)
+            return result
+        reconcile_module._read_chunk = read_and_vote
+        try:
+            cache.set(poll_key('tally', 1), [])
+            self.failIf(reconcile(processes=1)['problems'])
+        finally:
+            reconcile_module._read_chunk = read_chunk
+
+
+class VoterSetTests(TestCase):
+    fixtures = ['users.json',
+                'polls.json',
+                'choices.json',
+                'votes.json']
+
+    def test_voter_sets(self):
+        self.failUnlessEqual(list(Poll.objects.voters(1)), [3, 4, 5])
+        self.failUnlessEqual(list(Choice.objects.voters(1)), [3, 5])
+        self.failUnless(Poll.objects.has_voted(1, 4))
+        self.failIf(Poll.objects.has_voted(1, 2))
+        self.failUnlessEqual(len(Poll.objects.distinct_voters([1, 3])), 3)
+        both = Choice.objects.voters(1) & Poll.objects.voters(3)
+        self.failUnlessEqual(list(both), [3, 5])
+
+    def test_voter_sets_follow_votes(self):
+        u = User.objects.get(username='testclient')
+        Poll.objects.voters(1)
+
+        v = Vote.objects.create(user=u, choice=Choice.objects.get(id=2))
+        self.failUnless(Poll.objects.has_voted(1, u.id))
+        self.failUnless(u.id in Choice.objects.voters(2))
+
+        v = Vote.objects.get(id=v.id)
+        v.choice = Choice.objects.get(id=3)
+        v.save()
+        self.failIf(u.id in Choice.objects.voters(2))
+        self.failUnless(u.id in Choice.objects.voters(3))
+
+        v.delete()
+        self.failIf(Poll.objects.has_voted(1, u.id))
+        self.failIf(u.id in Choice.objects.voters(3))
+
+    def test_voter_set_race(self):
+        """ A voter set stored by someone else while it was being built
+        is used rather than stored twice.
+
+        """
+        Poll.objects.voters(1)
+        get = VoterSet.objects.get
+        missed = []
+
+        def get_after_miss(**kwargs):
+            if not missed:
+                missed.append(kwargs)
+                raise VoterSet.DoesNotExist
+            return get(**kwargs)
+        VoterSet.objects.get = get_after_miss
+        try:
+            voters = VoterSet.objects._row(1, None).voters
+        finally:
+            del VoterSet.objects.get
+        self.failUnlessEqual(list(RoaringBitmap.loads(voters)), [3, 4, 5])
+        self.failUnlessEqual(VoterSet.objects.filter(poll=1).count(), 1)
+
+
+class VoterFilterTests(TestCase):
+    fixtures = ['users.json',
+                'polls.json',
+                'choices.json',
+                'votes.json']
+
+    def test_voter_filter(self):
+        """ The filter never misses a voter, old or new. """
+
+        for userid in [3, 4, 5]:
+            self.failUnless(Vote.objects.might_have_voted(1, userid))
+        u = User.objects.get(username='testclient')
+        Vote.objects.create(user=u, choice=Choice.objects.get(id=2))
+        self.failUnless(Vote.objects.might_have_voted(1, u.id))
+
+        voters = Vote.objects.build_voter_filter(1)
+        self.failUnless(voters.might_contain(u.id))
+        self.failUnless(voters.false_positive_rate() < 0.01)
+
+    def test_contended_update(self):
+        """ A voter added while someone else updates the filter is not
+        lost from it.
+
+        """
+        u = User.objects.get(username='testclient')
+        Vote.objects.might_have_voted(1, u.id)
+        cache.add('polls:voter-filter-lock:1', 1)
+        try:
+            Vote.objects.create(user=u, choice=Choice.objects.get(id=2))
+        finally:
+            cache.delete('polls:voter-filter-lock:1')
+        self.failUnless(Vote.objects.might_have_voted(1, u.id))
+
+    def test_filter_built_before_commit(self):
+        """ A voter missing from a filter built before the vote was
+        committed is added after the commit.
+
+        """
+        u = User.objects.get(username='testclient')
+        Vote.objects.add_committed_voters()
+        # Test cases run in a managed transaction
+        Vote.objects.create(user=u, choice=Choice.objects.get(id=2))
+        Vote.objects._drop_voter_filter(1)
+        # Built by another request, from the votes committed so far
+        cache.set(Vote.objects._voter_filter_key(1), BloomFilter())
+        self.failIf(Vote.objects.might_have_voted(1, u.id))
+        CommittedCacheMiddleware().process_response(None, HttpResponse())
+        self.failUnless(Vote.objects.might_have_voted(1, u.id))
+
+    def test_show_poll_with_filter(self):
+        """ Both voters and non-voters see the right voting state. """
+
+        poll = Poll.objects.get(id=1)
+        p_at = poll.published_at
+        url = reverse('molnet-polls-show-poll',
+                      kwargs={'year': p_at.year,
+                              'month': p_at.month,
+                              'day': p_at.day,
+                              'slug': poll.slug})
+        self.client.login(username='testclient', password='password')
+        response = self.client.get(url)
+        self.failUnlessEqual(response.context['vote_id'], None)
+        self.client.login(username='user', password='password')
+        response = self.client.get(url)
+        self.failUnlessEqual(response.context['vote_id'], 1)
+
+
+class RoaringBitmapTests(TestCase):
+    def test_set_operations(self):
+        a = RoaringBitmap(range(0, 10000, 2) + [70000, 4000000000])
+        b = RoaringBitmap(range(0, 10000, 3))
+        self.failUnlessEqual(len(a), 5002)
+        self.failUnless(70000 in a and 4000000000 in a)
+        self.failUnlessEqual(set(a | b), set(a) | set(b))
+        self.failUnlessEqual(set(a & b), set(range(0, 10000, 6)))
+        self.failUnlessEqual(set(a - b), set(a) - set(b))
+        self.failUnlessEqual(RoaringBitmap.loads(a.dumps()), a)
+        a.discard(70000)
+        self.failIf(70000 in a)
+
+
+class HyperLogLogTests(TestCase):
+    def test_count_and_merge(self):
+        a = HyperLogLog()
+        b = HyperLogLog()
+        for i in range(10000):
+            a.add(i)
+            b.add(i + 5000)
+        # The standard error is about 1.6%
+        self.failUnless(abs(a.count() - 10000) < 500)
+        self.failUnless(abs((a | b).count() - 15000) < 750)
+        self.failUnlessEqual(len(HyperLogLog.loads(a.dumps())), len(a))
+        self.failUnlessEqual(len(HyperLogLog()), 0)
+        self.assertRaises(ValueError, a.update, HyperLogLog(10))
+
+
+class StatsTests(TestCase):
+    fixtures = ['users.json',
+                'polls.json',
+                'choices.json',
+                'votes.json']
+
+    def test_refresh(self):
+        """ Summary tables are refreshed incrementally. """
+
+        self.failUnlessEqual(DailyStats.objects.refresh(datetime.now()), 17)
+        day = DailyStats.objects.get(date=datetime(2010, 4, 18).date())
+        self.failUnlessEqual(day.polls_created, 5)
+        self.failUnlessEqual(day.votes_cast, 6)
+        self.failUnlessEqual(day.active_voters(), 3)
+        self.failUnlessEqual(
+            dict(CreatorStats.objects.values_list('user', 'polls_created')),
+            {3: 3, 4: 2})
+
+        # Nothing new, nothing read
+        self.failUnlessEqual(DailyStats.objects.refresh(datetime.now()), 0)
+        # Watermarks never move back
+        until = StatsWatermark.objects.get().created_until
+        self.failUnlessEqual(DailyStats.objects.refresh(datetime(2010, 1, 1)),
+                             0)
+        self.failUnlessEqual(StatsWatermark.objects.get().created_until, until)
+
+        Vote.objects.create(user=User.objects.get(id=2),
+                            choice=Choice.objects.get(id=1))
+        self.failUnlessEqual(DailyStats.objects.refresh(
+            datetime.now() + timedelta(seconds=1)), 2)
+        today = DailyStats.objects.get(date=datetime.now().date())
+        self.failUnlessEqual(today.votes_cast, 1)
+        self.failUnlessEqual(today.active_voters(), 1)
+        self.failUnlessEqual(DailyStats.objects.get(id=day.id).votes_cast, 6)
+        self.failUnlessEqual(
+            DailyStats.objects.voters_between(datetime(2010, 4, 1).date(),
+                                              datetime.now().date()),
+            4)
+
+    def test_stats_view(self):
+        """ Only staff may see the statistics. """
+
+        DailyStats.objects.refresh(datetime.now())
+        login = self.client.login(username='user', password='password')
+        self.failUnless(login, 'Could not log in')
+        response = self.client.get(reverse('molnet-polls-stats'))
+        self.failUnlessEqual(response.status_code, 302)
+
+        User.objects.filter(username='user').update(is_staff=True)
+        response = self.client.get(reverse('molnet-polls-stats'))
+        self.failUnlessEqual(response.status_code, 200)
+        self.failUnlessEqual([c['user__username']
+                              for c in response.context['creators']], [])
+
+
+class SlowQueryTests(TestCase):
+    fixtures = ['users.json',
+                'polls.json',
+                'choices.json',
+                'votes.json']
+
+    def setUp(self):
+        self.threshold = slowlog.SLOW_QUERY_THRESHOLD
+        # Every query is slow
+        slowlog.SLOW_QUERY_THRESHOLD = -1
+
+    def tearDown(self):
+        slowlog.SLOW_QUERY_THRESHOLD = self.threshold
+
+    def test_slow_query_log(self):
+        """ Slow queries are logged with their callers and plans, and
+        only staff may see them.
+
+        """
+        sql, params = Choice.objects.ranked_for_poll(1).query.as_sql()
+        cursor = SlowQueryCursor(connection.cursor())
+        cursor.execute(sql, params)
+        self.failUnlessEqual(len(cursor.fetchall()), 3)
+
+        query = slow_queries()[0]
+        self.failUnlessEqual(query['sql'], sql)
+        self.failUnless(query['callers'][0].startswith('tests.py:'))
+        self.failUnless(query['plan'])
+
+        login = self.client.login(username='user', password='password')
+        self.failUnless(login, 'Could not log in')
+        response = self.client.get(reverse('molnet-polls-slow-queries'))
+        self.failUnlessEqual(response.status_code, 302)
+
+        User.objects.filter(username='user').update(is_staff=True)
+        response = self.client.get(reverse('molnet-polls-slow-queries'))
+        self.failUnlessEqual(response.status_code, 200)
+        self.failUnless(response.context['queries'])
+
+    def test_failed_query(self):
+        """ Failing statements raise their own error and are not logged. """
+
+        class FailingCursor(object):
+            def execute(self, sql, params):
+                raise ValueError(sql)
+
+        sql = 'SELECT * FROM polls_failed_query'
+        cursor = SlowQueryCursor(FailingCursor())
+        self.assertRaises(ValueError, cursor.execute, sql)
+        self.failIf([q for q in slow_queries() if q['sql'] == sql])
+
+    def test_install(self):
+        """ Once installed, the cursors of every thread log queries. """
+
+        wrapper_class = connection.__class__
+        cursor_method = wrapper_class.__dict__.get('cursor')
+        slowlog.install()
+        try:
+            cursors = []
+
+            def open_cursor():
+                cursors.append(connection.cursor())
+                connection.close()
+            thread = threading.Thread(target=open_cursor)
+            thread.start()
+            thread.join()
+            self.failUnless(isinstance(cursors[0], SlowQueryCursor))
+            self.failUnless(isinstance(connection.cursor(), SlowQueryCursor))
+        finally:
+            if cursor_method is None:
+                del wrapper_class.cursor
+            else:
+                wrapper_class.cursor = cursor_method
+            slowlog._raw_cursor = None
+
+
+class LoadTestTests(TestCase):
+    def test_percentile(self):
+        values = range(1, 101)
+        self.failUnlessEqual(percentile(values, 50), 50)
+        self.failUnlessEqual(percentile(values, 95), 95)
+        self.failUnlessEqual(percentile(values, 99), 99)
+        self.failUnlessEqual(percentile([0.3], 99), 0.3)
+        self.failUnlessEqual(percentile([], 50), 0.0)
+
+    def test_run(self):
+        """ A short run reports on every request sent. """
+
+        stats = LoadTest(num_users=3, num_threads=2, num_requests=10,
+                         num_choices=2).run()
+        self.failUnlessEqual(stats['requests'], 10)
+        self.failUnlessEqual(stats['GET_count'] + stats['POST_count'], 10)
+        self.failUnlessEqual(stats['all_count'], 10)
+        for name in ('elapsed', 'throughput', 'errors', 'lock_errors',
+                     'votes', 'write_p95', 'write_max', 'all_p50',
+                     'all_p95', 'all_p99'):
+            self.failUnless(name in stats, name)
+        self.failUnless(stats['errors'] <= stats['requests'])
+
+
+class StartupTests(TestCase):
+    def test_startup_budget(self):
+        """ The app imports and serves its first request in time, and
+        leaves slow modules for later.
+
+        """
+        result = measure(reverse('molnet-polls-startpage'))
+        for name in LAZY_MODULES:
+            self.failIf(name in result['modules'],
+                        "%s is imported at start-up" % name)
+        self.failUnless(result['import_time'] < IMPORT_BUDGET,
+                        "Import took %.2f s" % result['import_time'])
+        self.failUnlessEqual(result['status_code'], 200)
+        self.failUnless(result['first_request_time'] < FIRST_REQUEST_BUDGET,
+                        "First request took %.2f s" %
+                        result['first_request_time'])
+
+
+class QueryPlanTests(TestCase):
+    """ Make sure the manager methods are served by indexes, i.e. that
+    SQLite neither scans whole tables nor sorts rows for them.
+
+    """
+    fixtures = ['users.json',
+                'polls.json',
+                'choices.json',
+                'votes.json']
+
+    def setUp(self):
+        self.sqlite = 'sqlite3' in connection.__class__.__module__
+        if not self.sqlite:
+            return
+        # The test database may have been created by syncdb, which does
+        # not know about the composite indexes of the migrations. Only
+        # those left after the last migration are created: each migration
+        # drops its REPLACED_INDEXES, which must exist, and adds INDEXES.
+        indexes = []
+        for name in sorted(os.listdir(os.path.join(os.path.dirname(__file__),
+                                                   'migrations'))):
+            if name[0].isdigit() and name.endswith('.py'):
+                migration = __import__('molnet.polls.migrations.' + name[:-3],
+                                       {}, {}, ['Migration'])
+                for index in getattr(migration, 'REPLACED_INDEXES', []):
+                    self.failUnless(index in indexes,
+                                    "%s drops missing index %s" %
+                                    (name, index))
+                    indexes.remove(index)
+                indexes.extend(getattr(migration, 'INDEXES', []))
+        cursor = connection.cursor()
+        for i, (table, columns) in enumerate(indexes):
+            cursor.execute("CREATE INDEX IF NOT EXISTS polls_plan_test_%d "
+                           "ON %s (%s)" % (i, table, ', '.join(columns)))
+
+    def assertIndexed(self, queryset):
+        if not self.sqlite:
+            return
+        sql, params = queryset.query.as_sql()
+        cursor = connection.cursor()
+        cursor.execute("EXPLAIN QUERY PLAN " + sql, params)
+        for row in cursor.fetchall():
+            detail = row[-1]
+            self.failIf('TEMP B-TREE' in detail,
+                        "Sorting rows for %s: %s" % (sql, detail))
+            self.failIf(detail.startswith('SCAN') and 'polls_' in detail,
+                        "Full scan for %s: %s" % (sql, detail))
+
+    def test_poll_queries(self):
+        self.assertIndexed(Poll.objects.recent())
+        self.assertIndexed(Poll.objects.trending())
+        self.assertIndexed(Poll.objects.created_by_user(3))
+
+    def test_choice_queries(self):
+        self.assertIndexed(Choice.objects.get_choices_and_votes_for_poll(1))
+
+    def test_schedule_queries(self):
+        now = datetime(2010, 5, 1)
+        self.assertIndexed(Poll.objects.due_to_publish(now))
+        self.assertIndexed(Poll.objects.due_to_close(now))
+
+    def test_vote_queries(self):
+        self.assertIndexed(Vote.objects.votes_for_poll(1).order_by())
+        self.assertIndexed(Vote.objects.user_vote_for_poll(3, 1))
+        self.assertIndexed(Vote.objects.by_user(3))
+
+
+class AdminTests(TestCase):
+    fixtures = ['users.json',
+                'polls.json']
+
+    def test_cached_count(self):
+        """ Changelist counts are cached per query: the same query reuses
+        its count, a different filter is counted afresh.
+
+        """
+        admin.autodiscover()
+        queryset = admin.site._registry[Poll].queryset(None)
+        count = queryset.count()
+        self.failUnlessEqual(count, Poll.objects.count())
+
+        Poll.objects.create(user=User.objects.get(id=3),
+                            title=u"Counted?",
+                            status='DRAFT')
+        self.failUnlessEqual(queryset.count(), count)
+        self.failUnlessEqual(queryset.all().count(), count)
+        self.failUnlessEqual(queryset.filter(status='DRAFT').count(),
+                             Poll.objects.filter(status='DRAFT').count())
+        self.failIfEqual(Poll.objects.count(), count)
+        # Searches may have any characters
+        searched = queryset.filter(title__icontains=u"k\xe4")
+        self.failUnlessEqual(searched.count(), 0)
+
 
 class PollUnauthorizedTests(TestCase):
     fixtures = ['users.json',
@@ -106,6 +1182,14 @@ class PollUnauthorizedTests(TestCase):
         response = self.client.get(reverse('molnet-polls-startpage'))
         self.failUnlessEqual(response.status_code, 200)
 
+    def test_trending_unauth(self):
+        """ Check that the trending polls tab renders. """
+
+        response = self.client.get(reverse('molnet-polls-trending'))
+        self.failUnlessEqual(response.status_code, 200)
+        for poll in response.context['polls']:
+            self.failUnless(poll.is_published())
+
     def test_poll_views_unauth(self):
         """ Make sure all the views render. """
 
@@ -143,6 +1227,53 @@ class PollUnauthorizedTests(TestCase):
                              target_status_code=200)
 
 
+class EmbedTests(TestCase):
+    fixtures = ['users.json',
+                'polls.json',
+                'choices.json',
+                'votes.json']
+
+    def test_embed_is_cacheable(self):
+        """ The embedded poll is revalidated by ETag until a vote. """
+
+        url = reverse('molnet-polls-embed',
+                      kwargs={'slug': 'kittens-or-kaboodles'})
+        response = self.client.get(url)
+        self.failUnlessEqual(response.status_code, 200)
+        self.failUnless('public' in response['Cache-Control'])
+        etag = response['ETag']
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.failUnlessEqual(response.status_code, 304)
+
+        Vote.objects.create(user=User.objects.get(id=2),
+                            choice=Choice.objects.get(id=2))
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.failUnlessEqual(response.status_code, 200)
+        self.failIfEqual(response['ETag'], etag)
+
+    def test_embed_draft(self):
+        response = self.client.get(reverse('molnet-polls-embed',
+                                           kwargs={'slug': 'draft-beer'}))
+        self.failUnlessEqual(response.status_code, 404)
+
+    def test_embed_voter(self):
+        """ The visitor's own vote is served privately. """
+
+        url = reverse('molnet-polls-embed-voter',
+                      kwargs={'slug': 'kittens-or-kaboodles'})
+        response = self.client.get(url)
+        self.failUnlessEqual(simplejson.loads(response.content),
+                             {'voted_for': None})
+
+        login = self.client.login(username='user', password='password')
+        self.failUnless(login, 'Could not log in')
+        response = self.client.get(url)
+        self.failUnless('private' in response['Cache-Control'])
+        self.failUnlessEqual(simplejson.loads(response.content),
+                             {'voted_for': 1})
+
+
 class PollAuthorizedTests(TestCase):
     fixtures = ['users.json',
                 'polls.json',
@@ -186,6 +1317,51 @@ class PollAuthorizedTests(TestCase):
         self.assertEqual(response.context['user'].username, 'testclient')
 
 
+class MyVotesTests(TestCase):
+    fixtures = ['users.json',
+                'polls.json',
+                'choices.json',
+                'votes.json']
+
+    def test_votes_by_user(self):
+        """ Votes are paged by (date_modified, id), newest first. """
+
+        votes = list(Vote.objects.by_user(3))
+        self.failUnlessEqual([v.id for v in votes], [6, 1])
+        # Related rows come with the votes
+        self.failUnlessEqual(votes[0].choice.poll.id, 3)
+
+        before = (votes[0].date_modified, votes[0].id)
+        self.failUnlessEqual([v.id for v in Vote.objects.by_user(3, before)],
+                             [1])
+        self.failUnlessEqual(parse_vote_cursor(vote_cursor(votes[0])),
+                             before)
+
+        # Votes on deleted polls are left out
+        Poll.objects.get(id=3).soft_delete()
+        self.failUnlessEqual([v.id for v in Vote.objects.by_user(3)], [1])
+
+    def test_my_votes_view(self):
+        """ Make sure the votes page renders for the logged in user. """
+
+        response = self.client.get(reverse('molnet-polls-my-votes'))
+        self.failUnlessEqual(response.status_code, 302)
+
+        login = self.client.login(username='user', password='password')
+        self.failUnless(login, 'Could not log in')
+        response = self.client.get(reverse('molnet-polls-my-votes'))
+        self.failUnlessEqual(response.status_code, 200)
+        self.failUnlessEqual([v.id for v in response.context['votes']],
+                             [6, 1])
+        self.failUnlessEqual(response.context['next_cursor'], None)
+
+        for before in ('garbage', '99999999999999999999.0.1',
+                       '9' * 400 + '.0.1'):
+            response = self.client.get(reverse('molnet-polls-my-votes'),
+                                       {'before': before})
+            self.failUnlessEqual(response.status_code, 404)
+
+
 class EditPollLoggedInAsNonOwnerTests(TestCase):
     fixtures = ['users.json',
                 'polls.json',
@@ -226,6 +1402,16 @@ class EditPollLoggedInAsNonOwnerTests(TestCase):
         p = Poll.objects.get(id=2)
         self.failIfEqual(p.title, "Hello")
 
+    def test_export_poll_owned_by_other_user(self):
+        """ Only the owner of a poll may export it. """
+
+        p = Poll.objects.get(id=3)
+        response = self.client.get(reverse('molnet-polls-export',
+                                           kwargs={'slug': p.slug,
+                                                   'what': 'votes',
+                                                   'format': 'csv'}))
+        self.failUnlessEqual(response.status_code, 403)
+
 
 class EditPollTests(TestCase):
     fixtures = ['users.json',
@@ -268,6 +1454,49 @@ class EditPollTests(TestCase):
         p = Poll.objects.get(id=1)
         self.failUnlessEqual(p.title, "Hello")
 
+    def test_export_poll(self):
+        """ Export results and votes of own poll. """
+
+        p = Poll.objects.get(id=1)
+        kwargs = {'slug': p.slug, 'what': 'votes', 'format': 'csv'}
+        response = self.client.get(reverse('molnet-polls-export',
+                                           kwargs=kwargs))
+        self.failUnlessEqual(response.status_code, 200)
+        self.failUnless(response['Content-Type'].startswith('text/csv'))
+        lines = response.content.splitlines()
+        # Header and one line per vote
+        self.failUnlessEqual(len(lines), 4)
+
+        kwargs.update({'what': 'results', 'format': 'xlsx'})
+        response = self.client.get(reverse('molnet-polls-export',
+                                           kwargs=kwargs))
+        self.failUnlessEqual(response.status_code, 200)
+        archive = zipfile.ZipFile(StringIO(response.content))
+        self.failIf(archive.testzip())
+        sheet = archive.read('xl/worksheets/sheet1.xml')
+        rows = [re.findall('<[tv]>(.*?)</[tv]>', row)
+                for row in re.findall('<row>(.*?)</row>', sheet)]
+        self.failUnlessEqual(rows[0], ['choice', 'votes'])
+        self.failUnlessEqual(sorted(rows[1:]),
+                             [["I can't decide, I like both!", '1'],
+                              ['Kaboodles!', '0'],
+                              ['Kittens!', '2']])
+
+    def test_export_archived_votes(self):
+        """ Archived votes are exported along with live ones. """
+
+        p = Poll.objects.get(id=3)
+        p.closed_at = datetime(2010, 4, 19)
+        p.save()
+        VoteArchive.objects.archive_poll(p)
+        Poll.objects.filter(id=3).update(user=3)
+        kwargs = {'slug': p.slug, 'what': 'votes', 'format': 'csv'}
+        response = self.client.get(reverse('molnet-polls-export',
+                                           kwargs=kwargs))
+        self.failUnlessEqual(response.status_code, 200)
+        # Header and one line per vote
+        self.failUnlessEqual(len(response.content.splitlines()), 4)
+
     def test_delete_poll_by_form(self):
         """ Delete own poll. """
 
@@ -276,12 +1505,31 @@ class EditPollTests(TestCase):
         self.failUnless(choices)
         votes = Vote.objects.filter(choice__in=choices)
         self.failUnless(votes)
+        for token in ('a' * 32, 'b' * 32):
+            AnonymousVote.objects.cast(Choice.objects.get(id=2), token)
 
         response = self.client.post(reverse('molnet-polls-edit-poll',
                                             kwargs={'slug': p.slug}),
                                     {'delete': "Delete"})
         self.assertRedirects(response, reverse('molnet-polls-startpage'))
+
+        # The poll should disappear from listings at once...
+        self.assertRaises(ObjectDoesNotExist, Poll.objects.live().get, id=p.id)
+        self.failIf(Poll.objects.recent().filter(id=p.id))
+        p_at = p.published_at
+        response = self.client.get(reverse('molnet-polls-show-poll',
+                                           kwargs={'year': p_at.year,
+                                                   'month': p_at.month,
+                                                   'day': p_at.day,
+                                                   'slug': p.slug}))
+        self.failUnlessEqual(response.status_code, 404)
+
+        # ...while it and its votes are removed by the purge job
+        polls, purged_votes = Poll.objects.purge_deleted(chunk_size=1)
+        self.failUnlessEqual(polls, 1)
+        self.failUnlessEqual(purged_votes, 5)
         self.assertRaises(ObjectDoesNotExist, Poll.objects.get, id=p.id)
+        self.failIf(AnonymousVote.objects.filter(poll=p.id))
 
         # Verify that choices have been cascade deleted
         choices_post = Choice.objects.filter(poll=p.id) \
@@ -407,6 +1655,69 @@ class EditPollTests(TestCase):
         c = Choice.objects.filter(poll=p.id).filter(choice=new_choice)
         self.failUnless(c)
 
+    def test_bulk_edit_choices_by_form(self):
+        """ Reorder, add and delete choices of own poll at once. """
+
+        p = Poll.objects.get(id=1)
+        response = self.client.post(reverse('molnet-polls-edit-poll',
+                                            kwargs={'slug': p.slug}),
+                                    {'save-choices': "Save choices",
+                                     'bulk-choices': "Kaboodles!\n"
+                                                     "  New choice \n"
+                                                     "\n"
+                                                     "Kittens!"})
+        self.assertRedirects(response,
+                             reverse('molnet-polls-edit-poll',
+                                     kwargs={'slug': p.slug}))
+        choices = Choice.objects.get_choices_and_votes_for_poll(p.id)
+        self.failUnlessEqual([c.choice for c in choices],
+                             [u"Kaboodles!", u"New choice", u"Kittens!"])
+        self.failUnlessEqual([c.num_votes for c in choices], [0, 0, 2])
+
+        # Add a choice the usual way, it should end up last
+        self.client.post(reverse('molnet-polls-edit-poll',
+                                 kwargs={'slug': p.slug}),
+                         {'choice': "Add choice",
+                          'choice-choice': "Last"})
+        choices = Choice.objects.get_choices_and_votes_for_poll(p.id)
+        self.failUnlessEqual(choices[3].choice, u"Last")
+
+    def test_add_duplicate_choice_by_form(self):
+        """ A choice differing only in case from another is refused. """
+
+        p = Poll.objects.get(id=1)
+        response = self.client.post(reverse('molnet-polls-edit-poll',
+                                            kwargs={'slug': p.slug}),
+                                    {'choice': "Add choice",
+                                     'choice-choice': " KITTENS! "})
+        self.failUnlessEqual(response.status_code, 200)
+        self.failUnless(response.context['choice_form'].errors)
+        self.failUnlessEqual(Choice.objects.filter(poll=p).count(), 3)
+
+    def test_bulk_respell_choices_by_form(self):
+        """ Respelling a choice keeps it and its votes. """
+
+        p = Poll.objects.get(id=1)
+        self.client.post(reverse('molnet-polls-edit-poll',
+                                 kwargs={'slug': p.slug}),
+                         {'save-choices': "Save choices",
+                          'bulk-choices': "kittens!\nKaboodles!"})
+        choices = Choice.objects.get_choices_and_votes_for_poll(p.id)
+        self.failUnlessEqual([(c.id, c.choice, c.num_votes) for c in choices],
+                             [(1, u"kittens!", 2), (2, u"Kaboodles!", 0)])
+
+    def test_bulk_edit_duplicate_choices_by_form(self):
+        """ The same choice can not be entered twice. """
+
+        p = Poll.objects.get(id=1)
+        response = self.client.post(reverse('molnet-polls-edit-poll',
+                                            kwargs={'slug': p.slug}),
+                                    {'save-choices': "Save choices",
+                                     'bulk-choices': "Yes\nNo\nYes"})
+        self.failUnlessEqual(response.status_code, 200)
+        self.failUnless(response.context['bulk_choice_form'].errors)
+        self.failUnlessEqual(Choice.objects.live().filter(poll=p).count(), 3)
+
     def test_delete_choice_by_form(self):
         """ Delete a choice from own poll. """
 
@@ -426,7 +1737,15 @@ class EditPollTests(TestCase):
         self.assertRedirects(response, reverse('molnet-polls-edit-poll',
                                                kwargs={'slug': poll.slug}))
 
-        # Verify choice has been deleted
+        # Verify choice has been hidden
+        self.assertRaises(ObjectDoesNotExist, Choice.objects.live().get,
+                          id=choice.id)
+        choices = Choice.objects.get_choices_and_votes_for_poll(poll.id)
+        self.failIf(choice.id in [c.id for c in choices])
+
+        # Verify choice has been deleted by the purge job
+        choices, purged_votes = Choice.objects.purge_deleted()
+        self.failUnlessEqual(choices, 1)
         self.assertRaises(ObjectDoesNotExist, Choice.objects.get, id=choice.id)
 
         # All votes linked to the original choices should have been
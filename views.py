@@ -1,22 +1,48 @@
 # -*- coding: utf-8 -*-
 import datetime
+import os
+import re
 
 from django.conf import settings
-from django.contrib.auth.decorators import login_required
-from django.contrib.auth.models import User
-from django.core.cache import cache
+from django.contrib.auth.decorators import login_required, user_passes_test
 from django.core.exceptions import PermissionDenied
 from django.core.urlresolvers import reverse
-from django.db.models import Count, Q
+from django.db.models import Q, Sum
 from django.http import (HttpResponse, HttpResponseNotFound, Http404,
-                         HttpResponseRedirect, HttpResponseForbidden)
-from django.shortcuts import (get_object_or_404, get_list_or_404,
-                              render_to_response)
+                         HttpResponseRedirect)
+from django.shortcuts import get_object_or_404
 from django.template import Context, RequestContext, loader
-from django.utils.translation import ugettext_lazy as _
+from django.utils import simplejson
+from django.utils.hashcompat import md5_constructor
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition
 
-from forms import ChoiceForm, PollForm, PollVotingForm
-from models import Choice, Poll, Vote
+from caching import poll_key
+from models import (AnonymousVote, Choice, CreatorStats, DailyStats, Poll,
+                    Vote, VoteArchive, vote_position)
+from packing import from_timestamp, to_timestamp
+from slowlog import SLOW_QUERY_THRESHOLD, slow_queries
+from tenancy import get_current_tenant
+
+TRENDING_POLLS = 20
+VOTES_PER_PAGE = 25
+# Number of answered polls in the sidebar
+SIDEBAR_ANSWERED_POLLS = 10
+# Days covered by the statistics page, and number of top poll creators
+STATS_DAYS = 30
+STATS_CREATORS = 10
+# Upper limit on the number of polls in one results request
+MAX_RESULTS_POLLS = 50
+# Polls with more choices than this only show the most voted for ones,
+# the rest are fetched on demand a page at a time
+TOP_CHOICES = getattr(settings, 'POLLS_TOP_CHOICES', 20)
+CHOICES_PER_PAGE = 50
+# Seconds that shared caches may serve an embedded poll without asking
+EMBED_MAX_AGE = getattr(settings, 'POLLS_EMBED_MAX_AGE', 60)
+# Cookie with the token that anonymous votes are tied to
+VOTER_COOKIE = getattr(settings, 'POLLS_VOTER_COOKIE', 'polls_voter')
+VOTER_COOKIE_MAX_AGE = 365 * 24 * 3600
+VOTER_TOKEN_RE = re.compile(r'^[0-9a-f]{32}$')
 
 
 def get_sidebar_polls(user):
@@ -25,7 +51,8 @@ def get_sidebar_polls(user):
 
     if user.is_authenticated():
         created_by_user = Poll.objects.created_by_user(user.id)
-        answered_by_user = Poll.objects.answered_by_user(user.id)
+        answered_by_user = Poll.objects.answered_by_user(
+            user.id, SIDEBAR_ANSWERED_POLLS)
 
     sidebar_polls = {'created_by_user': created_by_user,
                      'answered_by_user': answered_by_user,
@@ -38,6 +65,93 @@ def get_form_choices(choices):
         form_choices.append((str(choice.id), choice.choice))
     return form_choices
 
+def get_shown_choices(poll):
+    """ Returns the choices of a poll to show, with their votes, the
+    number of choices left out (see `TOP_CHOICES`), and the generation
+    of the ranking to page through them at, or None.
+
+    """
+    if not TOP_CHOICES:
+        return (Choice.objects.get_choices_and_votes_for_poll(poll.id), 0,
+                None)
+    return Choice.objects.top_for_poll(poll.id, TOP_CHOICES)
+
+def get_voting_choices(poll, choices, voted_for_choice_id):
+    """ Form choices of the choices shown, and of the choice voted for
+    if it is not one of them.
+
+    """
+    form_choices = get_form_choices(choices)
+    if voted_for_choice_id and \
+       str(voted_for_choice_id) not in dict(form_choices):
+        try:
+            choice = Choice.objects.live().get(id=voted_for_choice_id,
+                                               poll=poll.id)
+            form_choices.append((str(choice.id), choice.choice))
+        except Choice.DoesNotExist:
+            pass
+    return form_choices
+
+def get_all_form_choices(poll):
+    """ Form choices of all live choices of a poll, for validating
+    votes on choices that were fetched on demand.
+
+    """
+    return get_form_choices(Choice.objects.live().filter(poll=poll.id))
+
+def get_voter_token(request):
+    """ The anonymous voter token of the visitor, or None. """
+
+    token = request.COOKIES.get(VOTER_COOKIE, '')
+    if VOTER_TOKEN_RE.match(token):
+        return token
+    return None
+
+def anonymous_vote(request, poll, choices, other_choices, generation):
+    """ Voting by a visitor who is not logged in, in a poll open to
+    anonymous votes. Returns the voting form, the id of the choice voted
+    for or None, the choices shown, the number left out and the
+    generation of their ranking, and a new voter token to be set as a
+    cookie or None.
+
+    """
+    from forms import PollVotingForm
+
+    token = get_voter_token(request)
+    new_token = None
+    voted_for_choice_id = None
+    if token:
+        voted_for_choice_id = AnonymousVote.objects.vote_for_token(poll.id,
+                                                                   token)
+
+    # New choices need a user to be added by
+    if request.method == 'POST':
+        form = PollVotingForm(request.POST,
+                              choices=get_all_form_choices(poll),
+                              allow_new_choices=False)
+        if not form.is_valid():
+            return (form, voted_for_choice_id, choices, other_choices,
+                    generation, new_token)
+        choice = get_object_or_404(Choice.objects.live(),
+                                   id=form.cleaned_data['choices'],
+                                   poll=poll.id)
+        if not token:
+            token = new_token = os.urandom(16).encode('hex')
+        AnonymousVote.objects.cast(choice, token)
+        voted_for_choice_id = choice.id
+        choices, other_choices, generation = get_shown_choices(poll)
+
+    initial = {}
+    if voted_for_choice_id:
+        initial = {'choices': str(voted_for_choice_id)}
+    form = PollVotingForm(choices=get_voting_choices(poll,
+                                                     choices,
+                                                     voted_for_choice_id),
+                          allow_new_choices=False,
+                          initial=initial)
+    return (form, voted_for_choice_id, choices, other_choices, generation,
+            new_token)
+
 def startpage(request):
     """ Start page. """
 
@@ -45,38 +159,262 @@ def startpage(request):
 
     t = loader.get_template('polls-index.html')
     c = RequestContext(request,
-                       {'sidebar_polls': sidebar_polls,
+                       {'polls': sidebar_polls['recent'],
+                        'sidebar_polls': sidebar_polls,
                         'navigation': 'polls',
                         'navigation2': 'polls-all',})
     return HttpResponse(t.render(c))
 
+def trending(request):
+    """ Start page, listing the most popular polls right now. """
+
+    sidebar_polls = get_sidebar_polls(request.user)
+    polls = Poll.objects.trending()[:TRENDING_POLLS]
+
+    t = loader.get_template('polls-index.html')
+    c = RequestContext(request,
+                       {'polls': polls,
+                        'sidebar_polls': sidebar_polls,
+                        'navigation': 'polls',
+                        'navigation2': 'polls-trending',})
+    return HttpResponse(t.render(c))
+
+def vote_cursor(vote):
+    """ Position of a vote in the keyset pagination of `my_votes`, see
+    `vote_position`.
+
+    """
+    date_modified, voteid = vote_position(vote)
+    return '%d.%d.%d' % (to_timestamp(date_modified),
+                         date_modified.microsecond,
+                         voteid)
+
+def parse_vote_cursor(cursor):
+    seconds, microseconds, voteid = [int(part) for part in cursor.split('.')]
+    date_modified = from_timestamp(seconds).replace(microsecond=microseconds)
+    return date_modified, voteid
+
+@login_required
+def my_votes(request):
+    """ The votes of the logged in user, archived ones included, a page
+    at a time. Pages are chained by the position of their last vote
+    (`?before=`) rather than numbered, so that every page is a single
+    indexed query, plus a look into the user's archive, no matter how far
+    back it is.
+
+    """
+    before = request.GET.get('before')
+    if before:
+        try:
+            before = parse_vote_cursor(before)
+        except (ValueError, OverflowError):
+            raise Http404
+    else:
+        before = None
+
+    # One extra vote tells whether there is a next page
+    votes = Vote.objects.history(request.user.id, VOTES_PER_PAGE + 1, before)
+    next_cursor = None
+    if len(votes) > VOTES_PER_PAGE:
+        votes = votes[:VOTES_PER_PAGE]
+        next_cursor = vote_cursor(votes[-1])
+
+    t = loader.get_template('polls-my-votes.html')
+    c = RequestContext(request,
+                       {'votes': votes,
+                        'next_cursor': next_cursor,
+                        'sidebar_polls': get_sidebar_polls(request.user),
+                        'navigation': 'polls',
+                        'navigation2': 'polls-my-votes',})
+    return HttpResponse(t.render(c))
+
+def results_json(request):
+    """ Tallies of several polls as JSON.
+
+    Polls are given by id (`poll`) and/or by slug (`slug`), each of which
+    may be repeated, e.g. `?poll=1&poll=2&slug=lunch`.
+
+    """
+    ids = []
+    for pollid in request.GET.getlist('poll'):
+        try:
+            ids.append(int(pollid))
+        except ValueError:
+            return HttpResponseNotFound()
+    slugs = request.GET.getlist('slug')
+    polls = list(Poll.objects.recent()
+                             .filter(Q(id__in=ids) | Q(slug__in=slugs))
+                             .values('id', 'slug', 'title')
+                             [:MAX_RESULTS_POLLS])
+    tallies = Choice.objects.tallies_for_polls([p['id'] for p in polls])
+
+    results = []
+    for poll in polls:
+        choices = [{'id': choiceid, 'choice': choice, 'votes': votes}
+                   for choiceid, choice, votes in tallies[poll['id']]]
+        poll['number_of_votes'] = sum([c['votes'] for c in choices])
+        poll['choices'] = choices
+        results.append(poll)
+    return HttpResponse(simplejson.dumps({'polls': results}),
+                        mimetype='application/json')
+
+def choices_json(request, slug):
+    """ Choices of a poll with their votes as JSON, most voted for
+    first, `CHOICES_PER_PAGE` at a time from `offset`. Used to fetch the
+    choices left out of polls with many choices (see `TOP_CHOICES`).
+
+    Pages are read from the poll's ranking at a `generation` (see
+    `ChoiceManager.ranking`): the current one for the first page, and
+    the same one for the pages after it, so that votes cast meanwhile
+    do not move choices between pages.
+
+    """
+    poll = get_object_or_404(Poll.objects.live(), slug=slug)
+    try:
+        offset = int(request.GET.get('offset', 0))
+        generation = request.GET.get('generation')
+        if generation is not None:
+            generation = int(generation)
+    except ValueError:
+        raise Http404
+    if offset < 0:
+        raise Http404
+    ranking, generation = Choice.objects.ranking(poll.id, generation)
+    rows = ranking[offset:offset + CHOICES_PER_PAGE]
+    texts = dict(Choice.objects.live()
+                               .filter(id__in=[id for id, votes in rows])
+                               .values_list('id', 'choice'))
+    next_url = None
+    if len(ranking) > offset + CHOICES_PER_PAGE:
+        next_url = '%s?generation=%d&offset=%d' % (
+            reverse('molnet-polls-choices-json', args=[poll.slug]),
+            generation,
+            offset + CHOICES_PER_PAGE)
+    # Choices deleted since the ranking was counted are left out
+    choices = [{'id': id,
+                'choice': texts[id],
+                'votes': votes} for id, votes in rows if id in texts]
+    return HttpResponse(simplejson.dumps({'choices': choices,
+                                          'next': next_url}),
+                        mimetype='application/json')
+
+def embed_etag(request, slug):
+    """ Changes with the generation of the poll (see caching.py). """
+
+    try:
+        pollid = Poll.objects.recent() \
+                             .values_list('id', flat=True) \
+                             .get(slug=slug)
+    except Poll.DoesNotExist:
+        return None
+    return md5_constructor(poll_key('embed', pollid)).hexdigest()
+
+@cache_control(public=True, max_age=EMBED_MAX_AGE)
+@condition(etag_func=embed_etag)
+def embed_poll(request, slug):
+    """ A minimal page showing a poll and its results, for embedding in
+    other pages through an iframe.
+
+    The page is the same for every visitor so that it can be kept in
+    shared caches. Whether the visitor has voted, and for what, is
+    fetched separately from `embed_poll_voter`.
+
+    """
+    poll = get_object_or_404(Poll.objects.recent(), slug=slug)
+    choices = [{'id': choiceid, 'choice': choice, 'num_votes': votes}
+               for choiceid, choice, votes in
+               Choice.objects.tallies_for_polls([poll.id])[poll.id]]
+    p_at = poll.published_at
+    poll_url = reverse('molnet-polls-show-poll',
+                       kwargs={'year': p_at.year,
+                               'month': p_at.month,
+                               'day': p_at.day,
+                               'slug': poll.slug})
+
+    # Not a RequestContext, which would make the page vary by user
+    t = loader.get_template('polls-embed.html')
+    c = Context({'poll': poll,
+                 'poll_url': poll_url,
+                 'choices': choices,
+                 'number_of_votes': sum([c['num_votes'] for c in choices])})
+    return HttpResponse(t.render(c))
+
+@cache_control(private=True, must_revalidate=True, max_age=0)
+def embed_poll_voter(request, slug):
+    """ The id of the choice the visitor voted for in an embedded poll,
+    as JSON.
+
+    """
+    poll = get_object_or_404(Poll.objects.recent(), slug=slug)
+    voted_for_choice_id = None
+    token = get_voter_token(request)
+    if request.user.is_authenticated():
+        if Vote.objects.might_have_voted(poll.id, request.user.id):
+            try:
+                voted_for_choice_id = Vote.objects \
+                    .user_vote_for_poll(request.user.id, poll.id) \
+                    .values_list('choice', flat=True).get()
+            except Vote.DoesNotExist:
+                voted_for_choice_id = poll.archived_vote(request.user.id)
+    elif poll.allow_anonymous_votes and token:
+        voted_for_choice_id = AnonymousVote.objects.vote_for_token(poll.id,
+                                                                   token)
+    return HttpResponse(simplejson.dumps({'voted_for': voted_for_choice_id}),
+                        mimetype='application/json')
+
 def show_poll(request, year, month, day, slug):
+    # Forms are imported on first use, see `feed`
+    from forms import PollVotingForm
+
     form = None
-    poll = get_object_or_404(Poll, slug=slug)
-    choices = Choice.objects.get_choices_and_votes_for_poll(poll.id)
+    poll = get_object_or_404(Poll.objects.live(), slug=slug)
+    choices, other_choices, choices_generation = get_shown_choices(poll)
 
     show_results = False
     if 'show-results' in request.GET or poll.status == "CLOSED":
         show_results = True
 
+    new_voter_token = None
     if not request.user.is_authenticated():
         voted_for_choice_id = None
+        if poll.allow_anonymous_votes and poll.status == 'PUBLISHED':
+            form, voted_for_choice_id, choices, other_choices, \
+                choices_generation, new_voter_token = anonymous_vote(
+                    request, poll, choices, other_choices,
+                    choices_generation)
+            if voted_for_choice_id:
+                show_results = True
     else:
         # Only show form if authenticated
-        try:
-            vote = Vote.objects.get(Q(user=request.user.id)&
-                                    Q(choice__poll=poll.id))
-            voted_for_choice_id = vote.choice.id
+        vote = None
+        voted_for_choice_id = None
+        # Most visitors have not voted, which the poll's Bloom filter
+        # tells without asking the database. As the filter may lag
+        # behind, always ask the database before voting though.
+        if request.method == 'POST' or \
+           Vote.objects.might_have_voted(poll.id, request.user.id):
+            try:
+                vote = Vote.objects.user_vote_for_poll(request.user.id,
+                                                       poll.id).get()
+                voted_for_choice_id = vote.choice.id
+            except Vote.DoesNotExist:
+                voted_for_choice_id = poll.archived_vote(request.user.id)
+                if not voted_for_choice_id and request.method != 'POST':
+                    Vote.objects.record_filter_miss()
+        if voted_for_choice_id:
             show_results = True
-        except Vote.DoesNotExist:
-            voted_for_choice_id = None
 
-        form_choices = get_form_choices(choices)
         if request.method == 'POST':
             form = PollVotingForm(request.POST,
-                                  choices=form_choices,
+                                  choices=get_all_form_choices(poll),
                                   allow_new_choices=poll.allow_new_choices)
             if form.is_valid():
+                if voted_for_choice_id and not vote:
+                    # Bring back the vote from the archive to change it
+                    vote = VoteArchive.objects.restore_vote(poll,
+                                                            request.user)
+                    if not vote:
+                        voted_for_choice_id = None
                 if poll.allow_new_choices:
                     choice_id, choice_text = form.cleaned_data['choices']
                 else:
@@ -85,9 +423,7 @@ def show_poll(request, year, month, day, slug):
                 if choice_id == 'OTHER':
                     # Check for duplicates
                     choice, created = Choice.objects \
-                        .get_or_create(poll=poll,
-                                       choice=choice_text,
-                                       defaults={'user': request.user})
+                        .get_or_restore(poll, choice_text, request.user)
                     # Voted already?
                     if voted_for_choice_id:
                         # Yes, change vote
@@ -98,7 +434,7 @@ def show_poll(request, year, month, day, slug):
                         Vote.objects.create(user=request.user, choice=choice)
                 else:
                     # Check that the choice is valid for this poll
-                    choice = get_object_or_404(Choice,
+                    choice = get_object_or_404(Choice.objects.live(),
                                                id=choice_id,
                                                poll=poll.id)
                     # Voted already?
@@ -111,8 +447,11 @@ def show_poll(request, year, month, day, slug):
                         Vote.objects.create(user=request.user, choice=choice)
 
                 voted_for_choice_id = choice.id
-                choices = Choice.objects.get_choices_and_votes_for_poll(poll.id)
-                form_choices = get_form_choices(choices)
+                choices, other_choices, choices_generation = \
+                    get_shown_choices(poll)
+                form_choices = get_voting_choices(poll,
+                                                  choices,
+                                                  voted_for_choice_id)
                 if poll.allow_new_choices:
                     poll_form_defaults = {'choices': (str(voted_for_choice_id),
                                                       '')}
@@ -123,6 +462,9 @@ def show_poll(request, year, month, day, slug):
                                       initial=poll_form_defaults)
         else:
             # Form not submitted
+            form_choices = get_voting_choices(poll,
+                                              choices,
+                                              voted_for_choice_id)
             if voted_for_choice_id:
                 if poll.allow_new_choices:
                     poll_form_defaults = {'choices': (str(voted_for_choice_id),
@@ -136,7 +478,8 @@ def show_poll(request, year, month, day, slug):
                 form = PollVotingForm(choices=form_choices,
                                       allow_new_choices=poll.allow_new_choices)
 
-    number_of_votes = Vote.objects.votes_for_poll(poll.id).count()
+    number_of_votes = poll.number_of_votes()
+    other_votes = number_of_votes - sum([c.num_votes for c in choices])
     related_polls = None
     sidebar_polls = get_sidebar_polls(request.user)
 
@@ -144,16 +487,25 @@ def show_poll(request, year, month, day, slug):
     c = RequestContext(request,
                        {'poll': poll,
                         'choices': choices,
+                        'other_choices': other_choices,
+                        'choices_generation': choices_generation,
+                        'other_votes': other_votes,
                         'form': form,
                         'vote_id': voted_for_choice_id,
                         'number_of_votes': number_of_votes,
                         'related_polls': related_polls,
                         'sidebar_polls': sidebar_polls,
                         'show_results': show_results})
-    return HttpResponse(t.render(c))
+    response = HttpResponse(t.render(c))
+    if new_voter_token:
+        response.set_cookie(VOTER_COOKIE, new_voter_token,
+                            max_age=VOTER_COOKIE_MAX_AGE)
+    return response
 
 @login_required
 def create_poll(request):
+    from forms import PollForm
+
     if request.method == 'POST':
         form = PollForm(request, request.POST)
         if form.is_valid():
@@ -175,7 +527,9 @@ def create_poll(request):
 
 @login_required
 def edit_poll(request, slug):
-    poll = get_object_or_404(Poll, slug=slug)
+    from forms import BulkChoiceForm, ChoiceForm, PollForm
+
+    poll = get_object_or_404(Poll.objects.live(), slug=slug)
 
     if request.user != poll.user:
         raise PermissionDenied("You must own a poll in order to edit it.")
@@ -184,6 +538,7 @@ def edit_poll(request, slug):
 
     poll_form = PollForm(request, instance=poll, prefix='poll')
     choice_form = ChoiceForm(request, poll, prefix='choice')
+    bulk_choice_form = BulkChoiceForm(poll, prefix='bulk')
 
     if request.method == 'POST':
         if 'poll' in request.POST:
@@ -203,43 +558,65 @@ def edit_poll(request, slug):
                                      prefix='choice')
             if choice_form.is_valid():
                 choice, created = Choice.objects \
-                    .get_or_create(poll=poll,
-                                   choice=choice_form.cleaned_data['choice'],
-                                   defaults={'user': request.user})
+                    .get_or_restore(poll,
+                                    choice_form.cleaned_data['choice'],
+                                    request.user)
+                return HttpResponseRedirect(reverse('molnet-polls-edit-poll',
+                                                    kwargs={'slug':
+                                                            poll.slug}))
+        elif 'save-choices' in request.POST:
+            bulk_choice_form = BulkChoiceForm(poll,
+                                              request.POST,
+                                              prefix='bulk')
+            if bulk_choice_form.is_valid():
+                Choice.objects.replace_choices(
+                    poll,
+                    request.user,
+                    bulk_choice_form.cleaned_data['choices'])
                 return HttpResponseRedirect(reverse('molnet-polls-edit-poll',
                                                     kwargs={'slug':
                                                             poll.slug}))
         elif 'delete-choice' in request.POST and 'choice-id' in request.POST:
+            # Votes are removed later by the purge_deleted_polls command
             try:
-                choice = Choice.objects.get(id=request.POST['choice-id'],
-                                            poll=poll) \
-                                       .delete()
+                choice = Choice.objects.live() \
+                                       .get(id=request.POST['choice-id'],
+                                            poll=poll)
+                choice.soft_delete()
                 return HttpResponseRedirect(reverse('molnet-polls-edit-poll',
                                             kwargs={'slug': poll.slug}))
-            except Choice.DoesNotExist:
+            except (Choice.DoesNotExist, ValueError):
                 raise Http404
         elif 'delete' in request.POST:
-            poll.delete()
+            # Votes are removed later by the purge_deleted_polls command
+            poll.soft_delete()
             return HttpResponseRedirect(reverse('molnet-polls-startpage'))
         elif 'close' in request.POST:
             poll.status="CLOSED"
+            poll.closed_at = datetime.datetime.now()
+            poll.close_at = None
             poll.save()
             return HttpResponseRedirect(reverse('molnet-polls-edit-poll',
                                                 kwargs={'slug': poll.slug}))
         elif 're-open' in request.POST:
             poll.status="PUBLISHED"
+            poll.closed_at = None
             poll.save()
             return HttpResponseRedirect(reverse('molnet-polls-edit-poll',
                                                 kwargs={'slug': poll.slug}))
         elif 'unpublish' in request.POST:
             poll.status="DRAFT"
+            poll.closed_at = None
             poll.save()
             return HttpResponseRedirect(reverse('molnet-polls-edit-poll',
                                                 kwargs={'slug': poll.slug}))
         elif 'publish' in request.POST:
             poll.status="PUBLISHED"
             poll.published_at = datetime.datetime.now()
+            poll.publish_at = None
             poll.save()
+            # Give new polls a chance to show up among trending polls
+            Poll.objects.register_activity(poll.id, poll.published_at)
             return HttpResponseRedirect(reverse('molnet-polls-edit-poll',
                                                 kwargs={'slug': poll.slug}))
         else:
@@ -253,7 +630,115 @@ def edit_poll(request, slug):
                        {'poll': poll,
                         'choices': choices,
                         'choice_form': choice_form,
+                        'bulk_choice_form': bulk_choice_form,
                         'poll_form': poll_form,
                         'related_polls': related_polls,
                         'sidebar_polls': sidebar_polls})
     return HttpResponse(t.render(c))
+
+def feed(request, url):
+    """ The feeds (see feeds.py).
+
+    The syndication framework and the forms are slow to import, so they
+    are imported on first use instead of when the URLs are loaded, which
+    keeps the start-up time of worker processes down.
+
+    """
+    from django.contrib.syndication.views import feed
+    from feeds import FEEDS
+
+    return feed(request, url, FEEDS)
+
+def user_feed(request, username):
+    """ The feed of a user's polls. """
+
+    return feed(request, 'user/%s' % username)
+
+@login_required
+def answered_feed(request):
+    """ Redirects to the feed of the polls the user has answered, whose
+    URL is kept secret (see `AnsweredPolls`).
+
+    """
+    from feeds import answered_feed_token
+
+    url = 'answered/%s/%s' % (request.user.username,
+                              answered_feed_token(request.user))
+    return HttpResponseRedirect(reverse('molnet-polls-feed',
+                                        kwargs={'url': url}))
+
+@login_required
+def export_poll(request, slug, what, format):
+    """ Results or raw votes of a poll as a CSV or XLSX file, for the
+    owner of the poll. The file is streamed while it is being written.
+
+    """
+    from export import (RESULTS_HEADER, VOTES_HEADER, buffered, csv_stream,
+                        for_tenant, result_rows, vote_rows, xlsx_stream)
+
+    poll = get_object_or_404(Poll.objects.live(), slug=slug)
+    if request.user != poll.user:
+        raise PermissionDenied("You must own a poll in order to export it.")
+
+    if what == 'results':
+        header, rows = RESULTS_HEADER, result_rows(poll)
+    else:
+        header, rows = VOTES_HEADER, vote_rows(poll)
+    if format == 'csv':
+        content = buffered(csv_stream(header, rows))
+        mimetype = 'text/csv; charset=utf-8'
+    else:
+        content = xlsx_stream(header, rows, what.capitalize())
+        mimetype = 'application/vnd.openxmlformats-officedocument.' \
+                   'spreadsheetml.sheet'
+    response = HttpResponse(for_tenant(get_current_tenant(), content),
+                            mimetype=mimetype)
+    response['Content-Disposition'] = 'attachment; filename=%s-%s.%s' % \
+                                      (poll.slug, what, format)
+    return response
+
+@user_passes_test(lambda u: u.is_staff)
+def stats(request):
+    """ Site-wide statistics of the last `STATS_DAYS` days. Everything
+    is read from the summary tables kept by `DailyStatsManager.refresh`,
+    never from the polls and votes themselves.
+
+    """
+    end = datetime.date.today()
+    start = end - datetime.timedelta(days=STATS_DAYS - 1)
+    week = end - datetime.timedelta(days=6)
+    days = list(DailyStats.objects.filter(date__gte=start, date__lte=end))
+    creators = CreatorStats.objects.filter(date__gte=start, date__lte=end) \
+                                   .values('user__username') \
+                                   .annotate(polls=Sum('polls_created')) \
+                                   .order_by('-polls')[:STATS_CREATORS]
+
+    t = loader.get_template('polls-stats.html')
+    c = RequestContext(request,
+                       {'days': days,
+                        'start': start,
+                        'end': end,
+                        'polls_created': sum([d.polls_created for d in days]),
+                        'votes_cast': sum([d.votes_cast for d in days]),
+                        'voters': DailyStats.objects.voters_between(start,
+                                                                    end),
+                        'weekly_voters':
+                            DailyStats.objects.voters_between(week, end),
+                        'creators': creators,
+                        'navigation': 'polls',
+                        'navigation2': 'polls-stats',})
+    return HttpResponse(t.render(c))
+
+@user_passes_test(lambda u: u.is_staff)
+def slow_query_log(request):
+    """ The queries logged as slow, with their query plans (see
+    slowlog.py).
+
+    """
+    t = loader.get_template('polls-slow-queries.html')
+    c = RequestContext(request,
+                       {'queries': slow_queries(),
+                        'enabled': SLOW_QUERY_THRESHOLD is not None,
+                        'navigation': 'polls',
+                        'navigation2': 'polls-slow-queries',})
+    return HttpResponse(t.render(c))